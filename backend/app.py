@@ -1,15 +1,49 @@
 # app.py
 
-from flask import Flask, redirect, url_for, jsonify, request, g, session
-from sqlalchemy import case, asc
+from flask import Flask, Response, redirect, url_for, jsonify, request, g, session, stream_with_context
+from sqlalchemy import case, asc, and_, or_, tuple_, literal, update, delete, insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import aliased
 from flask_debugtoolbar import DebugToolbarExtension
 from authlib.integrations.flask_client import OAuth
-from models import db, connect_db, User, Group, GroupMembership, Shift, Shift_swap, Notification_messages
+from migrations import ensure_shift_exclusion_constraint
+from models import db, connect_db, User, Group, GroupMembership, Shift, Shift_swap, Shift_recurrence, Notification_messages, Calendar_feed, format_rrule
 from auth_decorator import login_required
+from token_cache import token_cache, PROVIDERS
+from hashing import create_password_hasher, HashingOverloaded, HashingRateLimited
+from pagination import encode_cursor, decode_cursor, parse_limit, escape_like
+from unread_counter import get_unread_count, unread_count_subquery, reconcile_unread_counters
+import notification_stream
+from notification_stream import init_notification_stream, notification_event, publish_notifications
+from scheduling import (
+    parse_iso, merge_overlapping_shifts, shift_range, sweep_batch_overlaps,
+    assigned_shifts_by_user, sweep_conflicts, conflict_clusters, merge_conflict_clusters
+)
+from schedule_index import schedule_indexes
+from serializers import (
+    GROUP_FIELDS, NOTIFICATION_FIELDS, SHIFT_FIELDS, MEMBERSHIP_REQUEST_FIELDS, RECURRING_SHIFT_FIELDS,
+    RECURRENCE_RULE_COLUMNS
+)
+from versions import version_subquery, members_version_subquery, get_version, get_versions, make_etag, not_modified, tag
+from staffing import group_coverage, RESOLUTIONS, MAX_SLOTS
+from auto_assign import propose_assignments, apply_assignments, MAX_OPEN_SHIFTS
+from hours_rollup import hours_report, rebuild_hours_rollup, check_hours_rollup, PERIODS
+from compression import CompressionMiddleware
+from calendar_feed import new_token, hash_token, feed_cutoff, group_feed, user_feed, feed_cache
+from recurrence import (
+    parse_rrule, expand, group_occurrences, user_occurrences, recurring_overlap,
+    occurrence_id, occurrence_details, occurrence_page, parse_occurrence_id,
+    materialize_occurrence, rule_overlaps, MAX_DURATION
+)
 from flask_bcrypt import Bcrypt
 import jwt
+import click
 import random
 import string
+import uuid
+import json
+import queue
+import threading
 from datetime import date, datetime, timezone, timedelta
 import requests
 import os
@@ -22,11 +56,13 @@ load_dotenv()
 
 app = Flask(__name__)
 app.wsgi_app = ProxyFix(app.wsgi_app, x_for=1, x_proto=1, x_host=1)
+app.wsgi_app = CompressionMiddleware(app.wsgi_app)
 app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv("SQLALCHEMY_DATABASE_URI")
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['SQLALCHEMY_ECHO'] = True
 app.config['SECRET_KEY'] = os.getenv("secretKey")
 app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
+app.config['BCRYPT_LOG_ROUNDS'] = int(os.getenv("BCRYPT_LOG_ROUNDS", 12))
 
 app.config.update(
     SESSION_COOKIE_SAMESITE='None',  # Allows cookies to be sent in cross-site requests
@@ -49,7 +85,17 @@ toolbar = DebugToolbarExtension(app)
 
 connect_db(app)
 
-bcrypt = Bcrypt()
+init_notification_stream(app)
+
+# Each open stream holds a worker thread, so cap them per process below
+# the gunicorn thread count (see procfile) to leave room for other requests
+notification_stream_slots = threading.BoundedSemaphore(
+    int(os.getenv("NOTIFICATION_STREAMS_PER_WORKER", 24)))
+NOTIFICATION_STREAM_HEARTBEAT = int(
+    os.getenv("NOTIFICATION_STREAM_HEARTBEAT", 15))
+
+bcrypt = Bcrypt(app)
+password_hasher = create_password_hasher(bcrypt, app.config['BCRYPT_LOG_ROUNDS'])
 SECRET_KEY = os.getenv("secretKey")
 
 # OAuth Setup
@@ -80,6 +126,15 @@ microsoft = oauth.register(
 )
 
 
+def hashing_busy_response(error):
+    response = jsonify({
+        "message": "Too many sign in attempts, please try again shortly",
+        "status": error.status_code
+    })
+    response.headers['Retry-After'] = '1'
+    return response, error.status_code
+
+
 @app.route('/', methods=["GET"])
 @login_required
 def home():
@@ -104,11 +159,22 @@ def login_host():
             "message": "A user for this account does not exist"
         }), 401
 
-    authorized = bcrypt.check_password_hash(user.password_hash, password)
-    if not authorized:
-        return jsonify({
-            "message": "Email and password combination not valid"
-        }), 401
+    try:
+        authorized = password_hasher.check(
+            request.remote_addr, user.password_hash, password)
+        if not authorized:
+            return jsonify({
+                "message": "Email and password combination not valid"
+            }), 401
+
+        # Upgrade hashes created with a different bcrypt cost
+        if password_hasher.needs_rehash(user.password_hash):
+            user.password_hash = password_hasher.generate(
+                request.remote_addr, password)
+            db.session.add(user)
+            db.session.commit()
+    except (HashingOverloaded, HashingRateLimited) as e:
+        return hashing_busy_response(e)
 
     # Create the JWT payload (FIX: remove 'datetime.' prefix)
     payload = {
@@ -155,7 +221,10 @@ def signup_host():
     if password != confirm_password:
         return jsonify({"message": "password does not match password confirmation"}), 400
 
-    password_hash = bcrypt.generate_password_hash(password).decode('UTF-8')
+    try:
+        password_hash = password_hasher.generate(request.remote_addr, password)
+    except (HashingOverloaded, HashingRateLimited) as e:
+        return hashing_busy_response(e)
 
     new_user = User(
         username=username.replace(" ", "_"),
@@ -266,6 +335,10 @@ def logout():
         requests.post('https://oauth2.googleapis.com/revoke', params={'token': access_token},
                       headers={'content-type': 'application/x-www-form-urlencoded'})
 
+    # Forget the validated token so it can't be served from the cache after logout
+    if auth_type in PROVIDERS and access_token is not None:
+        token_cache.invalidate(auth_type, access_token)
+
     for key in list(session.keys()):
         session.pop(key)
     return jsonify({"message": "Logout successful"}), 200
@@ -290,10 +363,178 @@ def get_user_info():
 def get_user_notifications():
     user = g.user
 
-    return jsonify({
-        "notifications": [notification.get_details() for notification in user.notifications],
-        "unread_notifications": [notification.get_details() for notification in user.unread_notifications]
+    etag = make_etag('user', user.id, get_version('user', user.id), user.id)
+    cached = not_modified(etag)
+    if cached is not None:
+        return cached
+
+    notifications = NOTIFICATION_FIELDS.dump_all(db.session.execute(
+        NOTIFICATION_FIELDS.select().where(Notification_messages.user_id == user.id)))
+
+    response = {"notifications": notifications}
+
+    # Clients that page through /user/notifications/page can skip the duplicated unread list
+    if request.args.get("include_unread", "true").lower() != "false":
+        response["unread_notifications"] = [
+            notification for notification in notifications if not notification["read"]]
+
+    return tag(jsonify(response), etag)
+
+
+@app.route('/user/notifications/page', methods=["GET"])
+@login_required
+def get_user_notifications_page():
+    user_id = g.user.id
+
+    try:
+        limit = parse_limit(request.args.get("limit"), default=20, maximum=100)
+        cursor = request.args.get("cursor")
+        before = decode_cursor(cursor, 2) if cursor else None
+        if before is not None:
+            before = (datetime.fromisoformat(before[0]), uuid.UUID(before[1]))
+    except (ValueError, TypeError, AttributeError):
+        return jsonify({"message": "Invalid pagination parameters"}), 400
+
+    unread_only = request.args.get("unread_only", "false").lower() == "true"
+
+    etag = make_etag('user', user_id, get_version('user', user_id), user_id)
+    cached = not_modified(etag)
+    if cached is not None:
+        return cached
+
+    unread_count = unread_count_subquery(user_id)
+
+    # Newest first; the unread count rides along as a scalar subquery so a
+    # page is a single statement
+    query = (
+        NOTIFICATION_FIELDS.select(unread_count.label("unread_count"))
+        .where(Notification_messages.user_id == user_id)
+        .order_by(Notification_messages.iat.desc(), Notification_messages.id.desc())
+        .limit(limit + 1)
+    )
+
+    if unread_only:
+        query = query.where(Notification_messages.read == False)
+
+    if before is not None:
+        query = query.where(
+            tuple_(Notification_messages.iat, Notification_messages.id) <
+            tuple_(literal(before[0]), literal(before[1]))
+        )
+
+    rows = db.session.execute(query).all()
+
+    if rows:
+        count = rows[0].unread_count
+    else:
+        count = db.session.execute(db.select(unread_count)).scalar()
+
+    next_cursor = None
+    if len(rows) > limit:
+        last = rows[limit - 1]
+        next_cursor = encode_cursor([last.iat.isoformat(), str(last.id)])
+
+    return tag(jsonify({
+        "notifications": NOTIFICATION_FIELDS.dump_all(rows[:limit]),
+        "unread_count": count,
+        "next_cursor": next_cursor
+    }), etag)
+
+
+@app.route('/user/notifications/stream', methods=["GET"])
+@login_required
+def stream_user_notifications():
+    user_id = g.user.id
+
+    # EventSource sends Last-Event-ID when it reconnects
+    last_event_id = request.headers.get(
+        "Last-Event-ID") or request.args.get("last_event_id")
+
+    try:
+        last_event_id = uuid.UUID(last_event_id) if last_event_id else None
+    except ValueError:
+        return jsonify({"message": "Invalid Last-Event-ID"}), 400
+
+    if not notification_stream_slots.acquire(blocking=False):
+        response = jsonify({"message": "Too many open notification streams", "status": 503})
+        response.headers['Retry-After'] = str(NOTIFICATION_STREAM_HEARTBEAT)
+        return response, 503
+
+    # Subscribe before replaying so nothing created in between is missed
+    subscription = notification_stream.broker.subscribe(user_id)
+
+    try:
+        missed = []
+        if last_event_id is not None:
+            last_event = db.session.execute(
+                db.select(Notification_messages.iat, Notification_messages.id)
+                .where(
+                    Notification_messages.id == last_event_id,
+                    Notification_messages.user_id == user_id
+                )
+            ).one_or_none()
+
+            if last_event is not None:
+                missed = db.session.execute(
+                    db.select(Notification_messages)
+                    .where(
+                        Notification_messages.user_id == user_id,
+                        tuple_(Notification_messages.iat, Notification_messages.id) >
+                        tuple_(literal(last_event.iat), literal(last_event.id))
+                    )
+                    .order_by(Notification_messages.iat, Notification_messages.id)
+                    .limit(100)
+                ).scalars().all()
+        missed = [notification_event(notification) for notification in missed]
+        # Don't hold a pooled connection for the life of the stream
+        db.session.remove()
+    except Exception:
+        notification_stream.broker.unsubscribe(subscription)
+        notification_stream_slots.release()
+        raise
+
+    def format_event(event):
+        return f"id: {event['id']}\nevent: notification\ndata: {json.dumps(event)}\n\n"
+
+    def generate():
+        yield "retry: 5000\n\n"
+        for event in missed:
+            yield format_event(event)
+
+        # Live events published while replaying may repeat a replayed one
+        replayed = {event["id"] for event in missed}
+
+        while True:
+            try:
+                event = subscription.events.get(
+                    timeout=NOTIFICATION_STREAM_HEARTBEAT)
+            except queue.Empty:
+                # Comment lines keep proxies from closing an idle connection
+                yield ": heartbeat\n\n"
+                continue
+
+            if event["id"] in replayed:
+                continue
+            yield format_event(event)
+
+    def close_stream():
+        notification_stream.broker.unsubscribe(subscription)
+        notification_stream_slots.release()
+
+    response = Response(generate(), mimetype="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",
     })
+    # Runs when the server closes the response, even if the client went away
+    # before the generator was first advanced
+    response.call_on_close(close_stream)
+    return response
+
+
+@app.route('/user/notifications/unread-count', methods=["GET"])
+@login_required
+def get_unread_notification_count():
+    return jsonify({"unread_count": get_unread_count(g.user.id)})
 
 
 @app.route('/user/notifications/read-all', methods=["POST"])
@@ -301,12 +542,88 @@ def get_user_notifications():
 def read_all_notifications():
     user = g.user
 
-    for notification in g.user.unread_notifications:
-        notification.read = True
-        db.session.add(notification)
+    # One set-based UPDATE; no rows are loaded into the session
+    result = db.session.execute(
+        update(Notification_messages)
+        .where(
+            Notification_messages.user_id == user.id,
+            Notification_messages.read == False
+        )
+        .values(read=True)
+        .execution_options(synchronize_session=False)
+    )
     db.session.commit()
 
-    return jsonify({"message": "All notifications marked as read."}), 200
+    return jsonify({"message": "All notifications marked as read.", "updated": result.rowcount}), 200
+
+
+@app.route('/user/notifications/read', methods=["POST", "DELETE"])
+@login_required
+def bulk_read_or_delete_notifications():
+    user = g.user
+
+    if request.method == "POST":
+        body = request.get_json()
+        ids = body.get("ids")
+        before = body.get("before")
+
+        if ids is None and before is None:
+            return jsonify({"message": "Required parameters are missing"}), 400
+
+        query = update(Notification_messages).where(
+            Notification_messages.user_id == user.id,
+            Notification_messages.read == False
+        )
+
+        if ids is not None:
+            try:
+                ids = [uuid.UUID(notification_id) for notification_id in ids]
+            except (ValueError, TypeError, AttributeError):
+                return jsonify({"message": "Invalid notification ids"}), 400
+            query = query.where(Notification_messages.id.in_(ids))
+
+        if before is not None:
+            # `before` is a cursor from /user/notifications/page: mark that
+            # notification and everything older than it as read
+            try:
+                iat, notification_id = decode_cursor(before, 2)
+                before = (datetime.fromisoformat(iat), uuid.UUID(notification_id))
+            except (ValueError, TypeError, AttributeError):
+                return jsonify({"message": "Invalid cursor"}), 400
+            query = query.where(
+                tuple_(Notification_messages.iat, Notification_messages.id) <=
+                tuple_(literal(before[0]), literal(before[1]))
+            )
+
+        result = db.session.execute(
+            query.values(read=True).execution_options(synchronize_session=False))
+        db.session.commit()
+
+        return jsonify({"message": "Notifications marked as read.", "updated": result.rowcount}), 200
+
+    elif request.method == "DELETE":
+        try:
+            older_than_days = int(request.args.get("older_than_days", 30))
+        except ValueError:
+            return jsonify({"message": "Invalid parameter 'older_than_days'"}), 400
+
+        if older_than_days < 0:
+            return jsonify({"message": "Invalid parameter 'older_than_days'"}), 400
+
+        cutoff_time = datetime.now() - timedelta(days=older_than_days)
+
+        result = db.session.execute(
+            delete(Notification_messages)
+            .where(
+                Notification_messages.user_id == user.id,
+                Notification_messages.read == True,
+                Notification_messages.iat < cutoff_time
+            )
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+
+        return jsonify({"message": "Read notifications deleted.", "deleted": result.rowcount}), 200
 
 
 @app.route('/groups/search', methods=["GET"])
@@ -316,46 +633,77 @@ def search_groups():
     if not name:
         return jsonify({"message": "Required parameter 'name' is missing"}), 400
 
+    try:
+        limit = parse_limit(request.args.get("limit"), default=20, maximum=50)
+        cursor = request.args.get("cursor")
+        after = decode_cursor(cursor, 3) if cursor else None
+        if after is not None:
+            after[2] = uuid.UUID(after[2])
+    except (ValueError, TypeError, AttributeError):
+        return jsonify({"message": "Invalid pagination parameters"}), 400
+
+    pattern = escape_like(name)
+
     # 1. Build a CASE expression: 0 if name starts with 'name', else 1
     starts_with_case = case(
-        (Group.name.ilike(f"{name}%"), 0),
+        (Group.name.ilike(f"{pattern}%", escape='\\'), 0),
         else_=1
     )
 
-    # 2. Query groups that contain `name` (ilike = case-insensitive LIKE)
-    #    Order by `starts_with_case` (start-with first), then Group.name asc
-    matching_groups = (
-        Group.query
-        .filter(Group.name.ilike(f"%{name}%"))
-        .order_by(starts_with_case, asc(Group.name))
-        .all()
+    # 2. Query groups that contain `name` (served by the trigram index),
+    #    ordered by `starts_with_case` (start-with first), then Group.name asc.
+    #    The caller's membership is outer joined so the whole page is one query.
+    query = (
+        db.session.query(
+            Group.id,
+            Group.name,
+            GroupMembership.approved,
+            starts_with_case.label("rank")
+        )
+        .outerjoin(GroupMembership, and_(
+            GroupMembership.group_id == Group.id,
+            GroupMembership.user_id == g.user.id
+        ))
+        .filter(Group.name.ilike(f"%{pattern}%", escape='\\'))
     )
 
-    user_id = g.user.id
+    # 3. Keyset pagination: continue after the last (rank, name, id) returned
+    if after is not None:
+        query = query.filter(
+            tuple_(starts_with_case, Group.name, Group.id) >
+            tuple_(literal(after[0]), literal(after[1]), literal(after[2]))
+        )
 
-    # 3. Build the response list
-    results = []
-    for group in matching_groups:
-        membership = GroupMembership.query.filter_by(
-            user_id=user_id,
-            group_id=group.id
-        ).one_or_none()
+    rows = (
+        query
+        .order_by(starts_with_case, asc(Group.name), asc(Group.id))
+        .limit(limit + 1)
+        .all()
+    )
 
+    # 4. Build the response list
+    results = []
+    for row in rows[:limit]:
         # Determine membership status
-        if membership is None:
+        if row.approved is None:
             status = None
-        elif membership.approved:
+        elif row.approved:
             status = "approved"
         else:
             status = "pending"
 
         results.append({
-            "id": str(group.id),
-            "name": group.name,
+            "id": str(row.id),
+            "name": row.name,
             "membership_status": status,
         })
 
-    return jsonify({"groups": results}), 200
+    next_cursor = None
+    if len(rows) > limit:
+        last = rows[limit - 1]
+        next_cursor = encode_cursor([last.rank, last.name, str(last.id)])
+
+    return jsonify({"groups": results, "next_cursor": next_cursor}), 200
 
 
 @app.route('/user/groups', methods=["GET", "POST"])
@@ -364,11 +712,29 @@ def list_all_or_create_group():
     user = g.user
 
     if request.method == "GET":
-        return jsonify({
-            "all_groups": [group.get_details() for group in user.groups],
-            "my_groups": [group.get_details() for group in user.my_groups],
-            "available_groups": [group.get_details() for group in user.available_groups],
-        })
+        etag = make_etag('user', user.id, get_version('user', user.id), user.id)
+        cached = not_modified(etag)
+        if cached is not None:
+            return cached
+
+        # Groups the caller belongs to or owns, in one query
+        rows = db.session.execute(
+            GROUP_FIELDS.select(GroupMembership.user_id.isnot(None).label("member"))
+            .outerjoin(GroupMembership, and_(
+                GroupMembership.group_id == Group.id,
+                GroupMembership.user_id == user.id
+            ))
+            .where(or_(GroupMembership.user_id.isnot(None), Group.owner_id == user.id))
+        ).all()
+
+        groups = [(row, GROUP_FIELDS.dump(row)) for row in rows]
+
+        return tag(jsonify({
+            "all_groups": [group for row, group in groups if row.member],
+            "my_groups": [group for row, group in groups if row.owner_id == user.id],
+            "available_groups": [
+                group for row, group in groups if row.member and row.owner_id != user.id],
+        }), etag)
     elif request.method == "POST":
         body = request.get_json()
         name = body.get("name")
@@ -390,248 +756,1326 @@ def list_all_or_create_group():
 def get_group_info(group_id):
     user = g.user
 
-    group = Group.query.filter_by(id=group_id).one_or_none()
+    # The group, the caller's membership and the group's version in one query
+    group = db.session.execute(
+        db.select(
+            Group.id,
+            Group.owner_id,
+            GroupMembership.approved,
+            GroupMembership.admin,
+            version_subquery('group', Group.id).label("version")
+        )
+        .outerjoin(GroupMembership, and_(
+            GroupMembership.group_id == Group.id,
+            GroupMembership.user_id == user.id
+        ))
+        .where(Group.id == group_id)
+    ).one_or_none()
 
     if group is None:
         return jsonify({"message": "Group not found"}), 404
 
-    # Query the GroupMembership table
-    membership = GroupMembership.query.filter_by(
-        user_id=user.id, group_id=group_id).one_or_none()
-
-    if not membership:
+    if group.approved is None:
         return jsonify({"message": "You do not have permission to view this group"}), 401
 
-    if not membership.approved:
+    if not group.approved:
         return jsonify({"message": "Your membership in this group is not approved"}), 401
 
+    include_shifts = request.args.get("include_shifts", "false").lower() == "true"
+
+    # The embedded schedule depends on the current time as well as the
+    # group's version, so only responses without it are tagged
+    etag = None
+    if not include_shifts:
+        etag = make_etag('group', group.id, group.version, user.id)
+        cached = not_modified(etag)
+        if cached is not None:
+            return cached
+
     role = ''
-    if group.owner.id == user.id:
+    if group.owner_id == user.id:
         role = 'owner'
-    elif membership.admin == True:
+    elif group.admin == True:
         role = 'admin'
     else:
         role = 'employee'
 
-    return jsonify({
+    # The schedule is served in windows by get_group_schedule; embedding
+    # the whole future schedule is kept only for clients that ask for it
+    shifts = []
+    if include_shifts:
+        # Same window as Group.recent_shifts
+        cutoff_time = datetime.now() - timedelta(days=1)
+        shifts = SHIFT_FIELDS.dump_all(db.session.execute(
+            SHIFT_FIELDS.select()
+            .where(Shift.group_id == group_id, Shift.end_time >= cutoff_time)
+        ))
+
+        # Recurring shifts have no end, so only the coming weeks are expanded
+        shifts += [
+            occurrence_details(rule, start, end)
+            for rule, start, end in group_occurrences(
+                group.id, cutoff_time, cutoff_time + RECURRENCE_PREVIEW)
+        ]
+
+    # Every membership with its user; pending ones double as the requests list
+    memberships = db.session.execute(
+        MEMBERSHIP_REQUEST_FIELDS.select(GroupMembership.approved, User.email)
+        .join(User, User.id == GroupMembership.user_id)
+        .where(GroupMembership.group_id == group_id)
+    ).all()
+
+    response = jsonify({
         "id": group.id,
-        "shifts": [shift.get_details() for shift in group.recent_shifts],
-        "members": [member.get_details() for member in group.members],
-        "membership_requests": [member.get_details() for member in group.membership_requests],
+        "shifts": shifts,
+        "members": [
+            {"id": m.user_id, "email": m.email, "username": m.username}
+            for m in memberships
+        ],
+        "membership_requests": [
+            MEMBERSHIP_REQUEST_FIELDS.dump(m) for m in memberships if not m.approved
+        ],
         "role": role
-    }), 200
+    })
 
+    return (tag(response, etag) if etag else response), 200
 
-@app.route('/user/groups/<group_id>/membership/request-join', methods=["POST"])
+
+@app.route('/user/groups/<group_id>/schedule', methods=["GET"])
 @login_required
-def request_group_membership(group_id):
+def get_group_schedule(group_id):
     user = g.user
 
-    group = Group.query.filter_by(id=group_id).one_or_none()
+    membership = GroupMembership.query.filter_by(
+        user_id=user.id, group_id=group_id).one_or_none()
 
-    if group == None:
-        return jsonify({"message": "Group not found"}), 404
+    if membership is None:
+        return jsonify({"message": "You do not have permission to view this group"}), 401
 
-    existing_request = next(
-        (group for group in user.groups if group.id == group_id), None)
+    if not membership.approved:
+        return jsonify({"message": "Your membership in this group is not approved"}), 401
 
-    if existing_request and not existing_request.approved:
-        return jsonify({"message": "You have already sent a request to this group"}), 401
-    if existing_request and existing_request.approved:
-        return jsonify({"message": "You are already a part of this group"}), 401
+    from_iso = request.args.get("from")
+    to_iso = request.args.get("to")
 
-    join_request = GroupMembership(
-        user_id=user.id, group_id=group.id, admin=False, approved=False)
-    db.session.add(join_request)
-    db.session.commit()
+    if not from_iso or not to_iso:
+        return jsonify({"message": "Required parameters are missing"}), 400
 
-    return jsonify({"message": "Request sent successfully"}), 201
+    try:
+        start_time = parse_iso(from_iso)
+        end_time = parse_iso(to_iso)
+        member_id = request.args.get("member")
+        member_id = uuid.UUID(member_id) if member_id else None
+    except ValueError:
+        return jsonify({"message": "Invalid schedule parameters"}), 400
+
+    if start_time >= end_time:
+        return jsonify({"message": "'from' must be before 'to'"}), 400
+
+    etag = make_etag('group', membership.group_id,
+                     get_version('group', membership.group_id), user.id)
+    cached = not_modified(etag)
+    if cached is not None:
+        return cached
+
+    # Pages are ordered by (start_time, kind, id): at equal start times
+    # stored shifts come before recurring occurrences
+    try:
+        limit = parse_limit(request.args.get("limit"), default=200, maximum=1000)
+        cursor = request.args.get("cursor")
+        after = decode_cursor(cursor, 2) if cursor else None
+        if after is not None:
+            after = (datetime.fromisoformat(after[0]), str(after[1]))
+            recurring_cursor = ":" in after[1]
+            if not recurring_cursor:
+                uuid.UUID(after[1])
+    except (ValueError, TypeError, AttributeError):
+        return jsonify({"message": "Invalid pagination parameters"}), 400
+
+    query = (
+        db.select(Shift.id, Shift.user_id, Shift.start_time, Shift.end_time)
+        .where(
+            Shift.group_id == membership.group_id,
+            Shift.start_time < end_time,
+            Shift.end_time > start_time
+        )
+        .order_by(Shift.start_time, Shift.id)
+        .limit(limit + 1)
+    )
 
+    if member_id is not None:
+        query = query.where(Shift.user_id == member_id)
 
-@app.route('/user/memberships/<membership_id>/approve-join', methods=["POST"])
+    if after is not None:
+        if recurring_cursor:
+            query = query.where(Shift.start_time > after[0])
+        else:
+            query = query.where(
+                tuple_(Shift.start_time, Shift.id) >
+                tuple_(literal(after[0]), literal(uuid.UUID(after[1])))
+            )
+
+    page = [
+        ((row.start_time, 0, str(row.id)), {
+            "id": row.id,
+            "user_id": row.user_id,
+            "start_time": row.start_time,
+            "end_time": row.end_time,
+            "recurrence_id": None
+        })
+        for row in db.session.execute(query)
+    ]
+
+    # An empty id sorts before every occurrence id, so a stored-shift
+    # cursor resumes with the occurrences that share its start time
+    occurrence_after = None
+    if after is not None:
+        occurrence_after = after if recurring_cursor else (after[0], "")
+
+    page += [
+        ((start, 1, key), {
+            "id": key,
+            "user_id": rule.user_id,
+            "start_time": start,
+            "end_time": end,
+            "recurrence_id": rule.id
+        })
+        for (start, key), rule, end in occurrence_page(
+            group_occurrences(membership.group_id, start_time, end_time, user_id=member_id),
+            limit + 1,
+            occurrence_after
+        )
+    ]
+
+    page.sort(key=lambda item: item[0])
+
+    next_cursor = None
+    if len(page) > limit:
+        last_start, _, last_id = page[limit - 1][0]
+        next_cursor = encode_cursor([last_start.isoformat(), last_id])
+
+    return tag(jsonify({
+        "shifts": [shift for _, shift in page[:limit]],
+        "next_cursor": next_cursor
+    }), etag), 200
+
+
+@app.route('/user/groups/<group_id>/coverage', methods=["GET"])
 @login_required
-def approve_group_membership(membership_id):
+def get_group_coverage(group_id):
     user = g.user
 
-    user_is_admin = (GroupMembership.query.filter_by(
-        user_id=user.id).one()).admin
+    membership = GroupMembership.query.filter_by(
+        user_id=user.id, group_id=group_id).one_or_none()
 
-    if not user_is_admin:
-        return jsonify({"message": "Only memebers with administative access can perform this action"}), 401
+    if membership is None:
+        return jsonify({"message": "You do not have permission to view this group"}), 401
 
-    membership = GroupMembership.query.filter_by(
-        id=membership_id).one_or_none()
+    if not membership.approved:
+        return jsonify({"message": "Your membership in this group is not approved"}), 401
 
-    if membership == None:
-        return jsonify({"message": "membership not found"}), 404
+    from_iso = request.args.get("from")
+    to_iso = request.args.get("to")
 
-    membership.approved = True
+    if not from_iso or not to_iso:
+        return jsonify({"message": "Required parameters are missing"}), 400
 
-    notification = Notification_messages(
-        user_id=membership.user.id, message=f"Your membership request to {membership.group.name} has been approved.")
+    try:
+        start_time = parse_iso(from_iso)
+        end_time = parse_iso(to_iso)
+        resolution = int(request.args.get("resolution", 60))
+    except ValueError:
+        return jsonify({"message": "Invalid coverage parameters"}), 400
 
-    db.session.add(membership)
-    db.session.add(notification)
-    db.session.commit()
+    if start_time >= end_time:
+        return jsonify({"message": "'from' must be before 'to'"}), 400
 
-    return jsonify({"message": "Request was approved successfully"}), 201
+    if resolution not in RESOLUTIONS:
+        return jsonify({"message": f"Resolution must be one of {', '.join(map(str, RESOLUTIONS))} minutes"}), 400
 
+    if (end_time - start_time) / timedelta(minutes=resolution) > MAX_SLOTS:
+        return jsonify({"message": "Window is too long for this resolution"}), 400
 
-@app.route('/user/memberships/<membership_id>/decline-join', methods=["DELETE"])
-@login_required
-def decline_group_membership(membership_id):
-    user = g.user
+    etag = make_etag('group', membership.group_id,
+                     get_version('group', membership.group_id), user.id)
+    cached = not_modified(etag)
+    if cached is not None:
+        return cached
 
-    user_is_admin = (GroupMembership.query.filter_by(
-        user_id=user.id).one()).admin
+    return tag(jsonify(group_coverage(
+        membership.group_id, start_time, end_time, resolution)), etag), 200
 
-    if not user_is_admin:
-        return jsonify({"message": "Only memebers with administative access can perform this action"}), 401
+
+MAX_REPORTED_CONFLICTS = 1000
+
+
+@app.route('/user/groups/<group_id>/conflicts', methods=["GET"])
+@login_required
+def get_group_conflicts(group_id):
+    user = g.user
 
     membership = GroupMembership.query.filter_by(
-        id=membership_id).one_or_none()
+        user_id=user.id, group_id=group_id).one_or_none()
 
-    if membership == None:
+    if membership is None:
         return jsonify({"message": "membership not found"}), 404
 
-    notification = Notification_messages(
-        user_id=membership.user.id, message=f"Your membership request to {membership.group.name} has been decline.")
+    if not membership.approved or not membership.admin:
+        return jsonify({"message": "Only members with administrative access can perform this action"}), 401
 
-    db.session.delete(membership)
-    db.session.add(notification)
-    db.session.commit()
+    conflicts = []
+    truncated = False
+    for conflict_user_id, earlier, later in sweep_conflicts(
+            assigned_shifts_by_user(db.session.connection(), membership.group_id)):
+        if len(conflicts) == MAX_REPORTED_CONFLICTS:
+            truncated = True
+            break
+        conflicts.append({
+            "user_id": conflict_user_id,
+            "shifts": [
+                {"id": shift_id, "start_time": start, "end_time": end}
+                for shift_id, start, end in (earlier, later)
+            ]
+        })
 
-    return jsonify({"message": "Request was declined successfully"}), 204
+    return jsonify({"conflicts": conflicts, "truncated": truncated}), 200
 
 
-@app.route('/user/memberships/<membership_id>/admin-permissions', methods=["PATCH"])
+@app.route('/user/groups/<group_id>/hours', methods=["GET"])
 @login_required
-def edit_membership_permissions(membership_id):
+def get_group_hours(group_id):
     user = g.user
 
-    body = request.get_json()
-    new_admin_permissions = body.get("set_admin_permissions")
-
-    if new_admin_permissions == None:
-        return jsonify({"message": "Required parameters are missing"}), 400
-
     membership = GroupMembership.query.filter_by(
-        id=membership_id).one_or_none()
+        user_id=user.id, group_id=group_id).one_or_none()
 
-    if membership == None:
+    if membership is None:
         return jsonify({"message": "membership not found"}), 404
 
-    user_membership = next(
-        (m for m in membership.group.members if m.id == user.id), None)
+    if not membership.approved or not membership.admin:
+        return jsonify({"message": "Only members with administrative access can perform this action"}), 401
 
-    user_is_owner = user_membership.group.owner.id == user.id
+    from_date = request.args.get("from")
+    to_date = request.args.get("to")
+    period = request.args.get("period", "week")
 
-    if not user_is_owner:
-        return jsonify({"message": "Only the group owner can perform this action"}), 401
+    if not from_date or not to_date:
+        return jsonify({"message": "Required parameters are missing"}), 400
 
-    editing_admin = membership.user.id == membership.group.owner.id
+    try:
+        start_day = date.fromisoformat(from_date)
+        end_day = date.fromisoformat(to_date)
+        overtime_hours = request.args.get("overtime_hours")
+        overtime_hours = float(overtime_hours) if overtime_hours else (40.0 if period == "week" else None)
+    except ValueError:
+        return jsonify({"message": "Invalid report parameters"}), 400
 
-    if editing_admin:
-        return jsonify({"message": "Cannot modify the admin permission of the group owner"}), 403
+    if period not in PERIODS:
+        return jsonify({"message": "Period must be 'week' or 'month'"}), 400
 
-    membership.admin = new_admin_permissions
+    if start_day >= end_day:
+        return jsonify({"message": "'from' must be before 'to'"}), 400
 
-    db.session.add(membership)
-    db.session.commit()
+    etag = make_etag('group', membership.group_id,
+                     get_version('group', membership.group_id), user.id)
+    cached = not_modified(etag)
+    if cached is not None:
+        return cached
 
-    return jsonify({"message": "Group membership permissions for this user was updated successfully"}), 200
+    return tag(jsonify({
+        "from": start_day.isoformat(),
+        "to": end_day.isoformat(),
+        "period": period,
+        "members": hours_report(membership.group_id, start_day, end_day, period, overtime_hours)
+    }), etag), 200
 
 
-@app.route('/user/groups/<group_id>/shift', methods=["POST"])
+@app.route('/user/groups/<group_id>/availability', methods=["GET"])
 @login_required
-def create_new_shift(group_id):
+def get_group_availability(group_id):
     user = g.user
-    body = request.get_json()
-    shift_owner_membership_id = body.get("shift_owner_membership_id")
-    start_time_iso = body.get("start_time_iso")
-    end_time_iso = body.get("end_time_iso")
 
-    user_membership = GroupMembership.query.filter_by(
-        user_id=user.id, group_id=group_id
-    ).one_or_none()
+    membership = GroupMembership.query.filter_by(
+        user_id=user.id, group_id=group_id).one_or_none()
 
-    if user_membership is None:
-        return jsonify({"message": "membership not found"}), 404
+    if membership is None:
+        return jsonify({"message": "You do not have permission to view this group"}), 401
 
-    if not user_membership.approved:
+    if not membership.approved:
         return jsonify({"message": "Your membership in this group is not approved"}), 401
 
-    if not user_membership.admin:
-        return jsonify({"message": "Only members with administrative access can perform this action"}), 401
+    at_iso = request.args.get("at")
+    from_iso = request.args.get("from")
+    to_iso = request.args.get("to")
 
-    if not shift_owner_membership_id or not start_time_iso or not end_time_iso:
-        return jsonify({"message": "Required parameters are missing"}), 400
+    try:
+        at = parse_iso(at_iso) if at_iso else None
+        start_time = parse_iso(from_iso) if from_iso else None
+        end_time = parse_iso(to_iso) if to_iso else None
+    except ValueError:
+        return jsonify({"message": "Invalid time parameters"}), 400
 
-    shift_owner_membership = GroupMembership.query.filter_by(
-        user_id=shift_owner_membership_id,
-        group_id=group_id
-    ).one_or_none()
+    if at is None and (start_time is None or end_time is None):
+        return jsonify({"message": "Required parameters are missing"}), 400
 
-    if not shift_owner_membership or not shift_owner_membership.approved:
-        return jsonify({
-            "message": "Assigned user does not have an approved membership to this group"
-        }), 404
+    if start_time is not None and end_time is not None and start_time >= end_time:
+        return jsonify({"message": "'from' must be before 'to'"}), 400
 
-    new_shift = Shift(
-        group_id=user_membership.group.id,
-        user_id=shift_owner_membership.user.id,
-        start_time=datetime.fromisoformat(start_time_iso),
-        end_time=datetime.fromisoformat(end_time_iso)
-    )
+    index = schedule_indexes.get(membership.group_id)
+    response = {}
 
-    start_overlapping_shift = next(
-        (s for s in user.assigned_shifts if new_shift.end_time > s.start_time),
-        None
-    )
-    end_overlapping_shift = next(
-        (s for s in user.assigned_shifts if s.start_time < new_shift.end_time),
-        None
-    )
+    if at is not None:
+        response["working"] = index.working_at(at)
 
-    if start_overlapping_shift:
-        db.session.delete(start_overlapping_shift)
-        new_shift.start_time = start_overlapping_shift.start_time
+    if start_time is not None and end_time is not None:
+        member_ids = db.session.execute(
+            db.select(GroupMembership.user_id)
+            .where(
+                GroupMembership.group_id == membership.group_id,
+                GroupMembership.approved == True
+            )
+        ).scalars().all()
 
-    if end_overlapping_shift:
-        db.session.delete(end_overlapping_shift)
-        new_shift.end_time = end_overlapping_shift.end_time
+        response["shifts"] = [
+            {
+                "id": shift_id,
+                "group_id": membership.group_id,
+                "user_id": shift_user_id,
+                "start_time": shift_start,
+                "end_time": shift_end
+            }
+            for shift_id, shift_user_id, shift_start, shift_end
+            in index.shifts_between(start_time, end_time)
+        ]
+        response["free_members"] = index.free_members(
+            member_ids, start_time, end_time)
 
-    notification = Notification_messages(
-        user_id=shift_owner_membership.user.id,
-        message=f"You've been assigned a new shift at {user_membership.group.name} from {new_shift.start_time} to {new_shift.end_time}."
-    )
+    return jsonify(response), 200
 
-    db.session.add(new_shift)
-    db.session.add(notification)
-    db.session.commit()
 
-    return jsonify({"message": "Shift created successfully"}), 201
+RECURRENCE_PREVIEW = timedelta(weeks=4)
 
 
-@app.route('/user/groups/<group_id>/shift/<shift_id>', methods=["PUT", "DELETE"])
+@app.route('/user/groups/<group_id>/recurring-shifts', methods=["GET", "POST"])
 @login_required
-def modify_or_delete_shift(group_id, shift_id):
+def list_or_create_recurring_shifts(group_id):
     user = g.user
 
     membership = GroupMembership.query.filter_by(
-        user_id=user.id, group_id=group_id
-    ).one_or_none()
+        user_id=user.id, group_id=group_id).one_or_none()
 
     if membership is None:
         return jsonify({"message": "membership not found"}), 404
+
     if not membership.approved:
         return jsonify({"message": "Your membership in this group is not approved"}), 401
-    if not membership.admin:
-        return jsonify({"message": "Only memebers with administrative access can perform this action"}), 401
-
-    shift = Shift.query.filter_by(id=shift_id).one_or_none()
-    if shift is None:
-        return jsonify({"message": "Shift not found"}), 404
+
+    if request.method == "GET":
+        rows = db.session.execute(
+            RECURRING_SHIFT_FIELDS.select(*RECURRENCE_RULE_COLUMNS)
+            .where(Shift_recurrence.group_id == membership.group_id)
+        )
+        rules = []
+        for row in rows:
+            rule = RECURRING_SHIFT_FIELDS.dump(row)
+            # The rule columns follow the projected fields
+            rule["rrule"] = format_rrule(*row[len(RECURRING_SHIFT_FIELDS.names):])
+            rules.append(rule)
+        return jsonify({"recurring_shifts": rules}), 200
+
+    if not membership.admin:
+        return jsonify({"message": "Only members with administrative access can perform this action"}), 401
+
+    body = request.get_json()
+    shift_owner_membership_id = body.get("shift_owner_membership_id")
+    start_time_iso = body.get("start_time_iso")
+    end_time_iso = body.get("end_time_iso")
+    rrule = body.get("rrule")
+
+    if not shift_owner_membership_id or not start_time_iso or not end_time_iso or not rrule:
+        return jsonify({"message": "Required parameters are missing"}), 400
+
+    shift_owner_membership = GroupMembership.query.filter_by(
+        user_id=shift_owner_membership_id, group_id=membership.group_id
+    ).one_or_none()
+
+    if not shift_owner_membership or not shift_owner_membership.approved:
+        return jsonify({
+            "message": "Assigned user does not have an approved membership to this group"
+        }), 404
+
+    try:
+        start_time = parse_iso(start_time_iso)
+        end_time = parse_iso(end_time_iso)
+        rule_fields = parse_rrule(rrule)
+    except ValueError as e:
+        return jsonify({"message": f"Invalid recurring shift: {e}"}), 400
+
+    if start_time >= end_time:
+        return jsonify({"message": "Shift must end after it starts"}), 400
+
+    if end_time - start_time > MAX_DURATION:
+        return jsonify({"message": "Recurring shifts can last at most 24 hours"}), 400
+
+    rule = Shift_recurrence(
+        group_id=membership.group_id,
+        user_id=shift_owner_membership.user_id,
+        dtstart=start_time,
+        duration_minutes=int((end_time - start_time).total_seconds() // 60),
+        **rule_fields
+    )
+
+    if next(expand(rule, start_time, end_time), None) is None:
+        return jsonify({"message": "The first occurrence must match the rule"}), 400
+
+    if rule_overlaps(rule):
+        return recurring_conflict_response()
+
+    notification = Notification_messages(
+        user_id=shift_owner_membership.user_id,
+        message=f"You've been assigned a recurring shift at {membership.group.name} starting {start_time} ({rule.rrule})."
+    )
+
+    db.session.add(rule)
+    db.session.add(notification)
+    db.session.commit()
+
+    return jsonify({"recurring_shift_id": rule.id}), 201
+
+
+@app.route('/user/groups/<group_id>/recurring-shifts/<recurrence_id>', methods=["DELETE"])
+@login_required
+def delete_recurring_shift(group_id, recurrence_id):
+    user = g.user
+
+    membership = GroupMembership.query.filter_by(
+        user_id=user.id, group_id=group_id).one_or_none()
+
+    if membership is None:
+        return jsonify({"message": "membership not found"}), 404
+
+    if not membership.approved or not membership.admin:
+        return jsonify({"message": "Only members with administrative access can perform this action"}), 401
+
+    rule = Shift_recurrence.query.filter_by(
+        id=recurrence_id, group_id=membership.group_id).one_or_none()
+
+    if rule is None:
+        return jsonify({"message": "Recurring shift not found"}), 404
+
+    # Occurrences that were already materialised stay as ordinary shifts
+    if rule.user_id is not None:
+        notification = Notification_messages(
+            user_id=rule.user_id,
+            message=f"Your recurring shift at {membership.group.name} ({rule.rrule}) was removed."
+        )
+        db.session.add(notification)
+
+    db.session.delete(rule)
+    db.session.commit()
+
+    return jsonify({"message": "Recurring shift deleted successfully"}), 204
+
+
+@app.route('/user/groups/<group_id>/recurring-shifts/<recurrence_id>/materialize', methods=["POST"])
+@login_required
+def materialize_recurring_shift(group_id, recurrence_id):
+    user = g.user
+    body = request.get_json()
+    occurrence_start_iso = body.get("occurrence_start_iso")
+
+    membership = GroupMembership.query.filter_by(
+        user_id=user.id, group_id=group_id).one_or_none()
+
+    if membership is None:
+        return jsonify({"message": "membership not found"}), 404
+
+    if not membership.approved:
+        return jsonify({"message": "Your membership in this group is not approved"}), 401
+
+    if not occurrence_start_iso:
+        return jsonify({"message": "Required parameters are missing"}), 400
+
+    try:
+        occurrence_start = parse_iso(occurrence_start_iso)
+    except ValueError:
+        return jsonify({"message": "Invalid occurrence start"}), 400
+
+    rule = Shift_recurrence.query.filter_by(
+        id=recurrence_id, group_id=membership.group_id).one_or_none()
+
+    if rule is None:
+        return jsonify({"message": "Recurring shift not found"}), 404
+
+    if not membership.admin and rule.user_id != user.id:
+        return jsonify({"message": "Only administrators and the assigned member can perform this action"}), 401
+
+    shift = materialize_occurrence(rule, occurrence_start)
+
+    if shift is None:
+        return jsonify({"message": "Occurrence not found"}), 404
+
+    db.session.commit()
+
+    return jsonify({"shift": shift.get_details()}), 201
+
+
+@app.route('/user/calendar-feed', methods=["POST", "DELETE"])
+@login_required
+def manage_user_calendar_feed():
+    return manage_calendar_feed(g.user.id, None)
+
+
+@app.route('/user/groups/<group_id>/calendar-feed', methods=["POST", "DELETE"])
+@login_required
+def manage_group_calendar_feed(group_id):
+    user = g.user
+
+    membership = GroupMembership.query.filter_by(
+        user_id=user.id, group_id=group_id).one_or_none()
+
+    if membership is None:
+        return jsonify({"message": "You do not have permission to view this group"}), 401
+
+    if not membership.approved:
+        return jsonify({"message": "Your membership in this group is not approved"}), 401
+
+    return manage_calendar_feed(user.id, membership.group_id)
+
+
+def manage_calendar_feed(user_id, group_id):
+    """POST issues a new feed URL, revoking the previous one; DELETE revokes it."""
+    db.session.execute(
+        delete(Calendar_feed).where(
+            Calendar_feed.user_id == user_id,
+            Calendar_feed.group_id == group_id if group_id else Calendar_feed.group_id.is_(None)
+        )
+    )
+
+    if request.method == "DELETE":
+        db.session.commit()
+        return jsonify({"message": "Calendar feed revoked"}), 204
+
+    token, token_hash = new_token()
+    db.session.add(Calendar_feed(token_hash=token_hash, user_id=user_id, group_id=group_id))
+    db.session.commit()
+
+    return jsonify({
+        "url": url_for('get_calendar_feed', token=token, _external=True)
+    }), 201
+
+
+@app.route('/calendar/<token>.ics', methods=["GET"])
+def get_calendar_feed(token):
+    # The token, the membership it relies on and the version of what it
+    # shows, in one query
+    feed = db.session.execute(
+        db.select(
+            Calendar_feed.user_id,
+            Calendar_feed.group_id,
+            GroupMembership.approved,
+            db.case(
+                (Calendar_feed.group_id.is_(None),
+                 version_subquery('user', Calendar_feed.user_id)),
+                else_=version_subquery('group', Calendar_feed.group_id)
+            ).label("version")
+        )
+        .outerjoin(GroupMembership, and_(
+            GroupMembership.group_id == Calendar_feed.group_id,
+            GroupMembership.user_id == Calendar_feed.user_id
+        ))
+        .where(Calendar_feed.token_hash == hash_token(token))
+    ).one_or_none()
+
+    if feed is None or (feed.group_id is not None and not feed.approved):
+        return jsonify({"message": "Calendar feed not found"}), 404
+
+    cutoff = feed_cutoff()
+    kind, resource_id = ('group', feed.group_id) if feed.group_id else ('user', feed.user_id)
+    key = (kind, resource_id, feed.version, cutoff)
+
+    etag = make_etag(kind, resource_id, feed.version, cutoff.date())
+    cached = not_modified(etag)
+    if cached is not None:
+        return cached
+
+    body = feed_cache.get(key)
+    if body is not None:
+        response = Response(body, mimetype='text/calendar')
+    else:
+        if kind == 'group':
+            chunks = group_feed(resource_id, cutoff, request.host)
+        else:
+            chunks = user_feed(resource_id, cutoff, request.host)
+        response = Response(
+            stream_with_context(feed_cache.stream(key, chunks)),
+            mimetype='text/calendar')
+
+    response.headers['Content-Disposition'] = 'inline; filename="shifts.ics"'
+    return tag(response, etag)
+
+
+@app.route('/user/groups/<group_id>/membership/request-join', methods=["POST"])
+@login_required
+def request_group_membership(group_id):
+    user = g.user
+
+    group = Group.query.filter_by(id=group_id).one_or_none()
+
+    if group == None:
+        return jsonify({"message": "Group not found"}), 404
+
+    existing_request = next(
+        (group for group in user.groups if group.id == group_id), None)
+
+    if existing_request and not existing_request.approved:
+        return jsonify({"message": "You have already sent a request to this group"}), 401
+    if existing_request and existing_request.approved:
+        return jsonify({"message": "You are already a part of this group"}), 401
+
+    join_request = GroupMembership(
+        user_id=user.id, group_id=group.id, admin=False, approved=False)
+    db.session.add(join_request)
+    db.session.commit()
+
+    return jsonify({"message": "Request sent successfully"}), 201
+
+
+@app.route('/user/memberships/<membership_id>/approve-join', methods=["POST"])
+@login_required
+def approve_group_membership(membership_id):
+    user = g.user
+
+    user_is_admin = (GroupMembership.query.filter_by(
+        user_id=user.id).one()).admin
+
+    if not user_is_admin:
+        return jsonify({"message": "Only memebers with administative access can perform this action"}), 401
+
+    membership = GroupMembership.query.filter_by(
+        id=membership_id).one_or_none()
+
+    if membership == None:
+        return jsonify({"message": "membership not found"}), 404
+
+    membership.approved = True
+
+    notification = Notification_messages(
+        user_id=membership.user.id, message=f"Your membership request to {membership.group.name} has been approved.")
+
+    db.session.add(membership)
+    db.session.add(notification)
+    db.session.commit()
+
+    return jsonify({"message": "Request was approved successfully"}), 201
+
+
+@app.route('/user/memberships/<membership_id>/decline-join', methods=["DELETE"])
+@login_required
+def decline_group_membership(membership_id):
+    user = g.user
+
+    user_is_admin = (GroupMembership.query.filter_by(
+        user_id=user.id).one()).admin
+
+    if not user_is_admin:
+        return jsonify({"message": "Only memebers with administative access can perform this action"}), 401
+
+    membership = GroupMembership.query.filter_by(
+        id=membership_id).one_or_none()
+
+    if membership == None:
+        return jsonify({"message": "membership not found"}), 404
+
+    notification = Notification_messages(
+        user_id=membership.user.id, message=f"Your membership request to {membership.group.name} has been decline.")
+
+    db.session.delete(membership)
+    db.session.add(notification)
+    db.session.commit()
+
+    return jsonify({"message": "Request was declined successfully"}), 204
+
+
+MAX_BATCH_IDS = 1000
+
+
+def parse_id_list(values):
+    """Parse a JSON list of UUID strings; raises ValueError for anything else."""
+    if not isinstance(values, list) or not values or len(values) > MAX_BATCH_IDS:
+        raise ValueError("Expected a list of ids")
+    try:
+        return list({uuid.UUID(value) for value in values})
+    except (TypeError, AttributeError):
+        raise ValueError("Expected a list of ids")
+
+
+def new_notification_rows(messages):
+    """Column values for bulk inserting (user_id, message) notifications."""
+    now = datetime.now()
+    return [
+        {"id": uuid.uuid4(), "user_id": user_id, "read": False, "message": message, "iat": now}
+        for user_id, message in messages
+    ]
+
+
+@app.route('/user/memberships/approve-join', methods=["POST"])
+@app.route('/user/memberships/decline-join', methods=["DELETE"])
+@login_required
+def approve_or_decline_memberships():
+    user = g.user
+    body = request.get_json()
+
+    try:
+        membership_ids = parse_id_list(body.get("membership_ids"))
+    except ValueError:
+        return jsonify({"message": "Invalid membership ids"}), 400
+
+    # Every request with its group's name and the caller's own membership
+    # in that group, so admin rights are checked once per group
+    caller = aliased(GroupMembership)
+    requests_ = db.session.execute(
+        db.select(
+            GroupMembership.id,
+            GroupMembership.group_id,
+            GroupMembership.approved,
+            Group.name,
+            caller.approved.label("caller_approved"),
+            caller.admin.label("caller_admin")
+        )
+        .join(Group, Group.id == GroupMembership.group_id)
+        .outerjoin(caller, and_(
+            caller.group_id == GroupMembership.group_id,
+            caller.user_id == user.id
+        ))
+        .where(GroupMembership.id.in_(membership_ids))
+    ).all()
+
+    if len(requests_) != len(membership_ids):
+        return jsonify({"message": "membership not found"}), 404
+
+    if not all(r.caller_approved and r.caller_admin for r in requests_):
+        return jsonify({"message": "Only members with administrative access can perform this action"}), 401
+
+    group_names = {r.group_id: r.name for r in requests_}
+    pending = GroupMembership.id.in_(membership_ids), GroupMembership.approved == False
+
+    if request.method == "POST":
+        changed = db.session.execute(
+            update(GroupMembership)
+            .where(*pending)
+            .values(approved=True)
+            .returning(GroupMembership.user_id, GroupMembership.group_id)
+            .execution_options(synchronize_session=False)
+        ).all()
+        verb = "approved"
+    else:
+        changed = db.session.execute(
+            delete(GroupMembership)
+            .where(*pending)
+            .returning(GroupMembership.user_id, GroupMembership.group_id)
+            .execution_options(synchronize_session=False)
+        ).all()
+        verb = "declined"
+
+    notification_rows = new_notification_rows(
+        (member_id, f"Your membership request to {group_names[member_group_id]} has been {verb}.")
+        for member_id, member_group_id in changed
+    )
+    if notification_rows:
+        db.session.execute(insert(Notification_messages), notification_rows)
+    db.session.commit()
+
+    # Core inserts bypass the session hooks
+    publish_notifications(notification_rows)
+
+    return jsonify({"message": f"Requests were {verb} successfully", "updated": len(changed)}), 200
+
+
+@app.route('/user/memberships/<membership_id>/admin-permissions', methods=["PATCH"])
+@login_required
+def edit_membership_permissions(membership_id):
+    user = g.user
+
+    body = request.get_json()
+    new_admin_permissions = body.get("set_admin_permissions")
+
+    if new_admin_permissions == None:
+        return jsonify({"message": "Required parameters are missing"}), 400
+
+    membership = GroupMembership.query.filter_by(
+        id=membership_id).one_or_none()
+
+    if membership == None:
+        return jsonify({"message": "membership not found"}), 404
+
+    user_membership = next(
+        (m for m in membership.group.members if m.id == user.id), None)
+
+    user_is_owner = user_membership.group.owner.id == user.id
+
+    if not user_is_owner:
+        return jsonify({"message": "Only the group owner can perform this action"}), 401
+
+    editing_admin = membership.user.id == membership.group.owner.id
+
+    if editing_admin:
+        return jsonify({"message": "Cannot modify the admin permission of the group owner"}), 403
+
+    membership.admin = new_admin_permissions
+
+    db.session.add(membership)
+    db.session.commit()
+
+    return jsonify({"message": "Group membership permissions for this user was updated successfully"}), 200
+
+
+def recurring_conflict_response():
+    return jsonify({"message": "This shift overlaps a recurring shift for the same member"}), 409
+
+
+def find_group_shift(group_id, shift_id):
+    """
+    Look up a shift of the group. Ids of recurring occurrences
+    ("<rule id>:<start>") are materialised into a Shift row first, so they
+    can be edited and swapped like any other shift.
+    """
+    if ":" in shift_id:
+        try:
+            rule_id, occurrence_start = parse_occurrence_id(shift_id)
+            rule_id = uuid.UUID(rule_id)
+        except ValueError:
+            return None
+        rule = Shift_recurrence.query.filter_by(
+            id=rule_id, group_id=group_id).one_or_none()
+        if rule is None:
+            return None
+        return materialize_occurrence(rule, occurrence_start)
+
+    try:
+        shift_id = uuid.UUID(shift_id)
+    except ValueError:
+        return None
+    return Shift.query.filter_by(id=shift_id, group_id=group_id).one_or_none()
+
+
+def shift_conflict_response():
+    # The exclusion constraint caught a shift written concurrently
+    return jsonify({"message": "This shift overlaps another shift for the same member, please try again"}), 409
+
+
+@app.route('/user/groups/<group_id>/shift', methods=["POST"])
+@login_required
+def create_new_shift(group_id):
+    user = g.user
+    body = request.get_json()
+    shift_owner_membership_id = body.get("shift_owner_membership_id")
+    start_time_iso = body.get("start_time_iso")
+    end_time_iso = body.get("end_time_iso")
+
+    user_membership = GroupMembership.query.filter_by(
+        user_id=user.id, group_id=group_id
+    ).one_or_none()
+
+    if user_membership is None:
+        return jsonify({"message": "membership not found"}), 404
+
+    if not user_membership.approved:
+        return jsonify({"message": "Your membership in this group is not approved"}), 401
+
+    if not user_membership.admin:
+        return jsonify({"message": "Only members with administrative access can perform this action"}), 401
+
+    if not shift_owner_membership_id or not start_time_iso or not end_time_iso:
+        return jsonify({"message": "Required parameters are missing"}), 400
+
+    shift_owner_membership = GroupMembership.query.filter_by(
+        user_id=shift_owner_membership_id,
+        group_id=group_id
+    ).one_or_none()
+
+    if not shift_owner_membership or not shift_owner_membership.approved:
+        return jsonify({
+            "message": "Assigned user does not have an approved membership to this group"
+        }), 404
+
+    try:
+        start_time = parse_iso(start_time_iso)
+        end_time = parse_iso(end_time_iso)
+    except ValueError:
+        return jsonify({"message": "Invalid start or end time"}), 400
+
+    if start_time >= end_time:
+        return jsonify({"message": "Shift must end after it starts"}), 400
+
+    if recurring_overlap(shift_owner_membership.user_id, start_time, end_time):
+        return recurring_conflict_response()
+
+    # Fold the assignee's overlapping shifts into the new one
+    start_time, end_time = merge_overlapping_shifts(
+        shift_owner_membership.user_id, start_time, end_time)
+
+    new_shift = Shift(
+        group_id=user_membership.group_id,
+        user_id=shift_owner_membership.user_id,
+        start_time=start_time,
+        end_time=end_time
+    )
+
+    notification = Notification_messages(
+        user_id=shift_owner_membership.user_id,
+        message=f"You've been assigned a new shift at {user_membership.group.name} from {new_shift.start_time} to {new_shift.end_time}."
+    )
+
+    db.session.add(new_shift)
+    db.session.add(notification)
+
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return shift_conflict_response()
+
+    return jsonify({"message": "Shift created successfully"}), 201
+
+
+MAX_SHIFT_BATCH = 1000
+
+
+@app.route('/user/groups/<group_id>/shifts/batch', methods=["POST"])
+@login_required
+def create_shift_batch(group_id):
+    user = g.user
+    body = request.get_json()
+    items = body.get("shifts")
+    mode = body.get("mode", "all_or_nothing")
+
+    user_membership = GroupMembership.query.filter_by(
+        user_id=user.id, group_id=group_id
+    ).one_or_none()
+
+    if user_membership is None:
+        return jsonify({"message": "membership not found"}), 404
+
+    if not user_membership.approved:
+        return jsonify({"message": "Your membership in this group is not approved"}), 401
+
+    if not user_membership.admin:
+        return jsonify({"message": "Only members with administrative access can perform this action"}), 401
+
+    if not isinstance(items, list) or not items:
+        return jsonify({"message": "Required parameters are missing"}), 400
+
+    if len(items) > MAX_SHIFT_BATCH:
+        return jsonify({"message": f"A batch can contain at most {MAX_SHIFT_BATCH} shifts"}), 400
+
+    if mode not in ("all_or_nothing", "best_effort"):
+        return jsonify({"message": "mode must be 'all_or_nothing' or 'best_effort'"}), 400
+
+    errors = {}
+    parsed = []
+
+    # 1. Parse every item, collecting per-item errors
+    for position, item in enumerate(items):
+        try:
+            assignee_id = uuid.UUID(item["shift_owner_membership_id"])
+            start_time = parse_iso(item["start_time_iso"])
+            end_time = parse_iso(item["end_time_iso"])
+        except (KeyError, TypeError, ValueError, AttributeError):
+            errors[position] = "Invalid or missing shift parameters"
+            continue
+
+        if start_time >= end_time:
+            errors[position] = "Shift must end after it starts"
+            continue
+
+        parsed.append((position, assignee_id, start_time, end_time))
+
+    # 2. Every assignee's membership in one query
+    assignee_ids = {assignee_id for _, assignee_id, _, _ in parsed}
+    approved_ids = set(db.session.execute(
+        db.select(GroupMembership.user_id)
+        .where(
+            GroupMembership.group_id == user_membership.group_id,
+            GroupMembership.approved == True,
+            GroupMembership.user_id.in_(assignee_ids)
+        )
+    ).scalars()) if assignee_ids else set()
+
+    for position, assignee_id, _, _ in parsed:
+        if assignee_id not in approved_ids:
+            errors[position] = "Assigned user does not have an approved membership to this group"
+    parsed = [item for item in parsed if item[0] not in errors]
+
+    # 3. Overlaps within the batch and against stored shifts, in one sweep
+    #    over the stored shifts that intersect the batch's overall window
+    existing = []
+    if parsed:
+        window_start = min(item[2] for item in parsed)
+        window_end = max(item[3] for item in parsed)
+        existing = db.session.execute(
+            db.select(Shift.id, Shift.user_id, Shift.start_time, Shift.end_time)
+            .where(
+                Shift.user_id.in_({item[1] for item in parsed}),
+                Shift.during.op('&&')(shift_range(window_start, window_end))
+            )
+        ).all()
+
+        # Recurring occurrences count as stored shifts too
+        existing += [
+            (occurrence_id(rule.id, start), rule.user_id, start, end)
+            for rule, start, end in user_occurrences(
+                {item[1] for item in parsed}, window_start, window_end)
+        ]
+
+    errors.update(sweep_batch_overlaps(parsed, existing))
+    accepted = [item for item in parsed if item[0] not in errors]
+
+    error_list = [
+        {"index": position, "message": message}
+        for position, message in sorted(errors.items())
+    ]
+
+    if errors and mode == "all_or_nothing":
+        return jsonify({
+            "message": "No shifts were created because some shifts are invalid",
+            "errors": error_list
+        }), 422
+
+    if not accepted:
+        return jsonify({"message": "No shifts were created", "created": [], "errors": error_list}), 422
+
+    # 4. Insert every shift and one coalesced notification per assignee in
+    #    a single transaction
+    shift_rows = [
+        {
+            "id": uuid.uuid4(),
+            "group_id": user_membership.group_id,
+            "user_id": assignee_id,
+            "start_time": start_time,
+            "end_time": end_time
+        }
+        for _, assignee_id, start_time, end_time in accepted
+    ]
+
+    shifts_by_assignee = {}
+    for row in shift_rows:
+        shifts_by_assignee.setdefault(row["user_id"], []).append(row)
+
+    group_name = user_membership.group.name
+    now = datetime.now()
+    notification_rows = []
+    for assignee_id, assignee_shifts in shifts_by_assignee.items():
+        first_start = min(row["start_time"] for row in assignee_shifts)
+        last_end = max(row["end_time"] for row in assignee_shifts)
+        if len(assignee_shifts) == 1:
+            message = f"You've been assigned a new shift at {group_name} from {first_start} to {last_end}."
+        else:
+            message = (
+                f"You've been assigned {len(assignee_shifts)} new shifts at {group_name} "
+                f"between {first_start} and {last_end}."
+            )
+        notification_rows.append({
+            "id": uuid.uuid4(),
+            "user_id": assignee_id,
+            "read": False,
+            "message": message,
+            "iat": now
+        })
+
+    try:
+        # Core inserts run straight away, so a concurrent overlap can fail here
+        db.session.execute(insert(Shift), shift_rows)
+        db.session.execute(insert(Notification_messages), notification_rows)
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return shift_conflict_response()
+
+    # Core inserts bypass the session hooks
+    schedule_indexes.invalidate(user_membership.group_id)
+    publish_notifications(notification_rows)
+
+    return jsonify({
+        "message": "Shifts created successfully",
+        "created": [
+            {"index": position, "id": row["id"]}
+            for (position, _, _, _), row in zip(accepted, shift_rows)
+        ],
+        "errors": error_list
+    }), 201
+
+
+@app.route('/user/groups/<group_id>/auto-assign', methods=["POST"])
+@login_required
+def propose_auto_assignment(group_id):
+    user = g.user
+    body = request.get_json()
+
+    membership = GroupMembership.query.filter_by(
+        user_id=user.id, group_id=group_id).one_or_none()
+
+    if membership is None:
+        return jsonify({"message": "membership not found"}), 404
+
+    if not membership.approved or not membership.admin:
+        return jsonify({"message": "Only members with administrative access can perform this action"}), 401
+
+    start_time_iso = body.get("start_time_iso")
+    end_time_iso = body.get("end_time_iso")
+
+    if not start_time_iso or not end_time_iso:
+        return jsonify({"message": "Required parameters are missing"}), 400
+
+    try:
+        start_time = parse_iso(start_time_iso)
+        end_time = parse_iso(end_time_iso)
+        max_hours_per_week = float(body.get("max_hours_per_week", 40))
+        min_rest_hours = float(body.get("min_rest_hours", 8))
+    except (ValueError, TypeError):
+        return jsonify({"message": "Invalid auto-assign parameters"}), 400
+
+    if start_time >= end_time:
+        return jsonify({"message": "Start time must be before end time"}), 400
+
+    if max_hours_per_week <= 0 or min_rest_hours < 0:
+        return jsonify({"message": "Invalid auto-assign parameters"}), 400
+
+    # Read before solving, so a change made while solving makes the
+    # proposal stale rather than silently outdated. The members' own
+    # versions cover their shifts in other groups, which count towards
+    # their hours and rest periods too.
+    version = get_version('group', membership.group_id)
+    member_versions = get_versions('user', db.session.execute(
+        db.select(GroupMembership.user_id)
+        .where(GroupMembership.group_id == membership.group_id, GroupMembership.approved == True)
+    ).scalars().all())
+
+    proposal = propose_assignments(
+        membership.group_id, start_time, end_time, max_hours_per_week, min_rest_hours)
+
+    if proposal is None:
+        return jsonify({"message": f"More than {MAX_OPEN_SHIFTS} open shifts; use a shorter window"}), 400
+
+    assignments, unassigned = proposal
+
+    return jsonify({
+        "version": version,
+        "user_versions": {
+            str(assignee_id): member_versions[assignee_id]
+            for assignee_id in {assignee_id for _, assignee_id, _, _ in assignments}
+        },
+        "assignments": [
+            {"shift_id": shift_id, "user_id": assignee_id, "start_time": start, "end_time": end}
+            for shift_id, assignee_id, start, end in assignments
+        ],
+        "unassigned": unassigned
+    }), 200
+
+
+@app.route('/user/groups/<group_id>/auto-assign/commit', methods=["POST"])
+@login_required
+def commit_auto_assignment(group_id):
+    user = g.user
+    body = request.get_json()
+
+    membership = GroupMembership.query.filter_by(
+        user_id=user.id, group_id=group_id).one_or_none()
+
+    if membership is None:
+        return jsonify({"message": "membership not found"}), 404
+
+    if not membership.approved or not membership.admin:
+        return jsonify({"message": "Only members with administrative access can perform this action"}), 401
+
+    version = body.get("version")
+    user_versions = body.get("user_versions")
+    items = body.get("assignments")
+
+    if version is None or not isinstance(user_versions, dict) or not isinstance(items, list) or not items:
+        return jsonify({"message": "Required parameters are missing"}), 400
+
+    try:
+        assignments = [
+            (uuid.UUID(item["shift_id"]), uuid.UUID(item["user_id"])) for item in items]
+    except (ValueError, TypeError, KeyError, AttributeError):
+        return jsonify({"message": "Invalid assignments"}), 400
+
+    if len({shift_id for shift_id, _ in assignments}) != len(assignments):
+        return jsonify({"message": "A shift is assigned more than once"}), 400
+
+    # Anything that changed the group since the proposal was made could
+    # invalidate it; the admin asks for a fresh one instead
+    if get_version('group', membership.group_id) != version:
+        return jsonify({"message": "The schedule changed since this proposal was made"}), 409
+
+    # The same goes for each assignee's schedule elsewhere. A version bump
+    # can also come from a new notification, which only costs a re-run.
+    assignee_ids = {assignee_id for _, assignee_id in assignments}
+    current_versions = get_versions('user', assignee_ids)
+    if any(user_versions.get(str(assignee_id)) != current_versions[assignee_id]
+           for assignee_id in assignee_ids):
+        return jsonify({"message": "The schedule changed since this proposal was made"}), 409
+
+    approved = db.session.execute(
+        db.select(db.func.count())
+        .select_from(GroupMembership)
+        .where(
+            GroupMembership.group_id == membership.group_id,
+            GroupMembership.user_id.in_(assignee_ids),
+            GroupMembership.approved == True
+        )
+    ).scalar()
+
+    if approved != len(assignee_ids):
+        return jsonify({"message": "Assigned user does not have an approved membership to this group"}), 404
+
+    try:
+        updated = apply_assignments(membership.group_id, assignments)
+        if len(updated) != len(assignments):
+            db.session.rollback()
+            return jsonify({"message": "Some shifts are no longer open"}), 409
+
+        counts = {}
+        for _, assignee_id, _, _ in updated:
+            counts[assignee_id] = counts.get(assignee_id, 0) + 1
+        db.session.add_all([
+            Notification_messages(
+                user_id=assignee_id,
+                message=f"You've been assigned {count} new shift{'s' if count > 1 else ''} at {membership.group.name}."
+            )
+            for assignee_id, count in counts.items()
+        ])
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return shift_conflict_response()
+
+    # The UPDATE bypassed the ORM, so the session hooks didn't see it
+    schedule_indexes.invalidate(membership.group_id)
+
+    return jsonify({"assigned": len(updated)}), 200
+
+
+@app.route('/user/groups/<group_id>/shift/<shift_id>', methods=["PUT", "DELETE"])
+@login_required
+def modify_or_delete_shift(group_id, shift_id):
+    user = g.user
+
+    membership = GroupMembership.query.filter_by(
+        user_id=user.id, group_id=group_id
+    ).one_or_none()
+
+    if membership is None:
+        return jsonify({"message": "membership not found"}), 404
+    if not membership.approved:
+        return jsonify({"message": "Your membership in this group is not approved"}), 401
+    if not membership.admin:
+        return jsonify({"message": "Only memebers with administrative access can perform this action"}), 401
+
+    shift = find_group_shift(membership.group_id, shift_id)
+    if shift is None:
+        return jsonify({"message": "Shift not found"}), 404
 
     if request.method == "PUT":
         body = request.get_json()
@@ -652,39 +2096,31 @@ def modify_or_delete_shift(group_id, shift_id):
             }), 404
 
         initial_shift_data = shift.get_details()
-        reassign_shift_owner = (shift.assigned_owner.id ==
-                                shift_owner_membership_id)
-
-        # FIX: parse trailing 'Z' by replacing it with '+00:00'
-        def parse_iso(iso_str):
-            if iso_str.endswith('Z'):
-                iso_str = iso_str[:-1] + '+00:00'
-            return datetime.fromisoformat(iso_str)
-
-        shift.group_id = membership.group.id
-        shift.user_id = shift_owner_membership.user.id
-        shift.start_time = parse_iso(start_time_iso)
-        shift.end_time = parse_iso(end_time_iso)
-
-        # The rest of your overlap & notification logic unchanged...
-        start_overlaping_shift = next(
-            (overlap_shift for overlap_shift in shift_owner_membership.user.assigned_shifts
-             if shift.end_time > overlap_shift.start_time),
-            None
-        )
-        end_overlaping_shift = next(
-            (overlap_shift for overlap_shift in shift_owner_membership.user.assigned_shifts
-             if overlap_shift.start_time < shift.end_time),
-            None
-        )
+        reassign_shift_owner = shift.user_id != shift_owner_membership.user_id
+
+        try:
+            start_time = parse_iso(start_time_iso)
+            end_time = parse_iso(end_time_iso)
+        except ValueError:
+            return jsonify({"message": "Invalid start or end time"}), 400
 
-        if start_overlaping_shift is not None:
-            db.session.delete(start_overlaping_shift)
-            shift.start_time = start_overlaping_shift.start_time
+        if start_time >= end_time:
+            return jsonify({"message": "Shift must end after it starts"}), 400
 
-        if end_overlaping_shift is not None:
-            db.session.delete(end_overlaping_shift)
-            shift.end_time = end_overlaping_shift.end_time
+        if recurring_overlap(shift_owner_membership.user_id, start_time, end_time):
+            return recurring_conflict_response()
+
+        # Fold the assignee's other overlapping shifts into this one. Done
+        # before the shift is changed so the lookup's autoflush doesn't
+        # write the new range while the overlapping rows still exist.
+        start_time, end_time = merge_overlapping_shifts(
+            shift_owner_membership.user_id, start_time, end_time,
+            exclude_shift_id=shift.id)
+
+        shift.group_id = membership.group_id
+        shift.user_id = shift_owner_membership.user_id
+        shift.start_time = start_time
+        shift.end_time = end_time
 
         if not reassign_shift_owner:
             notification = Notification_messages(
@@ -696,13 +2132,16 @@ def modify_or_delete_shift(group_id, shift_id):
             )
             db.session.add(notification)
         else:
-            previous_owner_notification = Notification_messages(
-                user_id=initial_shift_data['user_id'],
-                message=(
-                    f"Your shift at {membership.group.name} from {initial_shift_data['start_time']} "
-                    f"to {initial_shift_data['end_time']} was unassigned."
+            # Open shifts have no previous owner to tell
+            if initial_shift_data['user_id'] is not None:
+                previous_owner_notification = Notification_messages(
+                    user_id=initial_shift_data['user_id'],
+                    message=(
+                        f"Your shift at {membership.group.name} from {initial_shift_data['start_time']} "
+                        f"to {initial_shift_data['end_time']} was unassigned."
+                    )
                 )
-            )
+                db.session.add(previous_owner_notification)
             new_owner_notification = Notification_messages(
                 user_id=shift_owner_membership.user.id,
                 message=(
@@ -710,24 +2149,30 @@ def modify_or_delete_shift(group_id, shift_id):
                     f"from {shift.start_time} to {shift.end_time}."
                 )
             )
-            db.session.add(previous_owner_notification)
             db.session.add(new_owner_notification)
 
         db.session.add(shift)
-        db.session.commit()
+
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            return shift_conflict_response()
+
         return jsonify({"message": "Shift modified successfully"}), 200
 
     elif request.method == "DELETE":
         initial_shift_data = shift.get_details()
-        notification = Notification_messages(
-            user_id=shift.assigned_owner.id,
-            message=(
-                f"Your shift at {membership.group.name} from {initial_shift_data['start_time']} "
-                f"to {initial_shift_data['end_time']} was unassigned."
+        if shift.user_id is not None:
+            notification = Notification_messages(
+                user_id=shift.user_id,
+                message=(
+                    f"Your shift at {membership.group.name} from {initial_shift_data['start_time']} "
+                    f"to {initial_shift_data['end_time']} was unassigned."
+                )
             )
-        )
+            db.session.add(notification)
         db.session.delete(shift)
-        db.session.add(notification)
         db.session.commit()
         return jsonify({"message": "Shift deleted successfully"}), 204
 
@@ -750,13 +2195,13 @@ def create_new_shift_swap(group_id, shift_id):
     if user_membership == None:
         return jsonify({"message": "You do not have a membership to this group"}), 401
 
-    shift = Shift.query.filter_by(
-        user_id=shift_id).one_or_none()
+    shift = find_group_shift(membership.group_id, shift_id)
 
     if shift == None:
         return jsonify({"message": "Shift not found"}), 404
 
-    shift_swap = Shift_swap(shift_id=shift.id, current_owner_id=shift.current_owner.id,
+    shift_swap = Shift_swap(shift_id=shift.id, group_id=shift.group_id,
+                            current_owner_id=shift.user_id,
                             new_owner_id=None, approved_by_admin_id=None)
 
     db.session.add(shift_swap)
@@ -765,6 +2210,99 @@ def create_new_shift_swap(group_id, shift_id):
     return jsonify({"message": "Shift swap request created successfully"}), 201
 
 
+@app.route('/user/groups/<group_id>/shift-swaps/open', methods=["GET"])
+@login_required
+def list_open_shift_swaps(group_id):
+    user = g.user
+
+    membership = GroupMembership.query.filter_by(
+        user_id=user.id, group_id=group_id).one_or_none()
+
+    if membership is None:
+        return jsonify({"message": "membership not found"}), 404
+
+    if not membership.approved:
+        return jsonify({"message": "Your membership in this group is not approved"}), 401
+
+    # Who is free depends on the members' shifts in every group, which
+    # only their own versions track
+    group_version, members_version = db.session.execute(db.select(
+        version_subquery('group', membership.group_id),
+        members_version_subquery(membership.group_id)
+    )).one()
+    etag = make_etag('group', membership.group_id, group_version, members_version, user.id)
+    cached = not_modified(etag)
+    if cached is not None:
+        return cached
+
+    # Every open swap with the approved members who are free for it, in one
+    # statement: the anti-join probes the GiST index on (user_id, during)
+    # once per candidate instead of issuing a query per member
+    other = aliased(Shift)
+    swaps = db.session.execute(
+        db.select(
+            Shift_swap.id,
+            Shift_swap.current_owner_id,
+            Shift.id.label("shift_id"),
+            Shift.start_time,
+            Shift.end_time,
+            db.func.array_agg(GroupMembership.user_id)
+            .filter(GroupMembership.user_id.isnot(None)).label("eligible")
+        )
+        .join(Shift, Shift.id == Shift_swap.shift_id)
+        .outerjoin(GroupMembership, and_(
+            GroupMembership.group_id == Shift_swap.group_id,
+            GroupMembership.approved == True,
+            GroupMembership.user_id != Shift_swap.current_owner_id,
+            ~db.exists().where(
+                other.user_id == GroupMembership.user_id,
+                other.during.op('&&')(Shift.during)
+            )
+        ))
+        .where(Shift_swap.group_id == membership.group_id, Shift_swap.new_owner_id.is_(None))
+        .group_by(Shift_swap.id, Shift.id)
+        .order_by(Shift.start_time, Shift_swap.id)
+    ).all()
+
+    # Recurring occurrences have no rows to anti-join against
+    busy = {}
+    if swaps:
+        for rule, start, end in occurrences_for_group_members(
+                membership.group_id,
+                min(swap.start_time for swap in swaps),
+                max(swap.end_time for swap in swaps)):
+            busy.setdefault(str(rule.user_id), []).append((start, end))
+
+    return tag(jsonify({
+        "swaps": [
+            {
+                "id": swap.id,
+                "current_owner_id": swap.current_owner_id,
+                "shift": {
+                    "id": swap.shift_id,
+                    "start_time": swap.start_time,
+                    "end_time": swap.end_time
+                },
+                "eligible_member_ids": [
+                    member_id for member_id in map(str, swap.eligible or [])
+                    if not any(start < swap.end_time and end > swap.start_time
+                               for start, end in busy.get(member_id, ()))
+                ]
+            }
+            for swap in swaps
+        ]
+    }), etag), 200
+
+
+def occurrences_for_group_members(group_id, start_time, end_time):
+    """Recurring occurrences, in any group, of the group's approved members."""
+    member_ids = db.session.execute(
+        db.select(GroupMembership.user_id)
+        .where(GroupMembership.group_id == group_id, GroupMembership.approved == True)
+    ).scalars().all()
+    return user_occurrences(member_ids, start_time, end_time) if member_ids else ()
+
+
 @app.route('/user/groups/<group_id>/shift/<shift_id>/shift-swap/<swap_id>/link', methods=["POST"])
 @login_required
 def link_shift_swap(group_id, shift_id, swap_id):
@@ -783,66 +2321,64 @@ def link_shift_swap(group_id, shift_id, swap_id):
     if user_membership == None:
         return jsonify({"message": "You do not have a membership to this group"}), 401
 
-    shift = Shift.query.filter_by(
-        user_id=shift_id).one_or_none()
+    shift = find_group_shift(membership.group_id, shift_id)
 
     if shift == None:
         return jsonify({"message": "Shift not found"}), 404
 
     shift_swap = Shift_swap.query.filter_by(
-        user_id=swap_id).one_or_none()
+        id=swap_id, shift_id=shift.id).one_or_none()
 
     if shift_swap == None:
         return jsonify({"message": "Swap not found"}), 404
 
-    shift_swap.new_owner_id = user.id
+    current_shift_owner_membership = GroupMembership.query.filter_by(
+        user_id=shift_swap.current_owner_id, group_id=membership.group_id).one_or_none()
 
-    db.session.add(shift_swap)
-    db.session.commit()
+    initial_shift_data = shift.get_details()
 
-    current_shift_owner = User.query.filter_by(
-        user_id=shift_swap.current_owner.id).one_or_none()
+    # Nothing is written until every check has passed, so a rejected link
+    # leaves the swap unclaimed
+    if membership.admin or (current_shift_owner_membership is not None
+                            and current_shift_owner_membership.admin):
 
-    current_shift_owner_membership = GroupMembership.query.filter_by(
-        user_id=current_shift_owner.id, group_id=membership.group_id).one()
+        if recurring_overlap(user.id, shift.start_time, shift.end_time):
+            return recurring_conflict_response()
 
-    initial_shift_data = shift.get_details()
+        # Fold the new owner's overlapping shifts into the swapped shift
+        shift.start_time, shift.end_time = merge_overlapping_shifts(
+            user.id, shift.start_time, shift.end_time, exclude_shift_id=shift.id)
 
-    if membership.admin or current_shift_owner_membership.admin:
+        shift.user_id = user.id
+        shift_swap.new_owner_id = user.id
+        shift_swap.approved_by_admin_id = (
+            user.id if membership.admin else current_shift_owner_membership.user_id)
 
-        start_overlaping_shift = next(
-            (overlap_shift for overlap_shift in user.assigned_shifts if shift.end_time >
-             overlap_shift.start_time),
-            None
-        )
+        db.session.add(shift)
+        db.session.add(shift_swap)
 
-        end_overlaping_shift = next(
-            (overlap_shift for overlap_shift in user.assigned_shifts if overlap_shift.start_time <
-             shift.end_time),
-            None
-        )
+        if initial_shift_data['user_id'] is not None:
+            notification = Notification_messages(
+                user_id=initial_shift_data['user_id'], message=f"Your shift at {membership.group.name} from {initial_shift_data['start_time']} to {initial_shift_data['end_time']}, was unassigned via a shift swap request.")
+            db.session.add(notification)
 
-        if start_overlaping_shift != None:
-            db.session.delete(start_overlaping_shift)
-            shift.start_time = start_overlaping_shift.start_time
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            return shift_conflict_response()
 
-        if end_overlaping_shift != None:
-            db.session.delete(end_overlaping_shift)
-            shift.end_time = end_overlaping_shift.end_time
+        return jsonify({"message": "Shift swap was completed successfully"}), 200
 
-        shift.user_id = user.id
+    shift_swap.new_owner_id = user.id
+    db.session.add(shift_swap)
 
+    if initial_shift_data['user_id'] is not None:
         notification = Notification_messages(
-            user_id=initial_shift_data.user_id, message=f"Your shift at {membership.group.name} from {initial_shift_data.start_time.strftime()} to {initial_shift_data.end_time.strftime()}, was unassigned via a shift swap request.")
-
-        db.session.add(shift)
+            user_id=initial_shift_data['user_id'], message=f"A group member requested to take shift at {membership.group.name} from {initial_shift_data['start_time']} to {initial_shift_data['end_time']} via a shift swap request, awaiting admin approval.")
         db.session.add(notification)
-        db.session.commit()
-
-        return jsonify({"message": "Shift swap was completed successfully"}), 200
 
-    notification = Notification_messages(
-        user_id=initial_shift_data.user_id, message=f"A group member requested to take shift at {membership.group.name} from {initial_shift_data.start_time.strftime()} to {initial_shift_data.end_time.strftime()} via a shift swap request, awaiting admin approval.")
+    db.session.commit()
 
     return jsonify({"message": "Shift swap request linked successfully awaiting admin approval"}), 200
 
@@ -865,64 +2401,215 @@ def approve_shift_swap(group_id, shift_id, swap_id):
     if user_membership == None:
         return jsonify({"message": "You do not have a membership to this group"}), 401
 
-    user_is_admin = user_membership.admin
+    user_is_admin = membership.admin
 
     if not user_is_admin:
         return jsonify({"message": "Only memebers with administative access can perform this action"}), 401
 
-    shift = Shift.query.filter_by(
-        user_id=shift_id).one_or_none()
+    shift = find_group_shift(membership.group_id, shift_id)
 
     if shift == None:
         return jsonify({"message": "Shift not found"}), 404
 
     shift_swap = Shift_swap.query.filter_by(
-        user_id=swap_id).one_or_none()
+        id=swap_id, shift_id=shift.id).one_or_none()
 
     if shift_swap == None:
         return jsonify({"message": "Swap not found"}), 404
 
+    if shift_swap.new_owner_id == None:
+        return jsonify({"message": "No group member has requested this shift yet"}), 400
+
+    if shift_swap.approved_by_admin_id is not None:
+        return jsonify({"message": "This shift swap was already approved"}), 409
+
     initial_shift_data = shift.get_details()
 
     shift_swap.approved_by_admin_id = user.id
 
     db.session.add(shift_swap)
 
-    start_overlaping_shift = next(
-        (overlap_shift for overlap_shift in user.assigned_shifts if shift.end_time >
-         overlap_shift.start_time),
-        None
-    )
-
-    end_overlaping_shift = next(
-        (overlap_shift for overlap_shift in user.assigned_shifts if overlap_shift.start_time <
-         shift.end_time),
-        None
-    )
+    if recurring_overlap(shift_swap.new_owner_id, shift.start_time, shift.end_time):
+        return recurring_conflict_response()
 
-    if start_overlaping_shift != None:
-        db.session.delete(start_overlaping_shift)
-        shift.start_time = start_overlaping_shift.start_time
+    # The shift goes to the member who took the swap, so it's their
+    # overlapping shifts that get folded into it
+    shift.start_time, shift.end_time = merge_overlapping_shifts(
+        shift_swap.new_owner_id, shift.start_time, shift.end_time,
+        exclude_shift_id=shift.id)
 
-    if end_overlaping_shift != None:
-        db.session.delete(end_overlaping_shift)
-        shift.end_time = end_overlaping_shift.end_time
+    shift.user_id = shift_swap.new_owner_id
 
-    previous_owner_notification = Notification_messages(
-        user_id=initial_shift_data.user_id, message=f"Your shift at {membership.group.name} from {initial_shift_data.start_time.strftime()} to {initial_shift_data.end_time.strftime()} was unassigned via a shift swap request.")
+    # An open shift has no previous owner to tell
+    if initial_shift_data['user_id'] is not None:
+        previous_owner_notification = Notification_messages(
+            user_id=initial_shift_data['user_id'], message=f"Your shift at {membership.group.name} from {initial_shift_data['start_time']} to {initial_shift_data['end_time']} was unassigned via a shift swap request.")
+        db.session.add(previous_owner_notification)
     new_owner_notification = Notification_messages(
-        user_id=shift.user_id, message=f"You've been assigned a new shift at {membership.group.name} from {shift.start_time.strftime()} to {shift.end_time.strftime()} via a shift swap request.")
-
-    shift.user_id = user.id
+        user_id=shift.user_id, message=f"You've been assigned a new shift at {membership.group.name} from {shift.start_time} to {shift.end_time} via a shift swap request.")
 
     db.session.add(shift)
-    db.session.add(previous_owner_notification)
     db.session.add(new_owner_notification)
-    db.session.commit()
+
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return shift_conflict_response()
 
     return jsonify({"message": "Shift swap was successfully approved"}), 200
 
 
+@app.route('/user/groups/<group_id>/shift-swaps/approve', methods=["POST"])
+@app.route('/user/groups/<group_id>/shift-swaps/decline', methods=["DELETE"])
+@login_required
+def approve_or_decline_shift_swaps(group_id):
+    user = g.user
+    body = request.get_json()
+
+    membership = GroupMembership.query.filter_by(
+        user_id=user.id, group_id=group_id).one_or_none()
+
+    if membership is None:
+        return jsonify({"message": "membership not found"}), 404
+
+    if not membership.approved or not membership.admin:
+        return jsonify({"message": "Only members with administrative access can perform this action"}), 401
+
+    try:
+        swap_ids = parse_id_list(body.get("swap_ids"))
+    except ValueError:
+        return jsonify({"message": "Invalid swap ids"}), 400
+
+    swaps = db.session.execute(
+        db.select(
+            Shift_swap.id,
+            Shift_swap.current_owner_id,
+            Shift_swap.new_owner_id,
+            Shift_swap.approved_by_admin_id,
+            Shift.id.label("shift_id"),
+            Shift.user_id,
+            Shift.start_time,
+            Shift.end_time
+        )
+        .join(Shift, Shift.id == Shift_swap.shift_id)
+        .where(Shift_swap.id.in_(swap_ids), Shift_swap.group_id == membership.group_id)
+        # The swaps are locked too, so two admins can't both act on the
+        # same pending swap
+        .with_for_update(of=(Shift, Shift_swap))
+    ).all()
+
+    if len(swaps) != len(swap_ids):
+        return jsonify({"message": "Swap not found"}), 404
+
+    # Completed swaps can still be deleted, but not approved or declined again
+    completed = [swap.id for swap in swaps if swap.approved_by_admin_id is not None]
+    if completed and not (request.method == "DELETE" and body.get("delete_request") == True):
+        return jsonify({"message": "Some shift swaps were already approved", "swap_ids": completed}), 409
+
+    group_name = membership.group.name
+
+    if request.method == "DELETE":
+        delete_request = body.get("delete_request")
+
+        if delete_request is None:
+            return jsonify({"message": "Required parameters are missing"}), 400
+
+        if delete_request == True:
+            db.session.execute(
+                delete(Shift_swap).where(Shift_swap.id.in_(swap_ids))
+                .execution_options(synchronize_session=False))
+            reason = "removed"
+        else:
+            db.session.execute(
+                update(Shift_swap).where(Shift_swap.id.in_(swap_ids))
+                .values(new_owner_id=None)
+                .execution_options(synchronize_session=False))
+            reason = "declined"
+
+        notification_rows = new_notification_rows(
+            (swap.current_owner_id,
+             f"Your shift swap request at {group_name} from {swap.start_time} to {swap.end_time}, failed because it was {reason} by an admin.")
+            for swap in swaps if swap.current_owner_id != user.id
+        )
+        if notification_rows:
+            db.session.execute(insert(Notification_messages), notification_rows)
+        db.session.commit()
+        publish_notifications(notification_rows)
+
+        return jsonify({"message": f"Shift swap requests were {reason} successfully", "updated": len(swaps)}), 200
+
+    unclaimed = [swap.id for swap in swaps if swap.new_owner_id is None]
+    if unclaimed:
+        return jsonify({"message": "No group member has requested these shifts yet", "swap_ids": unclaimed}), 400
+
+    if len({swap.shift_id for swap in swaps}) != len(swaps):
+        return jsonify({"message": "A shift can only be swapped once per batch"}), 400
+
+    # Unlike a single approval, a batch doesn't fold overlapping shifts into
+    # the swapped ones: every new owner must be free, or nothing is applied
+    swapped_ids = [swap.shift_id for swap in swaps]
+    new_owner_ids = {swap.new_owner_id for swap in swaps}
+    window_start = min(swap.start_time for swap in swaps)
+    window_end = max(swap.end_time for swap in swaps)
+    existing = db.session.execute(
+        db.select(Shift.id, Shift.user_id, Shift.start_time, Shift.end_time)
+        .where(
+            Shift.user_id.in_(new_owner_ids),
+            Shift.id.not_in(swapped_ids),
+            Shift.during.op('&&')(shift_range(window_start, window_end))
+        )
+    ).all()
+    existing += [
+        (occurrence_id(rule.id, start), rule.user_id, start, end)
+        for rule, start, end in user_occurrences(new_owner_ids, window_start, window_end)
+    ]
+    conflicts = sweep_batch_overlaps(
+        [(swap.id, swap.new_owner_id, swap.start_time, swap.end_time) for swap in swaps],
+        existing
+    )
+    if conflicts:
+        return jsonify({
+            "message": "Some new owners already have overlapping shifts",
+            "conflicts": [{"swap_id": swap_id, "message": message} for swap_id, message in conflicts.items()]
+        }), 409
+
+    messages = []
+    for swap in swaps:
+        if swap.user_id is not None:
+            messages.append((swap.user_id,
+                             f"Your shift at {group_name} from {swap.start_time} to {swap.end_time} was unassigned via a shift swap request."))
+        messages.append((swap.new_owner_id,
+                         f"You've been assigned a new shift at {group_name} from {swap.start_time} to {swap.end_time} via a shift swap request."))
+    notification_rows = new_notification_rows(messages)
+
+    try:
+        # Core statements run straight away, so the exclusion constraint
+        # can reject a racing writer's overlap here, not only at commit
+        db.session.execute(
+            update(Shift)
+            .where(Shift.id == Shift_swap.shift_id, Shift_swap.id.in_(swap_ids))
+            .values(user_id=Shift_swap.new_owner_id)
+            .execution_options(synchronize_session=False)
+        )
+        db.session.execute(
+            update(Shift_swap).where(Shift_swap.id.in_(swap_ids))
+            .values(approved_by_admin_id=user.id)
+            .execution_options(synchronize_session=False)
+        )
+        db.session.execute(insert(Notification_messages), notification_rows)
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return shift_conflict_response()
+
+    # Core statements bypass the session hooks
+    schedule_indexes.invalidate(membership.group_id)
+    publish_notifications(notification_rows)
+
+    return jsonify({"message": "Shift swaps were successfully approved", "updated": len(swaps)}), 200
+
+
 @app.route('/user/groups/<group_id>/shift/<shift_id>/shift-swap/<swap_id>/decline', methods=["DELETE"])
 @login_required
 def decline_shift_swap(group_id, shift_id, swap_id):
@@ -941,33 +2628,37 @@ def decline_shift_swap(group_id, shift_id, swap_id):
     if user_membership == None:
         return jsonify({"message": "You do not have a membership to this group"}), 401
 
-    shift = Shift.query.filter_by(
-        user_id=shift_id).one_or_none()
+    shift = find_group_shift(membership.group_id, shift_id)
 
     if shift == None:
         return jsonify({"message": "Shift not found"}), 404
 
     shift_swap = Shift_swap.query.filter_by(
-        user_id=swap_id).one_or_none()
+        id=swap_id, shift_id=shift.id).one_or_none()
 
     if shift_swap == None:
         return jsonify({"message": "Swap not found"}), 404
 
-    user_is_admin = user_membership.admin
-    user_is_current_shift_owner = shift_swap.current_owner.id != user.id
-    user_is_new_shift_owner = shift_swap.new_owner.id != user.id
+    user_is_admin = membership.admin
+    user_is_current_shift_owner = shift_swap.current_owner_id == user.id
+    user_is_new_shift_owner = shift_swap.new_owner_id == user.id
 
     if not (user_is_admin or user_is_current_shift_owner or user_is_new_shift_owner):
         return jsonify({"message": "You do not have permission to perform this action"}), 401
 
+    shift_times = (f"from {shift.start_time.strftime('%Y-%m-%d %H:%M')} "
+                   f"to {shift.end_time.strftime('%Y-%m-%d %H:%M')}")
+
     if user_is_new_shift_owner:
         shift_swap.new_owner_id = None
+        db.session.add(shift_swap)
 
-        notification = Notification_messages(
-            user_id=shift.assigned_owner.id, message=f"Your shift swap request at {membership.group.name} from {shift.start_time.strftime()} to {shift.end_time.strftime()}, failed because the group member removed their request.")
+        if shift_swap.current_owner_id is not None:
+            notification = Notification_messages(
+                user_id=shift_swap.current_owner_id, message=f"Your shift swap request at {membership.group.name} {shift_times}, failed because the group member removed their request.")
+            db.session.add(notification)
 
-        db.session.add(shift_swap)
-        db.session.add(notification)
+        db.session.commit()
         return jsonify({"message": "You have been successfully unlinked from the shift swap"}), 204
 
     body = request.get_json()
@@ -976,12 +2667,15 @@ def decline_shift_swap(group_id, shift_id, swap_id):
     if delete_request == None:
         return jsonify({"message": "Required parameters are missing"}), 400
 
+    notify_current_owner = (not user_is_current_shift_owner
+                            and shift_swap.current_owner_id is not None)
+
     if delete_request == True:
         db.session.delete(shift_swap)
 
-        if not user_is_current_shift_owner:
+        if notify_current_owner:
             notification = Notification_messages(
-                user_id=shift.assigned_owner.id, message=f"Your shift swap request at {membership.group.name} from {shift.start_time.strftime()} to {shift.end_time.strftime()}, failed because it was removed by an admin.")
+                user_id=shift_swap.current_owner_id, message=f"Your shift swap request at {membership.group.name} {shift_times}, failed because it was removed by an admin.")
 
             db.session.add(notification)
 
@@ -991,9 +2685,9 @@ def decline_shift_swap(group_id, shift_id, swap_id):
         shift_swap.new_owner_id = None
         db.session.add(shift_swap)
 
-        if not user_is_current_shift_owner:
+        if notify_current_owner:
             notification = Notification_messages(
-                user_id=shift.assigned_owner.id, message=f"Your shift swap request at {membership.group.name} from {shift.start_time.strftime()} to {shift.end_time.strftime()}, failed because it was declined by an admin.")
+                user_id=shift_swap.current_owner_id, message=f"Your shift swap request at {membership.group.name} {shift_times}, failed because it was declined by an admin.")
 
             db.session.add(notification)
 
@@ -1001,5 +2695,59 @@ def decline_shift_swap(group_id, shift_id, swap_id):
         return jsonify({"message": "You have been successfully declined the shift swap request"}), 204
 
 
+@app.cli.command("reconcile-unread-counters")
+def reconcile_unread_counters_command():
+    """Repair unread notification counters that have drifted."""
+    with db.engine.connect() as conn:
+        repaired = reconcile_unread_counters(conn)
+    print(f"Repaired {repaired} unread notification counters.")
+
+
+@app.cli.command("rebuild-hours-rollup")
+@click.option("--check", is_flag=True, help="Only compare the rollup with the raw shifts.")
+def rebuild_hours_rollup_command(check):
+    """Recompute shift_hours_daily from the shifts table."""
+    with db.engine.connect() as conn:
+        if check:
+            mismatches = check_hours_rollup(conn)
+            for group_id, day, user_id, rollup, actual in mismatches:
+                print(f"group {group_id}, user {user_id}, {day}: rollup {rollup}s, shifts {actual}s")
+            print(f"{len(mismatches)} rollup rows disagree with the shifts.")
+            if mismatches:
+                raise SystemExit(1)
+            return
+
+        rows = rebuild_hours_rollup(conn)
+    print(f"Rebuilt {rows} hours rollup rows.")
+
+
+@app.cli.command("shift-conflicts")
+@click.option("--group", "group_id", default=None, help="Only scan this group's shifts.")
+@click.option("--merge", is_flag=True, help="Merge each run of overlapping shifts into one.")
+@click.option("--batch-size", default=500, show_default=True, help="Runs merged per transaction.")
+def shift_conflicts_command(group_id, merge, batch_size):
+    """Report every pair of overlapping shifts assigned to the same user."""
+    found = 0
+    with db.engine.connect() as conn:
+        for conflict_user_id, earlier, later in sweep_conflicts(
+                assigned_shifts_by_user(conn, group_id)):
+            found += 1
+            print(f"user {conflict_user_id}: shift {earlier[0]} ({earlier[1]} - {earlier[2]}) "
+                  f"overlaps shift {later[0]} ({later[1]} - {later[2]})")
+    print(f"Found {found} overlapping pairs.")
+
+    if not merge or not found:
+        return
+
+    # The scan streams on one connection while batches commit on another
+    with db.engine.connect() as scan, db.engine.connect() as conn:
+        deleted = merge_conflict_clusters(
+            conn, conflict_clusters(assigned_shifts_by_user(scan, group_id)), batch_size)
+    print(f"Merged away {deleted} shifts.")
+
+    if group_id is None and ensure_shift_exclusion_constraint(db.engine):
+        print("shifts_user_id_during_excl is in place.")
+
+
 if __name__ == '__main__':
     app.run(debug=True)
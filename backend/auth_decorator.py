@@ -1,8 +1,9 @@
 from flask import session, g, jsonify
-from models import User
+from identity_cache import identity_cache, UserNoLongerExists
 from functools import wraps
-import requests
+from token_cache import token_cache, PROVIDERS, InvalidToken, ProviderUnavailable
 import jwt
+import uuid
 from jwt import DecodeError, ExpiredSignatureError, InvalidTokenError
 from datetime import datetime, timedelta
 import os
@@ -13,6 +14,17 @@ load_dotenv()
 secretKey = os.getenv("secretKey")
 
 
+def run_as(user, f, args, kwargs):
+    """Call the route as `user`, who may have been deleted since they were cached."""
+    g.user = user
+    try:
+        return f(*args, **kwargs)
+    except UserNoLongerExists:
+        session.pop('auth_type', None)
+        session.pop('access_token', None)
+        return jsonify({"message": "User does not exist", "status": 401}), 401
+
+
 def login_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
@@ -36,8 +48,8 @@ def login_required(f):
                     session.pop('access_token', None)
                     return jsonify({"message": "Invalid token", "status": 401}), 401
 
-                # Fetch user from database using user_id
-                user = User.query.filter_by(id=user_id).one_or_none()
+                # Fetch user from the identity cache, falling back to the database
+                user = identity_cache.get_by_id(uuid.UUID(user_id))
 
                 if user is None:
                     # User does not exist
@@ -46,8 +58,7 @@ def login_required(f):
                     return jsonify({"message": "User does not exist", "status": 401}), 401
 
                 # Store user info in Flask's g object
-                g.user = user
-                return f(*args, **kwargs)
+                return run_as(user, f, args, kwargs)
 
             except ExpiredSignatureError:
                 # Token has expired
@@ -65,58 +76,33 @@ def login_required(f):
                 session.pop('access_token', None)
                 return jsonify({"message": "An error occurred", "status": 401}), 401
 
-        elif auth_type == "Google":
-            headers = {'Authorization': f'Bearer {access_token}'}
-            response = requests.get(
-                'https://openidconnect.googleapis.com/v1/userinfo',
-                headers=headers
-            )
-            if response.status_code == 200:
-                user_info = response.json()
-                user_openid = user_info.get("sub")
-
-                # Fetch user from database using openid
-                user = User.query.filter_by(
-                    google_openid=user_openid).one_or_none()
-
-                if user is None:
-                    return jsonify({"message": "User does not exist"}), 401
-
-                # Store user info in Flask's g object
-                g.user = user
-                return f(*args, **kwargs)
-
-            else:
+        elif auth_type in PROVIDERS:
+            try:
+                # Validate the token against the provider (served from cache when possible)
+                user_openid, user_id = token_cache.lookup(auth_type, access_token)
+            except InvalidToken:
                 # Access token is invalid or expired
                 session.pop('auth_type', None)
                 session.pop('access_token', None)
                 return jsonify({"message": "Invalid or expired token", "status": 401}), 401
+            except ProviderUnavailable:
+                # Keep the session, the token may still be valid once the provider recovers
+                return jsonify({"message": "Authentication provider unavailable", "status": 503}), 503
 
-        elif auth_type == "Microsoft":
-            headers = {'Authorization': f'Bearer {access_token}'}
-            response = requests.get(
-                'https://graph.microsoft.com/v1.0/me',
-                headers=headers
-            )
-            if response.status_code == 200:
-                user_info = response.json()
-                user_openid = user_info.get("id")
+            if user_id is not None:
+                user = identity_cache.get_by_id(user_id)
+            else:
+                user = identity_cache.get_by_openid(auth_type, user_openid)
 
-                # Fetch user from database using openid
-                user = User.query.filter_by(
-                    microsoft_openid=user_openid).one_or_none()
+            if user is None:
+                return jsonify({"message": "User does not exist"}), 401
 
-                if user is None:
-                    return jsonify({"message": "User does not exist"}), 401
+            token_cache.remember_user(
+                auth_type, access_token, user_openid, user.id)
+
+            # Store user info in Flask's g object
+            return run_as(user, f, args, kwargs)
 
-                # Store user info in Flask's g object
-                g.user = user
-                return f(*args, **kwargs)
-            else:
-                # Access token is invalid or expired
-                session.pop('auth_type', None)
-                session.pop('access_token', None)
-                return jsonify({"message": "Invalid or expired token", "status": 401}), 401
         else:
             # Authentication type not recognized
             session.pop('auth_type', None)
@@ -0,0 +1,281 @@
+"""
+Automatic assignment of a group's open shifts to its approved members.
+
+Weekly hour caps and rest periods tie a member's shifts together, so the
+problem isn't a plain matching. It is solved in rounds instead: each round
+finds a maximum bipartite matching between the open shifts and the
+members, where a member can take a shift if it fits around everything they
+already hold. A member gets at most one shift per round, which also spreads
+the work. Matched shifts are added to their member's schedule, and the next
+round runs on the shifts that are still open, until a round matches nothing.
+
+Within a round the matching is exact: augmenting paths (Kuhn's algorithm)
+after a greedy pass that hands each shift to the least loaded free member.
+Eligibility is tested lazily with a binary search over the member's sorted
+schedule, so the full shift x member graph is never built.
+
+Usage: python auto_assign.py runs a benchmark on synthetic groups.
+"""
+
+from bisect import bisect_right
+from datetime import timedelta
+from sqlalchemy import values, column, update
+from models import db, Shift, GroupMembership
+from recurrence import user_occurrences
+from schedule_index import to_epoch
+from scheduling import shift_range
+
+WEEK = 7 * 24 * 3600
+# 1970-01-01 was a Thursday; weeks start on Monday
+WEEK_OFFSET = 3 * 24 * 3600
+
+MAX_OPEN_SHIFTS = 20000
+
+
+def week_of(t):
+    return (t + WEEK_OFFSET) // WEEK
+
+
+class MemberSchedule:
+    """A member's shifts as sorted epoch arrays, plus seconds worked per week."""
+    __slots__ = ("user_id", "starts", "ends", "week_seconds", "load")
+
+    def __init__(self, user_id, busy=()):
+        self.user_id = user_id
+        self.starts = []
+        self.ends = []
+        self.week_seconds = {}
+        self.load = 0
+        for start, end in sorted(busy):
+            self.add(start, end)
+
+    def add(self, start, end):
+        i = bisect_right(self.starts, start)
+        self.starts.insert(i, start)
+        self.ends.insert(i, end)
+        week = week_of(start)
+        self.week_seconds[week] = self.week_seconds.get(week, 0) + end - start
+        self.load += end - start
+
+    def fits(self, start, end, rest, max_week_seconds):
+        if self.week_seconds.get(week_of(start), 0) + end - start > max_week_seconds:
+            return False
+        # The member's shifts don't overlap, so ends are sorted too: the
+        # first shift ending after start - rest is the only one that can
+        # come within `rest` of this one
+        i = bisect_right(self.ends, start - rest)
+        return i == len(self.starts) or self.starts[i] >= end + rest
+
+
+def round_matching(shifts, members, rest, max_week_seconds):
+    """
+    Maximum matching between `shifts`, a list of (id, start, end), and
+    `members`, a list of MemberSchedule. Returns {shift index: member index}.
+    """
+    # Per week, only members with room for that week's shortest shift are
+    # candidates, least loaded first. Once most members have hit their cap
+    # this keeps each shift from testing every member.
+    shortest = {}
+    for _, start, end in shifts:
+        week = week_of(start)
+        shortest[week] = min(shortest.get(week, end - start), end - start)
+    order = sorted(range(len(members)), key=lambda m: members[m].load)
+    candidates = {
+        week: [m for m in order
+               if members[m].week_seconds.get(week, 0) + length <= max_week_seconds]
+        for week, length in shortest.items()
+    }
+    weeks = [week_of(start) for _, start, _ in shifts]
+
+    owner = {}
+    matched = {}
+
+    def fits(s, m):
+        _, start, end = shifts[s]
+        return members[m].fits(start, end, rest, max_week_seconds)
+
+    # Greedy pass: most shifts find a free member among the first few tried
+    free = {week: list(members_) for week, members_ in candidates.items()}
+    for s in range(len(shifts)):
+        for m in free[weeks[s]]:
+            if fits(s, m):
+                owner[m] = s
+                matched[s] = m
+                for members_ in free.values():
+                    if m in members_:
+                        members_.remove(m)
+                break
+
+    # Augmenting paths for the rest. Every path ends at a free member, so
+    # there is nothing to do once all members are taken. Members visited by
+    # a failed search stay visited until the matching next changes, since
+    # they can't lead to a free member in the meantime.
+    visited = set()
+    for root in range(len(shifts)):
+        if len(owner) == len(members):
+            break
+        # Even with no free member in the root's own week, a path can end
+        # at a free member of another week's shift
+        if root in matched:
+            continue
+
+        # Iterative DFS; the stack holds (shift, member it was reached through, candidates)
+        stack = [(root, None, iter(candidates[weeks[root]]))]
+        while stack:
+            s, via, untried = stack[-1]
+            for m in untried:
+                if m in visited or not fits(s, m):
+                    continue
+                visited.add(m)
+                if m not in owner:
+                    # Flip the path back to the root
+                    while True:
+                        s, via, _ = stack.pop()
+                        owner[m] = s
+                        matched[s] = m
+                        if via is None:
+                            break
+                        m = via
+                    visited = set()
+                    break
+                stack.append((owner[m], m, iter(candidates[weeks[owner[m]]])))
+                break
+            else:
+                stack.pop()
+
+    return matched
+
+
+def solve(shifts, members, rest, max_week_seconds):
+    """
+    Assign `shifts`, a list of (id, start, end) in epoch seconds, to
+    `members`, a list of MemberSchedule which is updated in place.
+    Returns ({shift id: user id}, [ids of shifts left open]).
+    """
+    remaining = sorted(shifts, key=lambda shift: shift[1])
+    assignments = {}
+
+    while remaining:
+        matched = round_matching(remaining, members, rest, max_week_seconds)
+        if not matched:
+            break
+        for s, m in matched.items():
+            shift_id, start, end = remaining[s]
+            members[m].add(start, end)
+            assignments[shift_id] = members[m].user_id
+        remaining = [shift for s, shift in enumerate(remaining) if s not in matched]
+
+    return assignments, [shift[0] for shift in remaining]
+
+
+def propose_assignments(group_id, window_start, window_end, max_hours_per_week, min_rest_hours):
+    """
+    Dry run over the group's open shifts starting in the window. Returns
+    (assignments as (shift_id, user_id, start_time, end_time), ids of
+    shifts that stay open), or None if there are too many open shifts.
+    """
+    open_shifts = db.session.execute(
+        db.select(Shift.id, Shift.start_time, Shift.end_time)
+        .where(
+            Shift.group_id == group_id,
+            Shift.user_id.is_(None),
+            Shift.start_time >= window_start,
+            Shift.start_time < window_end
+        )
+        .limit(MAX_OPEN_SHIFTS + 1)
+    ).all()
+    if len(open_shifts) > MAX_OPEN_SHIFTS:
+        return None
+
+    rest = timedelta(hours=min_rest_hours)
+    # Whole weeks for the hour caps, widened by the rest period
+    monday = window_start - timedelta(days=window_start.weekday())
+    busy_start = monday.replace(hour=0, minute=0, second=0, microsecond=0) - rest
+    busy_end = (window_end + timedelta(days=7 - window_end.weekday())).replace(
+        hour=0, minute=0, second=0, microsecond=0) + rest
+
+    member_ids = db.session.execute(
+        db.select(GroupMembership.user_id)
+        .where(GroupMembership.group_id == group_id, GroupMembership.approved == True)
+    ).scalars().all()
+
+    busy = {user_id: [] for user_id in member_ids}
+    # Members' shifts in every group count towards their hours
+    for user_id, start, end in db.session.execute(
+        db.select(Shift.user_id, Shift.start_time, Shift.end_time)
+        .where(
+            Shift.user_id.in_(
+                db.select(GroupMembership.user_id)
+                .where(GroupMembership.group_id == group_id, GroupMembership.approved == True)
+            ),
+            Shift.during.op('&&')(shift_range(busy_start, busy_end))
+        )
+    ):
+        busy[user_id].append((to_epoch(start), to_epoch(end)))
+
+    if member_ids:
+        for rule, start, end in user_occurrences(member_ids, busy_start, busy_end):
+            busy[rule.user_id].append((to_epoch(start), to_epoch(end)))
+
+    members = [MemberSchedule(user_id, intervals) for user_id, intervals in busy.items()]
+    by_id = {shift.id: shift for shift in open_shifts}
+
+    assignments, unassigned = solve(
+        [(shift.id, to_epoch(shift.start_time), to_epoch(shift.end_time)) for shift in open_shifts],
+        members,
+        int(rest.total_seconds()),
+        int(max_hours_per_week * 3600)
+    )
+
+    return [
+        (shift_id, user_id, by_id[shift_id].start_time, by_id[shift_id].end_time)
+        for shift_id, user_id in assignments.items()
+    ], unassigned
+
+
+def apply_assignments(group_id, assignments):
+    """
+    Assign every (shift_id, user_id) pair in one UPDATE ... FROM (VALUES ...),
+    skipping shifts that are no longer open. Returns the updated rows as
+    (id, user_id, start_time, end_time).
+    """
+    proposal = values(
+        column('shift_id', db.UUID(as_uuid=True)),
+        column('user_id', db.UUID(as_uuid=True)),
+        name='proposal'
+    ).data(assignments)
+
+    return db.session.execute(
+        update(Shift)
+        .where(
+            Shift.id == proposal.c.shift_id,
+            Shift.group_id == group_id,
+            Shift.user_id.is_(None)
+        )
+        .values(user_id=proposal.c.user_id)
+        .returning(Shift.id, Shift.user_id, Shift.start_time, Shift.end_time)
+        .execution_options(synchronize_session=False)
+    ).all()
+
+
+if __name__ == '__main__':
+    import random
+    import time
+
+    # Four weeks of 8-hour shifts at three start times a day
+    day = 24 * 3600
+    for member_count, shift_count in [(100, 500), (1000, 5000), (3000, 15000), (5000, 25000)]:
+        rng = random.Random(0)
+        shifts = [
+            (i, start, start + 8 * 3600)
+            for i, start in enumerate(
+                rng.randrange(28) * day + rng.choice((6, 14, 22)) * 3600
+                for _ in range(shift_count))
+        ]
+        members = [MemberSchedule(i) for i in range(member_count)]
+
+        began = time.perf_counter()
+        assignments, unassigned = solve(shifts, members, 11 * 3600, 40 * 3600)
+        elapsed = time.perf_counter() - began
+        print(f"{member_count} members, {shift_count} shifts: "
+              f"{len(assignments)} assigned, {len(unassigned)} open in {elapsed:.2f} s")
@@ -0,0 +1,230 @@
+"""
+iCalendar (RFC 5545) feeds of a user's or a group's shifts.
+
+Feeds are rendered as a stream of lines from a server-side cursor, so
+memory stays flat however large the group is. Recurring shifts are
+emitted once, as an event with an RRULE and EXDATEs for occurrences that
+were materialised or cancelled, and calendar apps expand them.
+
+A rendered feed is cached under its group or user version and the day it
+was rendered. Changes to the shifts and recurring shifts bump the
+version, and so do renames of the group or of its members, since both
+appear in the events. Stale entries are never served and simply age out
+of the LRU.
+"""
+
+from collections import OrderedDict
+from datetime import datetime, timezone, timedelta
+import hashlib
+import secrets
+import threading
+import os
+from dotenv import load_dotenv
+from models import db, User, Group, Shift, Shift_recurrence, Shift_recurrence_exception
+
+load_dotenv()
+
+# Past shifts older than this are left out of feeds
+HISTORY = timedelta(days=int(os.getenv("CALENDAR_FEED_HISTORY_DAYS", 30)))
+
+PRODID = "-//Capstone-2//Shift Scheduler//EN"
+
+
+def new_token():
+    """A fresh feed token and the hash stored for it."""
+    token = secrets.token_urlsafe(32)
+    return token, hash_token(token)
+
+
+def hash_token(token):
+    return hashlib.sha256(token.encode('UTF-8')).hexdigest()
+
+
+def feed_cutoff(now=None):
+    """Start of the feed window; fixed for a whole day so feeds can be cached."""
+    now = now or datetime.now(timezone.utc).replace(tzinfo=None)
+    today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    return today - HISTORY
+
+
+def escape_text(value):
+    return (str(value).replace('\\', '\\\\').replace(';', '\\;')
+            .replace(',', '\\,').replace('\n', '\\n'))
+
+
+def format_time(value):
+    # Shift times are naive UTC
+    return value.strftime("%Y%m%dT%H%M%SZ")
+
+
+def content_line(name, value):
+    """One content line, folded at 75 octets as RFC 5545 requires."""
+    line = f"{name}:{value}".encode('UTF-8')
+    parts = []
+    while len(line) > 75:
+        cut = 75 if not parts else 74
+        # Don't split a multi-byte character
+        while cut > 0 and (line[cut] & 0xC0) == 0x80:
+            cut -= 1
+        parts.append(line[:cut])
+        line = line[cut:]
+    parts.append(line)
+    return b"\r\n ".join(parts).decode('UTF-8') + "\r\n"
+
+
+def event_lines(uid, stamp, start, end, summary, rrule=None, exdates=()):
+    yield "BEGIN:VEVENT\r\n"
+    yield content_line("UID", uid)
+    yield content_line("DTSTAMP", format_time(stamp))
+    yield content_line("DTSTART", format_time(start))
+    yield content_line("DTEND", format_time(end))
+    yield content_line("SUMMARY", escape_text(summary))
+    if rrule:
+        yield content_line("RRULE", rrule)
+    for exdate in exdates:
+        yield content_line("EXDATE", format_time(exdate))
+    yield "END:VEVENT\r\n"
+
+
+def rule_rrule(rule):
+    """The rule as an RRULE value, with UNTIL in UTC as RFC 5545 requires."""
+    rrule = rule.rrule
+    if rule.until is not None:
+        rrule = rrule.replace(
+            "UNTIL=" + rule.until.strftime("%Y%m%dT%H%M%S"),
+            "UNTIL=" + format_time(rule.until))
+    return rrule
+
+
+def render_feed(name, shifts, rules, cutoff, domain):
+    """
+    Yield the feed as text chunks. `shifts` yields (id, start, end,
+    summary), `rules` is a list of (Shift_recurrence, summary).
+    """
+    yield "BEGIN:VCALENDAR\r\n"
+    yield content_line("VERSION", "2.0")
+    yield content_line("PRODID", PRODID)
+    yield content_line("CALSCALE", "GREGORIAN")
+    yield content_line("METHOD", "PUBLISH")
+    yield content_line("X-WR-CALNAME", escape_text(name))
+
+    for shift_id, start, end, summary in shifts:
+        yield "".join(event_lines(
+            f"{shift_id}@{domain}", cutoff, start, end, summary))
+
+    exdates = {}
+    if rules:
+        for recurrence_id, occurrence_start in db.session.execute(
+            db.select(
+                Shift_recurrence_exception.recurrence_id,
+                Shift_recurrence_exception.occurrence_start
+            )
+            .where(Shift_recurrence_exception.recurrence_id.in_(
+                [rule.id for rule, _ in rules]))
+            .order_by(Shift_recurrence_exception.occurrence_start)
+        ):
+            exdates.setdefault(recurrence_id, []).append(occurrence_start)
+
+    for rule, summary in rules:
+        yield "".join(event_lines(
+            f"{rule.id}@{domain}", cutoff, rule.dtstart,
+            rule.dtstart + timedelta(minutes=rule.duration_minutes), summary,
+            rrule=rule_rrule(rule), exdates=exdates.get(rule.id, ())))
+
+    yield "END:VCALENDAR\r\n"
+
+
+def group_feed(group_id, cutoff, domain, batch_size=1000):
+    group_name = db.session.execute(
+        db.select(Group.name).where(Group.id == group_id)).scalar()
+
+    shifts = db.session.execute(
+        db.select(
+            Shift.id,
+            Shift.start_time,
+            Shift.end_time,
+            db.func.coalesce(User.username, "Open shift")
+        )
+        .outerjoin(User, User.id == Shift.user_id)
+        .where(Shift.group_id == group_id, Shift.end_time >= cutoff)
+        .execution_options(yield_per=batch_size)
+    )
+
+    rules = [
+        (rule, username or "Open shift")
+        for rule, username in db.session.execute(
+            db.select(Shift_recurrence, User.username)
+            .outerjoin(User, User.id == Shift_recurrence.user_id)
+            .where(Shift_recurrence.group_id == group_id)
+        )
+    ]
+
+    return render_feed(group_name or "Shifts", shifts, rules, cutoff, domain)
+
+
+def user_feed(user_id, cutoff, domain, batch_size=1000):
+    shifts = db.session.execute(
+        db.select(Shift.id, Shift.start_time, Shift.end_time, Group.name)
+        .join(Group, Group.id == Shift.group_id)
+        .where(Shift.user_id == user_id, Shift.end_time >= cutoff)
+        .execution_options(yield_per=batch_size)
+    )
+
+    rules = db.session.execute(
+        db.select(Shift_recurrence, Group.name)
+        .join(Group, Group.id == Shift_recurrence.group_id)
+        .where(Shift_recurrence.user_id == user_id)
+    ).all()
+
+    return render_feed("My shifts", shifts, rules, cutoff, domain)
+
+
+class FeedCache:
+    """LRU of rendered feeds, bounded by total size in bytes."""
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, max_entry_bytes=4 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            body = self.entries.get(key)
+            if body is not None:
+                self.entries.move_to_end(key)
+            return body
+
+    def put(self, key, body):
+        if len(body) > self.max_entry_bytes:
+            return
+        with self.lock:
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.size -= len(previous)
+            self.entries[key] = body
+            self.size += len(body)
+            while self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+
+    def stream(self, key, chunks):
+        """Encode and yield `chunks`, caching the whole body once it completes."""
+        parts = []
+        size = 0
+        for chunk in chunks:
+            data = chunk.encode('UTF-8')
+            if parts is not None:
+                parts.append(data)
+                size += len(data)
+                if size > self.max_entry_bytes:
+                    parts = None
+            yield data
+        if parts is not None:
+            self.put(key, b"".join(parts))
+
+
+feed_cache = FeedCache(
+    max_bytes=int(os.getenv("CALENDAR_FEED_CACHE_BYTES", 64 * 1024 * 1024)),
+)
@@ -0,0 +1,330 @@
+"""
+WSGI middleware compressing responses for clients that accept it.
+
+The encoding is negotiated from Accept-Encoding among gzip and, when the
+`brotli` or `zstandard` packages are installed, br and zstd. Responses
+with a Content-Length are compressed in one piece and sent with the new
+length, unless they are below the minimum size or compression doesn't
+make them smaller. Responses without one, such as streamed calendar
+feeds, are compressed as they are generated.
+
+Responses that are already encoded, partial, marked no-transform, or of
+a type that doesn't compress (images, archives) pass through untouched.
+So do event streams, where each event has to reach the client as soon as
+it is written. A compressed response's ETag is made weak, since its bytes
+differ from the identity response's.
+
+Usage: python compression.py reports the size and CPU cost of each
+encoding on representative payloads.
+"""
+
+import os
+import zlib
+from dotenv import load_dotenv
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+load_dotenv()
+
+MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", 1024))
+
+COMPRESSIBLE_TYPES = (
+    "text/",
+    "application/json",
+    "application/javascript",
+    "application/xml",
+    "image/svg+xml",
+)
+
+SKIPPED_TYPES = ("text/event-stream",)
+
+
+class GzipEncoder:
+    def __init__(self, level=6):
+        self.compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data):
+        return self.compressor.compress(data)
+
+    def finish(self):
+        return self.compressor.flush()
+
+
+class BrotliEncoder:
+    # Quality 11 is meant for static assets; 5 is the usual pick for
+    # dynamic responses
+    def __init__(self, quality=5):
+        self.compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data):
+        return self.compressor.process(data)
+
+    def finish(self):
+        return self.compressor.finish()
+
+
+class ZstdEncoder:
+    def __init__(self, level=3):
+        self.compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data):
+        return self.compressor.compress(data)
+
+    def finish(self):
+        return self.compressor.flush()
+
+
+# In order of preference when the client rates several encodings equally
+ENCODERS = {}
+if zstandard is not None:
+    ENCODERS["zstd"] = ZstdEncoder
+if brotli is not None:
+    ENCODERS["br"] = BrotliEncoder
+ENCODERS["gzip"] = GzipEncoder
+
+
+def negotiate(accept_encoding, available):
+    """The best of `available` for an Accept-Encoding value, None for identity."""
+    qualities = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        quality = 1.0
+        for param in params.split(";"):
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[name] = quality
+
+    best, best_quality = None, 0.0
+    for encoding in available:
+        quality = qualities.get(encoding, qualities.get("*", 0.0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def compress(encoding, body):
+    encoder = ENCODERS[encoding]()
+    return encoder.compress(body) + encoder.finish()
+
+
+def compressed_stream(encoding, chunks):
+    encoder = ENCODERS[encoding]()
+    try:
+        for chunk in chunks:
+            data = encoder.compress(chunk)
+            if data:
+                yield data
+        yield encoder.finish()
+    finally:
+        if hasattr(chunks, "close"):
+            chunks.close()
+
+
+class CompressionMiddleware:
+    def __init__(self, app, min_size=MIN_SIZE, encodings=None):
+        self.app = app
+        self.min_size = min_size
+        self.encodings = list(encodings or ENCODERS)
+
+    def __call__(self, environ, start_response):
+        if environ.get("REQUEST_METHOD") == "HEAD":
+            return self.app(environ, start_response)
+
+        encoding = negotiate(environ.get("HTTP_ACCEPT_ENCODING", ""), self.encodings)
+        captured = []
+
+        def capture(status, headers, exc_info=None):
+            if exc_info is not None and captured:
+                # Headers were not sent yet, so the error response replaces them
+                captured.clear()
+            captured.append((status, headers, exc_info))
+            # The write() callable is not supported; Flask never uses it
+            return None
+
+        app_iter = self.app(environ, capture)
+        chunks = iter(app_iter)
+        buffered = []
+        if not captured:
+            # start_response may be deferred until the first chunk
+            for chunk in chunks:
+                buffered.append(chunk)
+                if captured:
+                    break
+        status, headers, exc_info = captured[-1]
+
+        def passthrough(headers):
+            start_response(status, headers, exc_info)
+            if not buffered:
+                return app_iter
+            return chain_closing(buffered, chunks, app_iter)
+
+        if not self.compressible(status, headers):
+            return passthrough(headers)
+
+        headers = add_vary(headers)
+        length = header(headers, "Content-Length")
+        if encoding is None or (length is not None and int(length) < self.min_size):
+            return passthrough(headers)
+
+        if length is None:
+            headers = encoded_headers(headers, encoding, None)
+            start_response(status, headers, exc_info)
+            return compressed_stream(encoding, chain_closing(buffered, chunks, app_iter))
+
+        try:
+            body = b"".join(buffered) + b"".join(chunks)
+        finally:
+            if hasattr(app_iter, "close"):
+                app_iter.close()
+
+        compressed = compress(encoding, body)
+        if len(compressed) >= len(body):
+            start_response(status, headers, exc_info)
+            return [body]
+
+        start_response(status, encoded_headers(headers, encoding, len(compressed)), exc_info)
+        return [compressed]
+
+    def compressible(self, status, headers):
+        code = int(status.split(" ", 1)[0])
+        if code < 200 or code in (204, 206, 304):
+            return False
+        if header(headers, "Content-Encoding") or header(headers, "Content-Range"):
+            return False
+        if "no-transform" in (header(headers, "Cache-Control") or "").lower():
+            return False
+        content_type = (header(headers, "Content-Type") or "").split(";")[0].strip().lower()
+        if content_type in SKIPPED_TYPES:
+            return False
+        return content_type.startswith(COMPRESSIBLE_TYPES)
+
+
+def chain_closing(buffered, chunks, app_iter):
+    """Yield the buffered chunks and then the rest, closing the app's iterable."""
+    try:
+        yield from buffered
+        yield from chunks
+    finally:
+        if hasattr(app_iter, "close"):
+            app_iter.close()
+
+
+def header(headers, name):
+    name = name.lower()
+    for key, value in headers:
+        if key.lower() == name:
+            return value
+    return None
+
+
+def add_vary(headers):
+    vary = header(headers, "Vary")
+    if vary is None:
+        return headers + [("Vary", "Accept-Encoding")]
+    if "accept-encoding" in vary.lower() or vary.strip() == "*":
+        return headers
+    return [(key, value) for key, value in headers if key.lower() != "vary"] + [
+        ("Vary", f"{vary}, Accept-Encoding")]
+
+
+def encoded_headers(headers, encoding, length):
+    result = []
+    for key, value in headers:
+        lowered = key.lower()
+        if lowered == "content-length":
+            continue
+        if lowered == "etag" and not value.startswith("W/"):
+            value = "W/" + value
+        result.append((key, value))
+    result.append(("Content-Encoding", encoding))
+    if length is not None:
+        result.append(("Content-Length", str(length)))
+    return result
+
+
+if __name__ == '__main__':
+    import json
+    import random
+    import time
+    import uuid
+    from datetime import datetime, timedelta
+
+    rng = random.Random(0)
+
+    def random_uuid():
+        return str(uuid.UUID(int=rng.getrandbits(128)))
+
+    def http_time(value):
+        return value.strftime("%a, %d %b %Y %H:%M:%S GMT")
+
+    now = datetime(2024, 1, 1)
+    group_id = random_uuid()
+    members = [random_uuid() for _ in range(200)]
+    payloads = {
+        "group detail": {
+            "id": group_id,
+            "shifts": [
+                {
+                    "id": random_uuid(),
+                    "group_id": group_id,
+                    "user_id": rng.choice(members),
+                    "start_time": http_time(now + timedelta(hours=8 * i)),
+                    "end_time": http_time(now + timedelta(hours=8 * i + 8))
+                }
+                for i in range(2000)
+            ],
+            "members": [
+                {"id": member, "email": f"member{i}@example.com", "username": f"member{i}"}
+                for i, member in enumerate(members)
+            ],
+            "role": "admin"
+        },
+        "notifications": {
+            "notifications": [
+                {
+                    "id": random_uuid(),
+                    "user_id": members[0],
+                    "read": rng.random() < 0.5,
+                    "message": f"You've been assigned a new shift at Group {i} from "
+                               f"{now + timedelta(hours=i)} to {now + timedelta(hours=i + 8)}.",
+                    "iat": http_time(now + timedelta(minutes=i))
+                }
+                for i in range(500)
+            ]
+        },
+        "search page": {
+            "groups": [
+                {"id": random_uuid(), "name": f"Group {i}", "membership_status": None}
+                for i in range(20)
+            ],
+            "next_cursor": None
+        },
+    }
+
+    for name, payload in payloads.items():
+        body = json.dumps(payload).encode("UTF-8")
+        print(f"{name}: {len(body):,} bytes")
+        for encoding in ENCODERS:
+            rounds = 20
+            began = time.perf_counter()
+            for _ in range(rounds):
+                compressed = compress(encoding, body)
+            elapsed = (time.perf_counter() - began) / rounds
+            print(f"  {encoding:5} {len(compressed):>9,} bytes "
+                  f"({100 * (1 - len(compressed) / len(body)):.0f}% saved) "
+                  f"in {elapsed * 1000:.2f} ms")
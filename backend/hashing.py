@@ -0,0 +1,181 @@
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+import re
+import threading
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# bcrypt hashes look like $2b$<cost>$<salt+hash>
+BCRYPT_PREFIX = re.compile(r'^\$2[abxy]?\$(\d{2})\$')
+
+
+class HashingOverloaded(Exception):
+    """Raised when the hashing queue is full."""
+    status_code = 503
+
+
+class HashingRateLimited(Exception):
+    """Raised when a single client already has too many hashes in flight."""
+    status_code = 429
+
+
+class PasswordHasher:
+    """
+    Runs bcrypt work on a dedicated, size-limited thread pool so a burst of
+    logins can't occupy every request thread. At most `max_workers` hashes
+    run at once and at most `max_queue` more may wait; anything beyond that,
+    or beyond `max_per_ip` concurrent hashes for one client, is rejected
+    immediately instead of queueing behind the burst.
+
+    The request thread still blocks on the result while its hash runs or
+    waits, so the pool caps how much bcrypt work runs at once; it doesn't
+    free the worker thread for other requests.
+    """
+
+    def __init__(self, bcrypt, log_rounds, max_workers=2, max_queue=8, max_per_ip=2, timeout=10.0):
+        self.bcrypt = bcrypt
+        self.log_rounds = log_rounds
+        self.max_per_ip = max_per_ip
+        self.timeout = timeout
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="bcrypt")
+        self.slots = threading.BoundedSemaphore(max_workers + max_queue)
+        self.per_ip = {}
+        self.lock = threading.Lock()
+
+    def check(self, client_ip, password_hash, password):
+        return self._run(client_ip, self.bcrypt.check_password_hash,
+                         password_hash, password)
+
+    def generate(self, client_ip, password):
+        return self._run(client_ip, self.bcrypt.generate_password_hash,
+                         password).decode('UTF-8')
+
+    def needs_rehash(self, password_hash):
+        cost = hash_cost(password_hash)
+        return cost is not None and cost != self.log_rounds
+
+    def _run(self, client_ip, fn, *args):
+        with self.lock:
+            in_flight = self.per_ip.get(client_ip, 0)
+            if in_flight >= self.max_per_ip:
+                raise HashingRateLimited()
+            self.per_ip[client_ip] = in_flight + 1
+
+        try:
+            if not self.slots.acquire(blocking=False):
+                raise HashingOverloaded()
+            try:
+                future = self.executor.submit(fn, *args)
+            except Exception:
+                self.slots.release()
+                raise
+            # Free the slot when the hash actually finishes, not when we stop waiting
+            future.add_done_callback(lambda _: self.slots.release())
+            try:
+                return future.result(timeout=self.timeout)
+            except TimeoutError:
+                future.cancel()
+                raise HashingOverloaded()
+        finally:
+            with self.lock:
+                remaining = self.per_ip[client_ip] - 1
+                if remaining:
+                    self.per_ip[client_ip] = remaining
+                else:
+                    del self.per_ip[client_ip]
+
+
+def hash_cost(password_hash):
+    """The cost a bcrypt hash was made with, None if it isn't a bcrypt hash."""
+    match = BCRYPT_PREFIX.match(password_hash or '')
+    return int(match.group(1)) if match else None
+
+
+def create_password_hasher(bcrypt, log_rounds):
+    return PasswordHasher(
+        bcrypt,
+        log_rounds,
+        max_workers=int(os.getenv("BCRYPT_MAX_WORKERS", 2)),
+        max_queue=int(os.getenv("BCRYPT_MAX_QUEUE", 8)),
+        max_per_ip=int(os.getenv("BCRYPT_MAX_PER_IP", 2)),
+        timeout=float(os.getenv("BCRYPT_TIMEOUT", 10.0)),
+    )
+
+
+if __name__ == '__main__':
+    # p99 latency of a cheap, unauthenticated route while a burst of logins
+    # runs, with bcrypt inline on the request threads versus on the bounded
+    # pool. The request threads are modelled on the procfile's gthread
+    # worker: a fixed pool, with requests queueing when every thread is busy.
+    import statistics
+    import sys
+    import time
+    from flask import Flask, jsonify, request
+    from flask_bcrypt import Bcrypt
+
+    burst = int(sys.argv[1]) if len(sys.argv) > 1 else 64
+    request_threads = int(os.getenv("REQUEST_THREADS", 32))
+    rounds = int(os.getenv("BCRYPT_LOG_ROUNDS", 12))
+    # One cheap request every 5 ms for the length of the burst
+    probe_interval = 0.005
+
+    app = Flask(__name__)
+    app.config['BCRYPT_LOG_ROUNDS'] = rounds
+    bcrypt = Bcrypt(app)
+    password_hash = bcrypt.generate_password_hash("correct horse").decode('UTF-8')
+    check = None
+
+    @app.route('/login', methods=["POST"])
+    def login():
+        try:
+            check(request.remote_addr)
+        except (HashingOverloaded, HashingRateLimited) as e:
+            return jsonify({"message": "Too many login attempts"}), e.status_code
+        return jsonify({"message": "ok"}), 200
+
+    @app.route('/ping')
+    def ping():
+        return jsonify({"message": "ok"}), 200
+
+    client = app.test_client()
+
+    def serve(method, path, ip):
+        """The response status and when the response was finished."""
+        status = client.open(path, method=method, environ_base={"REMOTE_ADDR": ip}).status_code
+        return status, time.perf_counter()
+
+    def percentile(values, p):
+        values = sorted(values)
+        return values[min(len(values) - 1, int(len(values) * p))]
+
+    def run(name, login_check, with_burst=True):
+        global check
+        check = login_check
+        server = ThreadPoolExecutor(max_workers=request_threads)
+        logins = [
+            server.submit(serve, "POST", "/login", f"10.0.{i // 250}.{i % 250}")
+            for i in range(burst if with_burst else 0)
+        ]
+        # Each probe is timed from when it arrives, so time spent queueing
+        # for a request thread counts
+        probes = []
+        began = time.perf_counter()
+        while (not all(login.done() for login in logins)
+               or (not logins and time.perf_counter() - began < 1.0)):
+            probes.append((time.perf_counter(), server.submit(serve, "GET", "/ping", "10.1.0.1")))
+            time.sleep(probe_interval)
+        server.shutdown(wait=True)
+
+        latencies = [future.result()[1] - arrived for arrived, future in probes]
+        statuses = [login.result()[0] for login in logins]
+        print(f"{name}: {len(probes)} /ping requests, p50 {statistics.median(latencies) * 1000:.1f} ms, "
+              f"p99 {percentile(latencies, 0.99) * 1000:.1f} ms; "
+              f"logins {statuses.count(200)} served, {len(statuses) - statuses.count(200)} rejected")
+
+    print(f"{burst} logins at cost {rounds} on {request_threads} request threads")
+    run("no burst", None, with_burst=False)
+    run("inline", lambda ip: bcrypt.check_password_hash(password_hash, "correct horse"))
+    hasher = create_password_hasher(bcrypt, rounds)
+    run("pool", lambda ip: hasher.check(ip, password_hash, "correct horse"))
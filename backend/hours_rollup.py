@@ -0,0 +1,130 @@
+"""
+Hours-worked reports served from the `shift_hours_daily` rollup.
+
+The rollup is maintained by triggers on `shifts`. `rebuild_hours_rollup`
+backfills it from scratch and `check_hours_rollup` compares it with a
+brute-force aggregate over the raw shifts. Recurring occurrences have no
+rows to trigger on, so reports add them from the rules on the fly.
+"""
+
+from sqlalchemy import text
+from datetime import datetime, timedelta
+from models import db, User, Shift_hours_daily
+from recurrence import group_occurrences
+
+PERIODS = ("week", "month")
+
+# Per-day totals recomputed from the raw shifts
+SHIFT_HOURS_AGGREGATE = """
+    SELECT sh.group_id, s.day, sh.user_id, sum(s.seconds) AS seconds, sum(s.starts) AS shift_count
+    FROM shifts AS sh, shift_day_split(sh.start_time, sh.end_time) AS s
+    WHERE sh.user_id IS NOT NULL
+    GROUP BY 1, 2, 3
+"""
+
+
+def rebuild_hours_rollup(connection):
+    """
+    Recompute the whole rollup in one transaction. Shift writes wait for
+    it to finish, so no change can slip between the recount and the
+    triggers. Returns the number of rollup rows.
+    """
+    with connection.begin():
+        connection.execute(text("LOCK TABLE shifts IN SHARE MODE"))
+        connection.execute(text("DELETE FROM shift_hours_daily"))
+        return connection.execute(text(f"""
+            INSERT INTO shift_hours_daily (group_id, day, user_id, seconds, shift_count)
+            {SHIFT_HOURS_AGGREGATE}
+        """)).rowcount
+
+
+def check_hours_rollup(connection):
+    """Rollup rows that disagree with the raw shifts, as (group_id, day, user_id, rollup, actual)."""
+    with connection.begin():
+        return connection.execute(text(f"""
+            SELECT coalesce(h.group_id, a.group_id), coalesce(h.day, a.day), coalesce(h.user_id, a.user_id),
+                   h.seconds, a.seconds
+            FROM (SELECT * FROM shift_hours_daily WHERE seconds <> 0 OR shift_count <> 0) AS h
+            FULL OUTER JOIN ({SHIFT_HOURS_AGGREGATE}) AS a
+              ON a.group_id = h.group_id AND a.day = h.day AND a.user_id = h.user_id
+            WHERE h.seconds IS DISTINCT FROM a.seconds
+               OR h.shift_count IS DISTINCT FROM a.shift_count
+        """)).all()
+
+
+def period_start(day, period):
+    if period == "week":
+        return day - timedelta(days=day.weekday())
+    return day.replace(day=1)
+
+
+def hours_report(group_id, start_day, end_day, period, overtime_hours=None):
+    """
+    Per-member hours and shift counts for each week or month touching
+    [start_day, end_day). Periods cut by the range only count the days
+    inside it. With `overtime_hours`, periods above it are flagged.
+    """
+    period_column = db.cast(db.func.date_trunc(period, Shift_hours_daily.day), db.Date)
+    rows = db.session.execute(
+        db.select(
+            Shift_hours_daily.user_id,
+            period_column,
+            # sum() of a bigint is numeric, which would come back as Decimal
+            db.cast(db.func.sum(Shift_hours_daily.seconds), db.BigInteger),
+            db.cast(db.func.sum(Shift_hours_daily.shift_count), db.BigInteger)
+        )
+        .where(
+            Shift_hours_daily.group_id == group_id,
+            Shift_hours_daily.day >= start_day,
+            Shift_hours_daily.day < end_day
+        )
+        .group_by(Shift_hours_daily.user_id, period_column)
+    ).all()
+
+    totals = {}
+    for user_id, start, seconds, shift_count in rows:
+        total = totals.setdefault((user_id, start), [0, 0])
+        total[0] += seconds
+        total[1] += shift_count
+
+    # Recurring occurrences, split at midnight like the rollup does
+    range_start = datetime.combine(start_day, datetime.min.time())
+    range_end = datetime.combine(end_day, datetime.min.time())
+    for rule, start, end in group_occurrences(group_id, range_start, range_end):
+        if rule.user_id is None:
+            continue
+        day = datetime.combine(start.date(), datetime.min.time())
+        while day < end:
+            next_day = day + timedelta(days=1)
+            if range_start <= day < range_end:
+                total = totals.setdefault((rule.user_id, period_start(day.date(), period)), [0, 0])
+                total[0] += int((min(end, next_day) - max(start, day)).total_seconds())
+                total[1] += int(start >= day)
+            day = next_day
+
+    usernames = dict(db.session.execute(
+        db.select(User.id, User.username)
+        .where(User.id.in_({user_id for user_id, _ in totals}))
+    ).all()) if totals else {}
+
+    members = {}
+    for (user_id, start), (seconds, shift_count) in sorted(
+            totals.items(), key=lambda item: (str(item[0][0]), item[0][1])):
+        hours = round(seconds / 3600, 2)
+        member = members.setdefault(user_id, {
+            "user_id": user_id,
+            "username": usernames.get(user_id),
+            "periods": [],
+            "total_hours": 0,
+            "total_shifts": 0
+        })
+        member["periods"].append({
+            "start": start.isoformat(),
+            "hours": hours,
+            "shifts": shift_count,
+            "overtime": overtime_hours is not None and hours > overtime_hours
+        })
+        member["total_hours"] = round(member["total_hours"] + hours, 2)
+        member["total_shifts"] += shift_count
+
+    return list(members.values())
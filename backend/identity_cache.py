@@ -0,0 +1,173 @@
+from collections import OrderedDict
+from sqlalchemy import event
+import threading
+import time
+import os
+from dotenv import load_dotenv
+from models import db, User
+
+load_dotenv()
+
+
+class UserNoLongerExists(LookupError):
+    """Raised when a cached user's row is gone, typically deleted by another process."""
+
+
+class CachedUser:
+    """
+    Lightweight stand-in for a `User` row, holding only the columns that
+    authentication and most routes read. Any other attribute (relationships,
+    properties such as `assigned_shifts`) loads the full ORM object from the
+    current session the first time it is accessed. If the row has been
+    deleted since the entry was cached, the entry is evicted and
+    UserNoLongerExists is raised.
+    """
+
+    __slots__ = ("id", "username", "email", "google_openid",
+                 "microsoft_openid", "_orm")
+
+    def __init__(self, id, username, email, google_openid, microsoft_openid):
+        self.id = id
+        self.username = username
+        self.email = email
+        self.google_openid = google_openid
+        self.microsoft_openid = microsoft_openid
+        self._orm = None
+
+    @property
+    def orm(self):
+        if self._orm is None:
+            self._orm = db.session.get(User, self.id)
+            if self._orm is None:
+                identity_cache.invalidate(self.id)
+                raise UserNoLongerExists(f"User {self.id} no longer exists")
+        return self._orm
+
+    def __getattr__(self, name):
+        # Only reached for attributes not defined in __slots__
+        return getattr(self.orm, name)
+
+    def copy(self):
+        return CachedUser(self.id, self.username, self.email,
+                          self.google_openid, self.microsoft_openid)
+
+    def get_details(self):
+        return {
+            "id": self.id,
+            "email": self.email,
+            "username": self.username
+        }
+
+
+class IdentityCache:
+    """
+    Process-wide cache of `CachedUser` records keyed by id, with secondary
+    keys for Google and Microsoft openids. Entries expire after `ttl` seconds
+    and the least recently used entry is dropped past `max_entries`.
+
+    Entries are evicted when a `User` is updated or deleted through the ORM
+    in this process; the TTL bounds staleness for changes made elsewhere.
+    """
+
+    def __init__(self, ttl=60, max_entries=10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.by_id = OrderedDict()
+        self.by_openid = {}
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        with self.lock:
+            return {"size": len(self.by_id), "hits": self.hits, "misses": self.misses}
+
+    def clear(self):
+        with self.lock:
+            self.by_id.clear()
+            self.by_openid.clear()
+
+    def get_by_id(self, user_id):
+        user = self._get(user_id)
+        if user is not None:
+            return user
+
+        row = db.session.execute(
+            self._select().where(User.id == user_id)
+        ).one_or_none()
+        return self._store(row)
+
+    def get_by_openid(self, auth_type, openid):
+        with self.lock:
+            user_id = self.by_openid.get((auth_type, openid))
+        if user_id is not None:
+            user = self._get(user_id)
+            if user is not None:
+                return user
+
+        column = User.google_openid if auth_type == "Google" else User.microsoft_openid
+        row = db.session.execute(
+            self._select().where(column == openid)
+        ).one_or_none()
+        return self._store(row)
+
+    def invalidate(self, user_id):
+        with self.lock:
+            self._evict(user_id)
+
+    def _select(self):
+        return db.select(User.id, User.username, User.email,
+                         User.google_openid, User.microsoft_openid)
+
+    def _get(self, user_id):
+        now = time.monotonic()
+        with self.lock:
+            entry = self.by_id.get(user_id)
+            if entry is None or now - entry[1] >= self.ttl:
+                if entry is not None:
+                    self._evict(user_id)
+                self.misses += 1
+                return None
+            self.by_id.move_to_end(user_id)
+            self.hits += 1
+            # Hand out a copy so the lazily loaded ORM object stays per-request
+            return entry[0].copy()
+
+    def _store(self, row):
+        if row is None:
+            return None
+
+        user = CachedUser(*row)
+        with self.lock:
+            self.by_id[user.id] = (user, time.monotonic())
+            self.by_id.move_to_end(user.id)
+            if user.google_openid is not None:
+                self.by_openid[("Google", user.google_openid)] = user.id
+            if user.microsoft_openid is not None:
+                self.by_openid[("Microsoft", user.microsoft_openid)] = user.id
+            while len(self.by_id) > self.max_entries:
+                oldest_id = next(iter(self.by_id))
+                self._evict(oldest_id)
+        return user.copy()
+
+    def _evict(self, user_id):
+        # Caller must hold self.lock
+        entry = self.by_id.pop(user_id, None)
+        if entry is None:
+            return
+        user = entry[0]
+        self.by_openid.pop(("Google", user.google_openid), None)
+        self.by_openid.pop(("Microsoft", user.microsoft_openid), None)
+
+
+identity_cache = IdentityCache(
+    ttl=int(os.getenv("IDENTITY_CACHE_TTL", 60)),
+    max_entries=int(os.getenv("IDENTITY_CACHE_MAX_ENTRIES", 10000)),
+)
+
+
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def _evict_changed_user(mapper, connection, target):
+    identity_cache.invalidate(target.id)
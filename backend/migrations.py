@@ -0,0 +1,356 @@
+"""
+Incremental schema migrations.
+
+`python models.py` drops and recreates every table, which is only suitable
+for a fresh database. This module applies schema changes to a live database
+instead: each migration runs once and is recorded in `schema_migrations`.
+Indexes are built with CREATE INDEX CONCURRENTLY on Postgres so writes to
+the table are not blocked while they build.
+
+`0001_create_tables` is a snapshot of the schema as it stood before
+migrations existed, not `create_all()` on the current models, so every
+later change is applied by its own migration on top of it. Databases
+created by `python models.py` already have the current schema and run
+through all of them anyway, so every migration must also be safe to run
+against that, i.e. use IF NOT EXISTS.
+
+Usage: python migrations.py
+"""
+
+from sqlalchemy import text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.schema import CreateIndex
+from datetime import datetime
+import os
+from flask import Flask
+from dotenv import load_dotenv
+from models import db, connect_db, create_extensions, Group, Notification_messages, Notification_counter, GroupMembership, Shift, Shift_recurrence, Shift_recurrence_exception, Resource_version, Calendar_feed, Shift_swap, Shift_hours_daily, NOTIFICATION_COUNTER_TRIGGERS, RESOURCE_VERSION_TRIGGERS, SHIFT_HOURS_TRIGGERS
+from unread_counter import reconcile_unread_counters
+from hours_rollup import rebuild_hours_rollup
+
+load_dotenv()
+
+
+def autocommit(engine):
+    # CREATE INDEX CONCURRENTLY refuses to run inside a transaction block
+    return engine.connect().execution_options(isolation_level="AUTOCOMMIT")
+
+
+def create_index(engine, index):
+    """Build a model-declared index, concurrently on Postgres."""
+    with autocommit(engine) as conn:
+        if conn.dialect.name != 'postgresql':
+            index.create(conn, checkfirst=True)
+            return
+
+        # A failed concurrent build leaves an INVALID index behind which
+        # IF NOT EXISTS would otherwise happily skip over
+        invalid = conn.execute(text("""
+            SELECT 1 FROM pg_index i
+            JOIN pg_class c ON c.oid = i.indexrelid
+            WHERE c.relname = :name AND NOT i.indisvalid
+        """), {"name": index.name}).first()
+        if invalid:
+            conn.execute(text(f'DROP INDEX CONCURRENTLY IF EXISTS "{index.name}"'))
+
+        index.dialect_options['postgresql']['concurrently'] = True
+        try:
+            conn.execute(CreateIndex(index, if_not_exists=True))
+        finally:
+            index.dialect_options['postgresql']['concurrently'] = False
+
+
+def drop_index(engine, name):
+    with autocommit(engine) as conn:
+        if conn.dialect.name == 'postgresql':
+            conn.execute(text(f'DROP INDEX CONCURRENTLY IF EXISTS "{name}"'))
+        else:
+            conn.execute(text(f'DROP INDEX IF EXISTS "{name}"'))
+
+
+def find_index(model, name):
+    return next(index for index in model.__table__.indexes if index.name == name)
+
+
+# The original six tables, as `db.create_all()` created them
+INITIAL_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS users (
+        id uuid PRIMARY KEY,
+        username varchar(120) NOT NULL,
+        password_hash text,
+        email varchar(120) NOT NULL,
+        google_openid varchar(50) UNIQUE,
+        microsoft_openid varchar(50) UNIQUE
+    );
+
+    CREATE TABLE IF NOT EXISTS notification_messages (
+        id uuid PRIMARY KEY,
+        user_id uuid REFERENCES users (id) ON DELETE CASCADE,
+        read boolean NOT NULL,
+        message text NOT NULL,
+        iat timestamp without time zone NOT NULL
+    );
+
+    CREATE TABLE IF NOT EXISTS groups (
+        id uuid PRIMARY KEY,
+        name varchar(120),
+        owner_id uuid NOT NULL REFERENCES users (id) ON DELETE CASCADE
+    );
+
+    CREATE TABLE IF NOT EXISTS group_memberships (
+        id uuid NOT NULL UNIQUE,
+        user_id uuid NOT NULL REFERENCES users (id) ON DELETE CASCADE,
+        group_id uuid NOT NULL REFERENCES groups (id) ON DELETE CASCADE,
+        admin boolean NOT NULL,
+        approved boolean NOT NULL,
+        PRIMARY KEY (user_id, group_id)
+    );
+
+    CREATE TABLE IF NOT EXISTS shifts (
+        id uuid PRIMARY KEY,
+        group_id uuid NOT NULL REFERENCES groups (id) ON DELETE CASCADE,
+        user_id uuid REFERENCES users (id) ON DELETE CASCADE,
+        start_time timestamp without time zone NOT NULL,
+        end_time timestamp without time zone NOT NULL
+    );
+
+    CREATE TABLE IF NOT EXISTS shift_swaps (
+        id uuid PRIMARY KEY,
+        shift_id uuid NOT NULL REFERENCES shifts (id) ON DELETE CASCADE,
+        current_owner_id uuid NOT NULL REFERENCES users (id) ON DELETE CASCADE,
+        new_owner_id uuid REFERENCES users (id) ON DELETE CASCADE,
+        approved_by_admin_id uuid REFERENCES users (id) ON DELETE CASCADE
+    );
+"""
+
+
+def create_tables(engine):
+    with engine.begin() as conn:
+        conn.exec_driver_sql(INITIAL_SCHEMA)
+
+
+def add_query_indexes(engine):
+    for model, name in [
+        (Shift, 'ix_shifts_user_id_end_time'),
+        (Shift, 'ix_shifts_group_id_end_time'),
+        (GroupMembership, 'ix_group_memberships_group_id_approved'),
+    ]:
+        create_index(engine, find_index(model, name))
+
+
+def add_group_name_trigram_index(engine):
+    create_extensions()
+    create_index(engine, find_index(Group, 'ix_groups_name_trgm'))
+
+
+def add_notification_page_indexes(engine):
+    create_index(engine, find_index(
+        Notification_messages, 'ix_notification_messages_user_id_read_iat'))
+    create_index(engine, find_index(
+        Notification_messages, 'ix_notification_messages_user_id_iat'))
+    # Superseded by (user_id, read, iat)
+    drop_index(engine, 'ix_notification_messages_user_id_unread')
+
+
+def add_notification_counters(engine):
+    db.metadata.create_all(bind=engine, tables=[Notification_counter.__table__])
+    with engine.begin() as conn:
+        conn.exec_driver_sql(NOTIFICATION_COUNTER_TRIGGERS)
+    # Backfill counters for existing notifications
+    with engine.connect() as conn:
+        reconcile_unread_counters(conn)
+
+
+def ensure_shift_exclusion_constraint(engine):
+    """
+    Add the exclusion constraint that stops a user's shifts from
+    overlapping. Existing double-bookings make that impossible, in which
+    case only a plain GiST index is kept for overlap lookups and False is
+    returned. `flask shift-conflicts --merge` resolves them and calls this
+    again.
+    """
+    with autocommit(engine) as conn:
+        exists = conn.execute(text(
+            "SELECT 1 FROM pg_constraint "
+            "WHERE conname = 'shifts_user_id_during_excl' AND conrelid = 'shifts'::regclass"
+        )).first()
+        if exists:
+            return True
+
+        # Built concurrently first so the conflict check below is cheap
+        conn.execute(text(
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_shifts_user_id_during "
+            "ON shifts USING gist (user_id, during)"
+        ))
+
+        conflict = conn.execute(text("""
+            SELECT 1 FROM shifts AS a
+            JOIN shifts AS b
+              ON b.user_id = a.user_id AND b.id <> a.id AND b.during && a.during
+            LIMIT 1
+        """)).first()
+        if conflict:
+            print("Overlapping shifts exist; skipped shifts_user_id_during_excl.")
+            return False
+
+        # Exclusion constraints can't be attached to a prebuilt index, so this
+        # holds a table lock while its own index builds
+        try:
+            conn.execute(text("""
+                ALTER TABLE shifts ADD CONSTRAINT shifts_user_id_during_excl
+                EXCLUDE USING gist (user_id WITH =, during WITH &&)
+            """))
+        except IntegrityError:
+            print("Overlapping shifts were created meanwhile; skipped shifts_user_id_during_excl.")
+            return False
+
+        conn.execute(text("DROP INDEX CONCURRENTLY IF EXISTS ix_shifts_user_id_during"))
+        return True
+
+
+def add_shift_ranges(engine):
+    create_extensions()
+
+    with engine.begin() as conn:
+        inverted = conn.execute(text(
+            "SELECT count(*) FROM shifts WHERE start_time > end_time"
+        )).scalar()
+        if inverted:
+            raise RuntimeError(
+                f"{inverted} shifts end before they start; fix them before migrating.")
+
+        conn.execute(text("""
+            ALTER TABLE shifts ADD COLUMN IF NOT EXISTS during tsrange
+            GENERATED ALWAYS AS (tsrange(start_time, end_time, '[)')) STORED
+        """))
+        # NOT VALID: enforced for new writes without scanning existing rows
+        conn.execute(text("""
+            ALTER TABLE shifts DROP CONSTRAINT IF EXISTS shifts_start_before_end;
+            ALTER TABLE shifts ADD CONSTRAINT shifts_start_before_end
+            CHECK (start_time < end_time) NOT VALID
+        """))
+
+    ensure_shift_exclusion_constraint(engine)
+
+
+def add_shift_recurrences(engine):
+    db.metadata.create_all(bind=engine, tables=[
+        Shift_recurrence.__table__,
+        Shift_recurrence_exception.__table__,
+    ])
+
+
+def add_shift_schedule_index(engine):
+    create_index(engine, find_index(Shift, 'ix_shifts_group_id_start_time'))
+
+
+def add_resource_versions(engine):
+    db.metadata.create_all(bind=engine, tables=[Resource_version.__table__])
+    with engine.begin() as conn:
+        conn.exec_driver_sql(RESOURCE_VERSION_TRIGGERS)
+
+
+def add_calendar_feeds(engine):
+    db.metadata.create_all(bind=engine, tables=[Calendar_feed.__table__])
+    # Assigned shifts now also bump their user's version
+    with engine.begin() as conn:
+        conn.exec_driver_sql(RESOURCE_VERSION_TRIGGERS)
+
+
+def add_shift_hours_rollup(engine):
+    db.metadata.create_all(bind=engine, tables=[Shift_hours_daily.__table__])
+    with engine.begin() as conn:
+        conn.exec_driver_sql(SHIFT_HOURS_TRIGGERS)
+    # Backfill from existing shifts
+    with engine.connect() as conn:
+        rebuild_hours_rollup(conn)
+
+
+def add_shift_swap_groups(engine):
+    with engine.begin() as conn:
+        conn.execute(text("""
+            ALTER TABLE shift_swaps ADD COLUMN IF NOT EXISTS group_id uuid
+            REFERENCES groups (id) ON DELETE CASCADE
+        """))
+        conn.execute(text("""
+            UPDATE shift_swaps AS sw SET group_id = s.group_id
+            FROM shifts AS s
+            WHERE s.id = sw.shift_id AND sw.group_id IS NULL
+        """))
+        conn.execute(text("ALTER TABLE shift_swaps ALTER COLUMN group_id SET NOT NULL"))
+    create_index(engine, find_index(Shift_swap, 'ix_shift_swaps_group_id_open'))
+    # Swaps now bump their group's version straight from group_id
+    with engine.begin() as conn:
+        conn.exec_driver_sql(RESOURCE_VERSION_TRIGGERS)
+        conn.execute(text("DROP FUNCTION IF EXISTS bump_swap_group_versions()"))
+
+
+def add_user_rename_versions(engine):
+    # Renaming a user now bumps their groups' versions
+    with engine.begin() as conn:
+        conn.exec_driver_sql(RESOURCE_VERSION_TRIGGERS)
+
+
+def order_notification_counter_locks(engine):
+    # Counter rows are now locked in user_id order
+    with engine.begin() as conn:
+        conn.exec_driver_sql(NOTIFICATION_COUNTER_TRIGGERS)
+
+
+# (version, migration) in the order they must be applied
+MIGRATIONS = [
+    ("0001_create_tables", create_tables),
+    ("0002_query_indexes", add_query_indexes),
+    ("0003_group_name_trigram_index", add_group_name_trigram_index),
+    ("0004_notification_page_indexes", add_notification_page_indexes),
+    ("0005_notification_counters", add_notification_counters),
+    ("0006_shift_ranges", add_shift_ranges),
+    ("0007_shift_recurrences", add_shift_recurrences),
+    ("0008_shift_schedule_index", add_shift_schedule_index),
+    ("0009_resource_versions", add_resource_versions),
+    ("0010_calendar_feeds", add_calendar_feeds),
+    ("0011_shift_hours_rollup", add_shift_hours_rollup),
+    ("0012_shift_swap_groups", add_shift_swap_groups),
+    ("0013_user_rename_versions", add_user_rename_versions),
+    ("0014_notification_counter_lock_order", order_notification_counter_locks),
+]
+
+
+def applied_versions(engine):
+    with engine.begin() as conn:
+        conn.execute(text("""
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version VARCHAR(120) PRIMARY KEY,
+                applied_at TIMESTAMP NOT NULL
+            )
+        """))
+        return {row[0] for row in conn.execute(text("SELECT version FROM schema_migrations"))}
+
+
+def run_migrations(engine):
+    applied = applied_versions(engine)
+
+    for version, migration in MIGRATIONS:
+        if version in applied:
+            continue
+
+        print(f"Applying {version}...")
+        migration(engine)
+
+        with engine.begin() as conn:
+            conn.execute(
+                text("INSERT INTO schema_migrations (version, applied_at) VALUES (:version, :applied_at)"),
+                {"version": version, "applied_at": datetime.now()}
+            )
+
+
+if __name__ == '__main__':
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv(
+        "SQLALCHEMY_DATABASE_URI")
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    connect_db(app)
+
+    with app.app_context():
+        run_migrations(db.engine)
+        print("Migrations applied successfully.")
@@ -1,4 +1,6 @@
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event, DDL
+from sqlalchemy.dialects.postgresql import TSRANGE, ExcludeConstraint
 from datetime import datetime, timedelta
 import uuid
 import os
@@ -68,6 +70,13 @@ class User(db.Model):
 
 class Notification_messages(db.Model):
     __tablename__ = 'notification_messages'
+    __table_args__ = (
+        # User.unread_notifications and unread-only notification pages
+        db.Index('ix_notification_messages_user_id_read_iat',
+                 'user_id', 'read', 'iat'),
+        # Notification pages across read and unread messages
+        db.Index('ix_notification_messages_user_id_iat', 'user_id', 'iat'),
+    )
     id = db.Column(db.UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     user_id = db.Column(
         db.UUID(as_uuid=True),
@@ -98,8 +107,92 @@ class Notification_messages(db.Model):
         }
 
 
+class Notification_counter(db.Model):
+    """
+    Number of unread notifications per user, kept in step with
+    notification_messages by the triggers below so badge reads are a
+    single primary key lookup.
+    """
+    __tablename__ = 'notification_counters'
+    user_id = db.Column(
+        db.UUID(as_uuid=True),
+        db.ForeignKey('users.id', ondelete='CASCADE'),
+        primary_key=True
+    )
+    unread = db.Column(db.Integer, nullable=False, default=0)
+
+
+# Statement-level triggers, so a bulk UPDATE of 50k rows adjusts each
+# user's counter once rather than once per row
+NOTIFICATION_COUNTER_TRIGGERS = """
+CREATE OR REPLACE FUNCTION sync_notification_counters() RETURNS trigger AS $$
+BEGIN
+    -- Counter rows are always locked in user_id order, so statements
+    -- touching overlapping users wait on each other instead of deadlocking
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM 1 FROM notification_counters
+        WHERE user_id IN (SELECT user_id FROM old_rows WHERE NOT read)
+        ORDER BY user_id
+        FOR UPDATE;
+        UPDATE notification_counters AS c
+        SET unread = c.unread - d.n
+        FROM (
+            SELECT user_id, count(*) AS n FROM old_rows
+            WHERE NOT read AND user_id IS NOT NULL
+            GROUP BY user_id
+        ) AS d
+        WHERE c.user_id = d.user_id;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO notification_counters (user_id, unread)
+        SELECT user_id, count(*) FROM new_rows
+        WHERE NOT read AND user_id IS NOT NULL
+        GROUP BY user_id
+        ORDER BY user_id
+        ON CONFLICT (user_id) DO UPDATE
+        SET unread = notification_counters.unread + EXCLUDED.unread;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS notification_counters_insert ON notification_messages;
+DROP TRIGGER IF EXISTS notification_counters_update ON notification_messages;
+DROP TRIGGER IF EXISTS notification_counters_delete ON notification_messages;
+
+CREATE TRIGGER notification_counters_insert
+AFTER INSERT ON notification_messages
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION sync_notification_counters();
+
+CREATE TRIGGER notification_counters_update
+AFTER UPDATE ON notification_messages
+REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION sync_notification_counters();
+
+CREATE TRIGGER notification_counters_delete
+AFTER DELETE ON notification_messages
+REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT EXECUTE FUNCTION sync_notification_counters();
+"""
+
+event.listen(
+    Notification_messages.__table__,
+    'after_create',
+    DDL(NOTIFICATION_COUNTER_TRIGGERS).execute_if(dialect='postgresql')
+)
+
+
 class Group(db.Model):
     __tablename__ = 'groups'
+    __table_args__ = (
+        # Trigram index so the ILIKE '%name%' group search can use an index
+        db.Index(
+            'ix_groups_name_trgm', 'name',
+            postgresql_using='gin',
+            postgresql_ops={'name': 'gin_trgm_ops'}
+        ),
+    )
     id = db.Column(db.UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     name = db.Column(db.String(120))
     owner_id = db.Column(
@@ -152,6 +245,12 @@ class Group(db.Model):
 
 class GroupMembership(db.Model):
     __tablename__ = 'group_memberships'
+    __table_args__ = (
+        # Group.members and Group.membership_requests; the primary key only
+        # covers lookups that lead with user_id
+        db.Index('ix_group_memberships_group_id_approved',
+                 'group_id', 'approved'),
+    )
 
     # This is your new "extra" ID column, not a primary key
     id = db.Column(
@@ -191,6 +290,24 @@ class GroupMembership(db.Model):
 
 class Shift(db.Model):
     __tablename__ = 'shifts'
+    __table_args__ = (
+        # User.assigned_shifts
+        db.Index('ix_shifts_user_id_end_time', 'user_id', 'end_time'),
+        # Group.recent_shifts
+        db.Index('ix_shifts_group_id_end_time', 'group_id', 'end_time'),
+        # Windowed group schedule pages, ordered by start
+        db.Index('ix_shifts_group_id_start_time', 'group_id', 'start_time'),
+        # No two shifts assigned to the same user may overlap. The GiST
+        # index behind it also serves the overlap lookups in scheduling.py
+        ExcludeConstraint(
+            ('user_id', '='),
+            ('during', '&&'),
+            name='shifts_user_id_during_excl',
+            using='gist'
+        ),
+        db.CheckConstraint('start_time < end_time',
+                           name='shifts_start_before_end'),
+    )
     id = db.Column(db.UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     group_id = db.Column(
         db.UUID(as_uuid=True),
@@ -205,6 +322,11 @@ class Shift(db.Model):
     # Remove timezone=True
     start_time = db.Column(db.DateTime(), nullable=False)
     end_time = db.Column(db.DateTime(), nullable=False)
+    # Half-open [start_time, end_time) range, maintained by Postgres
+    during = db.Column(
+        TSRANGE,
+        db.Computed("tsrange(start_time, end_time, '[)')", persisted=True)
+    )
 
     group = db.relationship(
         'Group',
@@ -235,12 +357,24 @@ class Shift(db.Model):
 
 class Shift_swap(db.Model):
     __tablename__ = 'shift_swaps'
+    __table_args__ = (
+        # Open swaps per group, for the swap listing
+        db.Index('ix_shift_swaps_group_id_open', 'group_id',
+                 postgresql_where=db.text('new_owner_id IS NULL')),
+    )
     id = db.Column(db.UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     shift_id = db.Column(
         db.UUID(as_uuid=True),
         db.ForeignKey('shifts.id', ondelete='CASCADE'),
         nullable=False
     )
+    # Copied from the shift, which never changes group, so open swaps can
+    # be listed per group without joining shifts first
+    group_id = db.Column(
+        db.UUID(as_uuid=True),
+        db.ForeignKey('groups.id', ondelete='CASCADE'),
+        nullable=False
+    )
     current_owner_id = db.Column(
         db.UUID(as_uuid=True),
         db.ForeignKey('users.id', ondelete='CASCADE'),
@@ -279,6 +413,360 @@ class Shift_swap(db.Model):
     )
 
 
+def format_rrule(freq, interval, by_day, until):
+    """The RRULE text of a recurrence's columns, for rows fetched without the model."""
+    parts = [f"FREQ={freq}", f"INTERVAL={interval}"]
+    if by_day:
+        days = ["MO", "TU", "WE", "TH", "FR", "SA", "SU"]
+        parts.append("BYDAY=" + ",".join(
+            days[int(day)] for day in by_day.split(",")))
+    if until is not None:
+        parts.append("UNTIL=" + until.strftime("%Y%m%dT%H%M%S"))
+    return ";".join(parts)
+
+
+class Shift_recurrence(db.Model):
+    """
+    A repeating shift such as "every Mon/Wed 9-17", stored as an RRULE-style
+    rule. Occurrences are expanded on demand by recurrence.py; a concrete
+    `Shift` row only exists for an occurrence once it is edited or swapped.
+    """
+    __tablename__ = 'shift_recurrences'
+    id = db.Column(db.UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    group_id = db.Column(
+        db.UUID(as_uuid=True),
+        db.ForeignKey('groups.id', ondelete='CASCADE'),
+        nullable=False,
+        index=True
+    )
+    user_id = db.Column(
+        db.UUID(as_uuid=True),
+        db.ForeignKey('users.id', ondelete='CASCADE'),
+        nullable=True,
+        index=True
+    )
+    # Start of the first occurrence; later ones keep its time of day
+    dtstart = db.Column(db.DateTime(), nullable=False)
+    duration_minutes = db.Column(db.Integer, nullable=False)
+    freq = db.Column(db.String(10), nullable=False)
+    interval = db.Column(db.Integer, nullable=False, default=1)
+    # Comma separated weekday numbers, Monday = 0, for WEEKLY rules
+    by_day = db.Column(db.String(20), nullable=True)
+    # Last allowed occurrence start, None for "until further notice"
+    until = db.Column(db.DateTime(), nullable=True)
+
+    exceptions = db.relationship(
+        'Shift_recurrence_exception',
+        back_populates='recurrence',
+        cascade='all, delete-orphan',
+        passive_deletes=True
+    )
+
+    @property
+    def rrule(self):
+        return format_rrule(self.freq, self.interval, self.by_day, self.until)
+
+    def get_details(self):
+        return {
+            "id": self.id,
+            "group_id": self.group_id,
+            "user_id": self.user_id,
+            "start_time": self.dtstart,
+            "end_time": self.dtstart + timedelta(minutes=self.duration_minutes),
+            "rrule": self.rrule
+        }
+
+
+class Shift_recurrence_exception(db.Model):
+    """
+    An occurrence that is no longer generated by its rule, either because
+    it was materialised into `shift_id` or, when that is NULL, cancelled.
+    """
+    __tablename__ = 'shift_recurrence_exceptions'
+    recurrence_id = db.Column(
+        db.UUID(as_uuid=True),
+        db.ForeignKey('shift_recurrences.id', ondelete='CASCADE'),
+        primary_key=True
+    )
+    occurrence_start = db.Column(db.DateTime(), primary_key=True)
+    shift_id = db.Column(
+        db.UUID(as_uuid=True),
+        db.ForeignKey('shifts.id', ondelete='SET NULL'),
+        nullable=True
+    )
+
+    recurrence = db.relationship(
+        'Shift_recurrence',
+        back_populates='exceptions',
+        passive_deletes=True
+    )
+
+
+class Resource_version(db.Model):
+    """
+    Change counter for a group or user, bumped by the triggers below in the
+    same transaction as the change, so conditional GETs can compare ETags
+    with a single primary key lookup.
+
+    kind is 'group' for a group's schedule, members, swaps and recurring
+    shifts, and 'user' for a user's memberships, notifications and assigned
+    shifts. There are no foreign keys, because cascaded deletes bump the
+    counters of rows that are being deleted in the same statement.
+    """
+    __tablename__ = 'resource_versions'
+    kind = db.Column(db.String(10), primary_key=True)
+    resource_id = db.Column(db.UUID(as_uuid=True), primary_key=True)
+    version = db.Column(db.BigInteger, nullable=False, default=0)
+
+
+# Statement-level like the notification counters, so a bulk change bumps
+# each affected counter once. Counters are bumped in id order so two
+# statements touching the same groups can't deadlock on them.
+RESOURCE_VERSION_TRIGGERS = """
+CREATE OR REPLACE FUNCTION bump_resource_versions(resource_kind text, ids uuid[]) RETURNS void AS $$
+    INSERT INTO resource_versions (kind, resource_id, version)
+    SELECT DISTINCT resource_kind, id, 1 FROM unnest(ids) AS id
+    WHERE id IS NOT NULL
+    ORDER BY 2
+    ON CONFLICT (kind, resource_id) DO UPDATE
+    SET version = resource_versions.version + 1;
+$$ LANGUAGE sql;
+
+CREATE OR REPLACE FUNCTION bump_group_versions() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM bump_resource_versions('group', ARRAY(SELECT group_id FROM old_rows));
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM bump_resource_versions('group', ARRAY(SELECT group_id FROM new_rows));
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION bump_user_versions() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM bump_resource_versions('user', ARRAY(SELECT user_id FROM old_rows));
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM bump_resource_versions('user', ARRAY(SELECT user_id FROM new_rows));
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Recurrence exceptions reach their group through their rule. When the
+-- rule is being deleted too, its own trigger bumps the group.
+CREATE OR REPLACE FUNCTION bump_exception_group_versions() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM bump_resource_versions('group', ARRAY(
+            SELECT r.group_id FROM old_rows AS o JOIN shift_recurrences AS r ON r.id = o.recurrence_id));
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM bump_resource_versions('group', ARRAY(
+            SELECT r.group_id FROM new_rows AS n JOIN shift_recurrences AS r ON r.id = n.recurrence_id));
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- A renamed group changes every member's group list
+CREATE OR REPLACE FUNCTION bump_renamed_group_versions() RETURNS trigger AS $$
+BEGIN
+    PERFORM bump_resource_versions('group', ARRAY(SELECT id FROM new_rows));
+    PERFORM bump_resource_versions('user', ARRAY(
+        SELECT m.user_id FROM new_rows AS n JOIN group_memberships AS m ON m.group_id = n.id));
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- A renamed user changes the member lists, schedules and feeds of every
+-- group they belong to. Other user updates, such as a new password hash,
+-- change nothing a versioned view shows.
+CREATE OR REPLACE FUNCTION bump_renamed_user_versions() RETURNS trigger AS $$
+BEGIN
+    PERFORM bump_resource_versions('user', ARRAY(
+        SELECT n.id FROM new_rows AS n JOIN old_rows AS o ON o.id = n.id
+        WHERE n.username IS DISTINCT FROM o.username));
+    PERFORM bump_resource_versions('group', ARRAY(
+        SELECT m.group_id FROM new_rows AS n
+        JOIN old_rows AS o ON o.id = n.id
+        JOIN group_memberships AS m ON m.user_id = n.id
+        WHERE n.username IS DISTINCT FROM o.username));
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Each table gets an insert, update and delete trigger calling its function
+DO $$
+DECLARE
+    t record;
+    op text;
+BEGIN
+    FOR t IN SELECT * FROM (VALUES
+        ('shifts', 'shifts_group_version', 'bump_group_versions'),
+        ('shifts', 'shifts_user_version', 'bump_user_versions'),
+        ('group_memberships', 'group_memberships_group_version', 'bump_group_versions'),
+        ('group_memberships', 'group_memberships_user_version', 'bump_user_versions'),
+        ('shift_recurrences', 'shift_recurrences_group_version', 'bump_group_versions'),
+        ('shift_recurrences', 'shift_recurrences_user_version', 'bump_user_versions'),
+        ('shift_swaps', 'shift_swaps_group_version', 'bump_group_versions'),
+        ('shift_recurrence_exceptions', 'shift_recurrence_exceptions_group_version', 'bump_exception_group_versions'),
+        ('notification_messages', 'notification_messages_user_version', 'bump_user_versions')
+    ) AS v(tbl, name, func)
+    LOOP
+        FOREACH op IN ARRAY ARRAY['insert', 'update', 'delete']
+        LOOP
+            EXECUTE 'DROP TRIGGER IF EXISTS ' || quote_ident(t.name || '_' || op)
+                || ' ON ' || quote_ident(t.tbl);
+            EXECUTE 'CREATE TRIGGER ' || quote_ident(t.name || '_' || op)
+                || ' AFTER ' || upper(op) || ' ON ' || quote_ident(t.tbl)
+                || CASE op
+                    WHEN 'insert' THEN ' REFERENCING NEW TABLE AS new_rows'
+                    WHEN 'update' THEN ' REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows'
+                    ELSE ' REFERENCING OLD TABLE AS old_rows'
+                   END
+                || ' FOR EACH STATEMENT EXECUTE FUNCTION ' || quote_ident(t.func) || '()';
+        END LOOP;
+    END LOOP;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS groups_version_update ON groups;
+
+CREATE TRIGGER groups_version_update
+AFTER UPDATE ON groups
+REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION bump_renamed_group_versions();
+
+DROP TRIGGER IF EXISTS users_version_update ON users;
+
+CREATE TRIGGER users_version_update
+AFTER UPDATE ON users
+REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION bump_renamed_user_versions();
+"""
+
+# The triggers span several tables, so they are created once all of them exist
+event.listen(
+    db.metadata,
+    'after_create',
+    DDL(RESOURCE_VERSION_TRIGGERS).execute_if(dialect='postgresql')
+)
+
+
+class Shift_hours_daily(db.Model):
+    """
+    Hours worked per member, group and day, kept in step with `shifts` by
+    the triggers below so reports never aggregate raw shifts. A shift
+    running past midnight is split across the days it covers; it counts
+    as one shift on the day it starts. Unassigned shifts aren't counted.
+    """
+    __tablename__ = 'shift_hours_daily'
+    group_id = db.Column(db.UUID(as_uuid=True), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    user_id = db.Column(db.UUID(as_uuid=True), primary_key=True)
+    seconds = db.Column(db.BigInteger, nullable=False, default=0)
+    shift_count = db.Column(db.Integer, nullable=False, default=0)
+
+
+SHIFT_HOURS_TRIGGERS = """
+-- The part of [start_time, end_time) falling on each day it touches
+CREATE OR REPLACE FUNCTION shift_day_split(start_time timestamp, end_time timestamp)
+RETURNS TABLE (day date, seconds bigint, starts integer) AS $$
+    SELECT d::date,
+           extract(epoch FROM least(end_time, d + interval '1 day') - greatest(start_time, d))::bigint,
+           (start_time >= d)::integer
+    FROM generate_series(date_trunc('day', start_time), end_time, interval '1 day') AS d
+    WHERE d < end_time;
+$$ LANGUAGE sql IMMUTABLE;
+
+CREATE OR REPLACE FUNCTION sync_shift_hours() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        UPDATE shift_hours_daily AS h
+        SET seconds = h.seconds - d.seconds,
+            shift_count = h.shift_count - d.starts
+        FROM (
+            SELECT o.group_id, s.day, o.user_id, sum(s.seconds) AS seconds, sum(s.starts) AS starts
+            FROM old_rows AS o, shift_day_split(o.start_time, o.end_time) AS s
+            WHERE o.user_id IS NOT NULL
+            GROUP BY 1, 2, 3
+        ) AS d
+        WHERE h.group_id = d.group_id AND h.day = d.day AND h.user_id = d.user_id;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO shift_hours_daily (group_id, day, user_id, seconds, shift_count)
+        SELECT n.group_id, s.day, n.user_id, sum(s.seconds), sum(s.starts)
+        FROM new_rows AS n, shift_day_split(n.start_time, n.end_time) AS s
+        WHERE n.user_id IS NOT NULL
+        GROUP BY 1, 2, 3
+        ORDER BY 1, 2, 3
+        ON CONFLICT (group_id, day, user_id) DO UPDATE
+        SET seconds = shift_hours_daily.seconds + EXCLUDED.seconds,
+            shift_count = shift_hours_daily.shift_count + EXCLUDED.shift_count;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS shift_hours_insert ON shifts;
+DROP TRIGGER IF EXISTS shift_hours_update ON shifts;
+DROP TRIGGER IF EXISTS shift_hours_delete ON shifts;
+
+CREATE TRIGGER shift_hours_insert
+AFTER INSERT ON shifts
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION sync_shift_hours();
+
+CREATE TRIGGER shift_hours_update
+AFTER UPDATE ON shifts
+REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION sync_shift_hours();
+
+CREATE TRIGGER shift_hours_delete
+AFTER DELETE ON shifts
+REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT EXECUTE FUNCTION sync_shift_hours();
+"""
+
+event.listen(
+    Shift.__table__,
+    'after_create',
+    DDL(SHIFT_HOURS_TRIGGERS).execute_if(dialect='postgresql')
+)
+
+
+class Calendar_feed(db.Model):
+    """
+    Secret URL token for subscribing to shifts from a calendar app. Only a
+    hash of the token is stored. group_id is None for a user's own shifts.
+    """
+    __tablename__ = 'calendar_feeds'
+    token_hash = db.Column(db.String(64), primary_key=True)
+    user_id = db.Column(
+        db.UUID(as_uuid=True),
+        db.ForeignKey('users.id', ondelete='CASCADE'),
+        nullable=False,
+        index=True
+    )
+    group_id = db.Column(
+        db.UUID(as_uuid=True),
+        db.ForeignKey('groups.id', ondelete='CASCADE'),
+        nullable=True
+    )
+
+
+def create_extensions():
+    """Postgres extensions the indexes above depend on."""
+    with db.engine.begin() as conn:
+        conn.execute(db.text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+        # GiST support for the uuid '=' in the shift exclusion constraint
+        conn.execute(db.text("CREATE EXTENSION IF NOT EXISTS btree_gist"))
+
+
 def connect_db(app):
     """Connect to database."""
     db.app = app
@@ -294,5 +782,6 @@ if __name__ == '__main__':
 
     with app.app_context():
         db.drop_all()
+        create_extensions()
         db.create_all()
         print("Tables dropped and created successfully.")
@@ -0,0 +1,239 @@
+"""
+Fan-out of new notifications to Server-Sent Events streams.
+
+Notifications inserted through the ORM are published automatically once
+their transaction commits; code that inserts them with Core statements
+calls `publish_notifications` itself after committing.
+
+Two brokers are available, picked with NOTIFICATION_BROKER:
+  - "memory" (default): delivers only to streams held by this process
+  - "postgres": publishes with pg_notify and LISTENs on a dedicated
+    connection, so every gunicorn process sees every notification
+"""
+
+from abc import ABC, abstractmethod
+from sqlalchemy import event, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import Session
+import json
+import logging
+import queue
+import select
+import threading
+import os
+from types import SimpleNamespace
+from dotenv import load_dotenv
+from models import db, Notification_messages
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = 'notification_messages'
+
+# pg_notify payloads must stay under 8000 bytes
+MAX_PAYLOAD_BYTES = 7500
+
+
+def notification_event(notification):
+    return {
+        "id": str(notification.id),
+        "user_id": str(notification.user_id),
+        "read": notification.read,
+        "message": notification.message,
+        "iat": notification.iat.isoformat(),
+    }
+
+
+class Subscription:
+    def __init__(self, user_id, max_queued=100):
+        self.user_id = str(user_id)
+        self.events = queue.Queue(maxsize=max_queued)
+
+    def deliver(self, event):
+        try:
+            self.events.put_nowait(event)
+        except queue.Full:
+            # A stalled client loses live events; it catches up through
+            # Last-Event-ID when it reconnects
+            pass
+
+
+class Broker(ABC):
+    def __init__(self):
+        self.subscriptions = {}
+        self.lock = threading.Lock()
+
+    def subscribe(self, user_id):
+        subscription = Subscription(user_id)
+        with self.lock:
+            self.subscriptions.setdefault(subscription.user_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            subscriptions = self.subscriptions.get(subscription.user_id)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self.subscriptions[subscription.user_id]
+
+    def dispatch(self, event):
+        with self.lock:
+            subscriptions = list(self.subscriptions.get(event["user_id"], ()))
+        for subscription in subscriptions:
+            subscription.deliver(event)
+
+    @abstractmethod
+    def publish(self, events):
+        """Deliver `events` to every subscriber of their users, in any process."""
+
+
+class InProcessBroker(Broker):
+    def publish(self, events):
+        for event in events:
+            self.dispatch(event)
+
+
+class PostgresBroker(Broker):
+    def __init__(self, database_uri, reconnect_delay=2, max_reconnect_delay=60, connect=None):
+        super().__init__()
+        # libpq wants a plain postgresql:// URI, without the SQLAlchemy driver suffix
+        url = make_url(database_uri).set(drivername='postgresql')
+        self.dsn = url.render_as_string(hide_password=False)
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.connect = connect
+        self.listener = None
+        self.listener_lock = threading.Lock()
+        self.stopping = threading.Event()
+
+    def subscribe(self, user_id):
+        # Start listening lazily so nothing is opened before gunicorn forks
+        self._ensure_listener()
+        return super().subscribe(user_id)
+
+    def publish(self, events):
+        with db.engine.begin() as conn:
+            for event in events:
+                payload = json.dumps(event)
+                if len(payload.encode('UTF-8')) > MAX_PAYLOAD_BYTES:
+                    event = dict(event, message=None, truncated=True)
+                    payload = json.dumps(event)
+                conn.execute(
+                    text("SELECT pg_notify(:channel, :payload)"),
+                    {"channel": CHANNEL, "payload": payload}
+                )
+
+    def _ensure_listener(self):
+        with self.listener_lock:
+            if self.listener is None or not self.listener.is_alive():
+                self.listener = threading.Thread(
+                    target=self._listen, name="notification-listener", daemon=True)
+                self.listener.start()
+
+    def stop(self):
+        self.stopping.set()
+
+    def _listen(self):
+        if self.connect is None:
+            import psycopg2
+            self.connect = psycopg2.connect
+
+        # Doubles after every failure up to the maximum, and starts over
+        # once a connection is listening again
+        delay = self.reconnect_delay
+        while not self.stopping.is_set():
+            conn = None
+            try:
+                conn = self.connect(self.dsn)
+                conn.autocommit = True
+                with conn.cursor() as cursor:
+                    cursor.execute(f'LISTEN "{CHANNEL}"')
+                delay = self.reconnect_delay
+
+                while not self.stopping.is_set():
+                    if select.select([conn], [], [], 30) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        notify = conn.notifies.pop(0)
+                        self.dispatch(json.loads(notify.payload))
+            except Exception:
+                logger.exception(
+                    "Notification listener failed; reconnecting in %s seconds", delay)
+            finally:
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+
+            if self.stopping.wait(delay):
+                break
+            delay = min(delay * 2, self.max_reconnect_delay)
+
+
+broker = None
+
+
+def init_notification_stream(app):
+    global broker
+    if os.getenv("NOTIFICATION_BROKER", "memory") == "postgres":
+        broker = PostgresBroker(app.config['SQLALCHEMY_DATABASE_URI'])
+    else:
+        broker = InProcessBroker()
+    return broker
+
+
+def publish_notifications(notifications):
+    """
+    Publish committed notifications, given as ORM objects, result rows or
+    dicts of their column values.
+    """
+    events = [
+        notification_event(SimpleNamespace(**n) if isinstance(n, dict) else n)
+        for n in notifications
+    ]
+    if broker is not None and events:
+        broker.publish(events)
+
+
+def within(transaction, ancestor):
+    """Whether `transaction` is `ancestor` or nested inside it."""
+    while transaction is not None:
+        if transaction is ancestor:
+            return True
+        transaction = transaction.parent
+    return False
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_new_notifications(session, flush_context):
+    # Build the events while the flushed values are still loaded; commit
+    # expires them and after_commit can't emit SQL to reload them. Each is
+    # kept with the innermost transaction it was flushed in, so rolling
+    # back a savepoint only drops the events flushed inside it.
+    transaction = session.get_nested_transaction() or session.get_transaction()
+    pending = session.info.setdefault('pending_notifications', [])
+    pending.extend(
+        (transaction, notification_event(obj)) for obj in session.new
+        if isinstance(obj, Notification_messages))
+
+
+@event.listens_for(Session, 'after_commit')
+def _publish_committed_notifications(session):
+    # Only fires when the outermost transaction commits
+    pending = session.info.pop('pending_notifications', None)
+    if pending and broker is not None:
+        broker.publish([event for _, event in pending])
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _discard_rolled_back_notifications(session, previous_transaction):
+    pending = session.info.get('pending_notifications')
+    if pending:
+        pending[:] = [
+            (transaction, event) for transaction, event in pending
+            if not within(transaction, previous_transaction)
+        ]
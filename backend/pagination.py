@@ -0,0 +1,35 @@
+import base64
+import json
+
+
+def encode_cursor(values):
+    """Turn the sort key of the last row on a page into an opaque cursor."""
+    raw = json.dumps(values, separators=(',', ':'), default=str)
+    return base64.urlsafe_b64encode(raw.encode('UTF-8')).decode('ascii')
+
+
+def decode_cursor(cursor, length):
+    """
+    Reverse `encode_cursor`. Raises ValueError for anything that isn't a
+    cursor we issued with `length` sort values.
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except (ValueError, UnicodeError):
+        raise ValueError("Invalid cursor")
+    if not isinstance(values, list) or len(values) != length:
+        raise ValueError("Invalid cursor")
+    return values
+
+
+def parse_limit(value, default=20, maximum=100):
+    """Parse a `limit` query parameter, clamped to 1..maximum."""
+    if value is None or value == '':
+        return default
+    limit = int(value)
+    return max(1, min(limit, maximum))
+
+
+def escape_like(value):
+    """Escape LIKE wildcards so user input only matches literally."""
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
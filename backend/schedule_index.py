@@ -0,0 +1,437 @@
+"""
+In-memory interval index over each group's shifts.
+
+For every member of a group the index keeps that member's shifts as
+parallel arrays of start and end times (epoch seconds) sorted by start,
+plus the packed 16-byte shift ids: 32 bytes per shift rather than a
+`Shift` instance. Because the exclusion constraint on `shifts` stops a
+member's shifts from overlapping, both arrays are sorted, so each lookup
+is a binary search per member.
+
+The group's recurring shift rules and their exceptions are held next to
+the arrays. Their occurrences are never stored: each query expands the
+rules over its own window, as the schedule reads do, and skips the
+occurrences that were materialised or cancelled.
+
+A group is loaded lazily on first use, on a connection of its own so the
+snapshot only holds committed rows. After that, shift and rule changes
+committed through the ORM in this process are applied incrementally; a
+change that commits while the group is being loaded makes the loader
+discard its snapshot and load again, so it can't be lost. Other
+processes' changes are picked up when the group's entry reaches `max_age`
+and is reloaded. Code that changes shifts with Core statements calls
+`schedule_indexes.invalidate(group_id)`.
+"""
+
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+import threading
+import time
+import uuid
+import os
+from dotenv import load_dotenv
+from models import db, Shift, Shift_recurrence, Shift_recurrence_exception
+from notification_stream import within
+from recurrence import expand, occurrence_id
+
+load_dotenv()
+
+EPOCH = datetime(1970, 1, 1)
+
+# How often a load is retried when changes keep committing under it
+LOAD_ATTEMPTS = 3
+
+
+def to_epoch(value):
+    return int((value - EPOCH).total_seconds())
+
+
+def from_epoch(seconds):
+    return EPOCH + timedelta(seconds=seconds)
+
+
+class MemberIntervals:
+    __slots__ = ("starts", "ends", "ids", "disjoint")
+
+    def __init__(self):
+        self.starts = array('q')
+        self.ends = array('q')
+        self.ids = bytearray()
+        # False only for legacy data written before the exclusion constraint
+        self.disjoint = True
+
+    def __len__(self):
+        return len(self.starts)
+
+    def shift_id(self, i):
+        return uuid.UUID(bytes=bytes(self.ids[i * 16:(i + 1) * 16]))
+
+    def add(self, shift_id, start, end):
+        i = bisect_right(self.starts, start)
+        self.starts.insert(i, start)
+        self.ends.insert(i, end)
+        self.ids[i * 16:i * 16] = shift_id.bytes
+        if (i > 0 and self.ends[i - 1] > start) or (i + 1 < len(self.starts) and self.starts[i + 1] < end):
+            self.disjoint = False
+
+    def remove(self, shift_id, start):
+        i = bisect_left(self.starts, start)
+        while i < len(self.starts) and self.starts[i] == start:
+            if self.ids[i * 16:(i + 1) * 16] == shift_id.bytes:
+                del self.starts[i]
+                del self.ends[i]
+                del self.ids[i * 16:(i + 1) * 16]
+                if not self.disjoint:
+                    # Removing one of the overlapping shifts may have been
+                    # the last overlap
+                    self.disjoint = all(
+                        self.ends[j] <= self.starts[j + 1]
+                        for j in range(len(self.starts) - 1))
+                return True
+            i += 1
+        return False
+
+    def intersecting(self, a, b):
+        """Positions of intervals intersecting [a, b)."""
+        stop = bisect_left(self.starts, b)
+        if self.disjoint:
+            first = bisect_right(self.ends, a)
+            return range(first, stop)
+        return [i for i in range(stop) if self.ends[i] > a]
+
+    def covers(self, t):
+        if self.disjoint:
+            i = bisect_right(self.starts, t) - 1
+            return i >= 0 and self.ends[i] > t
+        return any(self.ends[i] > t for i in range(bisect_right(self.starts, t)))
+
+
+class Rule:
+    """The columns of a Shift_recurrence that `expand` reads."""
+    __slots__ = ("id", "user_id", "dtstart", "duration_minutes", "freq",
+                 "interval", "by_day", "until")
+
+    def __init__(self, id, user_id, dtstart, duration_minutes, freq, interval, by_day, until):
+        self.id = id
+        self.user_id = user_id
+        self.dtstart = dtstart
+        self.duration_minutes = duration_minutes
+        self.freq = freq
+        self.interval = interval
+        self.by_day = by_day
+        self.until = until
+
+
+RULE_COLUMNS = (
+    Shift_recurrence.id, Shift_recurrence.user_id, Shift_recurrence.dtstart,
+    Shift_recurrence.duration_minutes, Shift_recurrence.freq,
+    Shift_recurrence.interval, Shift_recurrence.by_day, Shift_recurrence.until
+)
+
+
+class GroupScheduleIndex:
+    def __init__(self, group_id):
+        self.group_id = group_id
+        # user_id -> MemberIntervals; unassigned shifts are kept under None
+        self.members = {}
+        # rule id -> Rule, and the (rule id, start) of occurrences the
+        # rules no longer generate
+        self.rules = {}
+        self.skipped = set()
+        self.lock = threading.Lock()
+
+    def load(self, rows, rules=(), exceptions=()):
+        for shift_id, user_id, start_time, end_time in rows:
+            self._add(shift_id, user_id, start_time, end_time)
+        for row in rules:
+            self.rules[row[0]] = Rule(*row)
+        self.skipped.update((rule_id, start) for rule_id, start in exceptions)
+
+    def add(self, shift_id, user_id, start_time, end_time):
+        with self.lock:
+            self._add(shift_id, user_id, start_time, end_time)
+
+    def remove(self, shift_id, user_id, start_time):
+        with self.lock:
+            intervals = self.members.get(user_id)
+            if intervals is not None:
+                intervals.remove(shift_id, to_epoch(start_time))
+                if not intervals:
+                    del self.members[user_id]
+
+    def skip(self, rule_id, occurrence_start):
+        with self.lock:
+            self.skipped.add((rule_id, occurrence_start))
+
+    def working_at(self, t):
+        """Ids of members with a shift or recurring occurrence covering `t`."""
+        with self.lock:
+            working = {
+                user_id for user_id, intervals in self.members.items()
+                if user_id is not None and intervals.covers(to_epoch(t))
+            }
+            working.update(
+                rule.user_id for rule, _, _
+                in self._occurrences(t, t + timedelta(microseconds=1))
+                if rule.user_id is not None)
+        return list(working)
+
+    def shifts_between(self, start_time, end_time):
+        """
+        Shifts and recurring occurrences intersecting [start_time, end_time),
+        as (id, user_id, start, end). Occurrences carry their occurrence id.
+        """
+        a, b = to_epoch(start_time), to_epoch(end_time)
+        results = []
+        with self.lock:
+            for user_id, intervals in self.members.items():
+                for i in intervals.intersecting(a, b):
+                    results.append((
+                        intervals.shift_id(i),
+                        user_id,
+                        from_epoch(intervals.starts[i]),
+                        from_epoch(intervals.ends[i])
+                    ))
+            results.extend(
+                (occurrence_id(rule.id, start), rule.user_id, start, end)
+                for rule, start, end in self._occurrences(start_time, end_time))
+        results.sort(key=lambda shift: shift[2])
+        return results
+
+    def free_members(self, member_ids, start_time, end_time):
+        """Those of `member_ids` with nothing intersecting [start_time, end_time)."""
+        a, b = to_epoch(start_time), to_epoch(end_time)
+        with self.lock:
+            busy = {rule.user_id for rule, _, _ in self._occurrences(start_time, end_time)}
+            return [
+                user_id for user_id in member_ids
+                if user_id not in busy and (
+                    user_id not in self.members
+                    or not self.members[user_id].intersecting(a, b))
+            ]
+
+    def _occurrences(self, start_time, end_time):
+        for rule in self.rules.values():
+            for start, end in expand(rule, start_time, end_time):
+                if (rule.id, start) not in self.skipped:
+                    yield rule, start, end
+
+    def _add(self, shift_id, user_id, start_time, end_time):
+        intervals = self.members.get(user_id)
+        if intervals is None:
+            intervals = self.members[user_id] = MemberIntervals()
+        intervals.add(shift_id, to_epoch(start_time), to_epoch(end_time))
+
+
+def load_group(group_id):
+    """A group's index built from what is committed right now."""
+    index = GroupScheduleIndex(group_id)
+    # Not the session: its flushed but uncommitted rows would end up in an
+    # index every other request shares
+    with db.engine.connect() as conn:
+        index.load(
+            conn.execute(
+                db.select(Shift.id, Shift.user_id, Shift.start_time, Shift.end_time)
+                .where(Shift.group_id == group_id)
+                .execution_options(yield_per=1000)
+            ),
+            conn.execute(
+                db.select(*RULE_COLUMNS).where(Shift_recurrence.group_id == group_id)
+            ),
+            conn.execute(
+                db.select(
+                    Shift_recurrence_exception.recurrence_id,
+                    Shift_recurrence_exception.occurrence_start
+                )
+                .join(Shift_recurrence,
+                      Shift_recurrence.id == Shift_recurrence_exception.recurrence_id)
+                .where(Shift_recurrence.group_id == group_id)
+            )
+        )
+    return index
+
+
+class PendingLoad:
+    __slots__ = ("stale",)
+
+    def __init__(self):
+        self.stale = False
+
+
+class ScheduleIndexRegistry:
+    def __init__(self, max_groups=500, max_age=300, loader=load_group):
+        self.max_groups = max_groups
+        self.max_age = max_age
+        self.loader = loader
+        self.groups = OrderedDict()
+        # group_id -> PendingLoads of the loads in progress
+        self.loading = {}
+        self.lock = threading.Lock()
+
+    def get(self, group_id):
+        """The group's index, loading it from the database when missing or too old."""
+        group_id = uuid.UUID(str(group_id))
+        for _ in range(LOAD_ATTEMPTS):
+            with self.lock:
+                entry = self.groups.get(group_id)
+                if entry is not None and time.monotonic() - entry[1] < self.max_age:
+                    self.groups.move_to_end(group_id)
+                    return entry[0]
+                load = PendingLoad()
+                self.loading.setdefault(group_id, []).append(load)
+
+            try:
+                index = self.loader(group_id)
+            finally:
+                with self.lock:
+                    loads = self.loading[group_id]
+                    loads.remove(load)
+                    if not loads:
+                        del self.loading[group_id]
+
+            with self.lock:
+                # A change committed during the load may be missing from the
+                # snapshot, and there was no index yet to apply it to
+                if not load.stale:
+                    self.groups[group_id] = (index, time.monotonic())
+                    self.groups.move_to_end(group_id)
+                    while len(self.groups) > self.max_groups:
+                        self.groups.popitem(last=False)
+                    return index
+
+        # Still changing after every attempt: answer from the latest
+        # snapshot without caching it
+        return index
+
+    def loaded(self, group_id):
+        with self.lock:
+            entry = self.groups.get(uuid.UUID(str(group_id)))
+        return entry[0] if entry is not None else None
+
+    def update(self, group_id, change):
+        """Apply `change(index)` to the group's index if it's loaded."""
+        group_id = uuid.UUID(str(group_id))
+        with self.lock:
+            self._mark_stale(group_id)
+            entry = self.groups.get(group_id)
+            if entry is not None:
+                change(entry[0])
+
+    def update_rule(self, rule_id, change):
+        """Apply `change(index)` to every loaded index holding the rule."""
+        with self.lock:
+            # The rule's group isn't known here, so any load could be affected
+            for group_id in list(self.loading):
+                self._mark_stale(group_id)
+            for index, _ in self.groups.values():
+                if rule_id in index.rules:
+                    change(index)
+
+    def invalidate(self, group_id):
+        group_id = uuid.UUID(str(group_id))
+        with self.lock:
+            self._mark_stale(group_id)
+            self.groups.pop(group_id, None)
+
+    def invalidate_rule(self, rule_id):
+        with self.lock:
+            for group_id in list(self.loading):
+                self._mark_stale(group_id)
+            for group_id in [group_id for group_id, (index, _) in self.groups.items()
+                             if rule_id in index.rules]:
+                del self.groups[group_id]
+
+    def clear(self):
+        with self.lock:
+            self.groups.clear()
+
+    def _mark_stale(self, group_id):
+        for load in self.loading.get(group_id, ()):
+            load.stale = True
+
+
+schedule_indexes = ScheduleIndexRegistry(
+    max_groups=int(os.getenv("SCHEDULE_INDEX_MAX_GROUPS", 500)),
+    max_age=int(os.getenv("SCHEDULE_INDEX_MAX_AGE", 300)),
+)
+
+
+def _previous_value(obj, key):
+    history = inspect(obj).attrs[key].history
+    if history.deleted:
+        return history.deleted[0]
+    return getattr(obj, key)
+
+
+INDEXED_MODELS = (Shift, Shift_recurrence, Shift_recurrence_exception)
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_shift_changes(session, flush_context):
+    # Attribute history is only available until the flush completes, so
+    # record what changed now and apply it once the transaction commits.
+    # Like the notification events, each change is kept with the innermost
+    # transaction it was flushed in.
+    transaction = session.get_nested_transaction() or session.get_transaction()
+    changes = session.info.setdefault('schedule_index_changes', [])
+
+    def record(*change):
+        changes.append((transaction, change))
+
+    for obj in session.new:
+        if isinstance(obj, Shift):
+            record("add", obj.group_id, obj.id, obj.user_id, obj.start_time, obj.end_time)
+        elif isinstance(obj, Shift_recurrence):
+            record("invalidate", obj.group_id)
+        elif isinstance(obj, Shift_recurrence_exception):
+            record("skip", obj.recurrence_id, obj.occurrence_start)
+
+    for obj in session.dirty:
+        if not isinstance(obj, INDEXED_MODELS) or not session.is_modified(obj):
+            continue
+        if isinstance(obj, Shift):
+            record("remove", _previous_value(obj, 'group_id'), obj.id,
+                   _previous_value(obj, 'user_id'), _previous_value(obj, 'start_time'))
+            record("add", obj.group_id, obj.id, obj.user_id, obj.start_time, obj.end_time)
+        elif isinstance(obj, Shift_recurrence):
+            record("invalidate", obj.group_id)
+        elif isinstance(obj, Shift_recurrence_exception):
+            record("invalidate_rule", obj.recurrence_id)
+
+    for obj in session.deleted:
+        if isinstance(obj, Shift):
+            record("remove", obj.group_id, obj.id, obj.user_id, obj.start_time)
+        elif isinstance(obj, Shift_recurrence):
+            record("invalidate", obj.group_id)
+        elif isinstance(obj, Shift_recurrence_exception):
+            record("invalidate_rule", obj.recurrence_id)
+
+
+@event.listens_for(Session, 'after_commit')
+def _apply_shift_changes(session):
+    for _, change in session.info.pop('schedule_index_changes', ()):
+        kind, args = change[0], change[2:]
+        if kind == "add":
+            schedule_indexes.update(change[1], lambda index: index.add(*args))
+        elif kind == "remove":
+            schedule_indexes.update(change[1], lambda index: index.remove(*args))
+        elif kind == "skip":
+            schedule_indexes.update_rule(change[1], lambda index: index.skip(change[1], change[2]))
+        elif kind == "invalidate":
+            schedule_indexes.invalidate(change[1])
+        else:
+            schedule_indexes.invalidate_rule(change[1])
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _discard_shift_changes(session, previous_transaction):
+    changes = session.info.get('schedule_index_changes')
+    if changes:
+        changes[:] = [
+            (transaction, change) for transaction, change in changes
+            if not within(transaction, previous_transaction)
+        ]
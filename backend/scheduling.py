@@ -0,0 +1,233 @@
+from sqlalchemy import func, select, delete, update, bindparam
+from datetime import datetime, timezone
+import heapq
+from models import db, Shift
+
+
+def parse_iso(iso_str):
+    """
+    Parse an ISO 8601 timestamp into the naive UTC datetimes the shift
+    columns store. A trailing 'Z' or offset is converted to UTC.
+    """
+    if iso_str.endswith('Z'):
+        iso_str = iso_str[:-1] + '+00:00'
+    value = datetime.fromisoformat(iso_str)
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def shift_range(start_time, end_time):
+    """SQL tsrange matching the generated `Shift.during` column."""
+    return func.tsrange(start_time, end_time, '[)')
+
+
+def overlapping_shifts(user_id, start_time, end_time, exclude_shift_id=None):
+    """
+    The user's shifts that intersect [start_time, end_time), locked for
+    update. The lookup is served by the GiST index behind the shift
+    exclusion constraint, so it reads only the intersecting rows no matter
+    how long the user's shift history is.
+    """
+    query = (
+        db.select(Shift)
+        .where(
+            Shift.user_id == user_id,
+            Shift.during.op('&&')(shift_range(start_time, end_time))
+        )
+        .with_for_update()
+    )
+    if exclude_shift_id is not None:
+        query = query.where(Shift.id != exclude_shift_id)
+    return db.session.execute(query).scalars().all()
+
+
+def merge_overlapping_shifts(user_id, start_time, end_time, exclude_shift_id=None):
+    """
+    Delete the user's shifts that overlap [start_time, end_time) and return
+    the bounds of a single shift covering all of them, the same way the
+    shift routes have always folded overlapping shifts into the new one.
+    """
+    if user_id is None:
+        return start_time, end_time
+
+    while True:
+        overlaps = overlapping_shifts(
+            user_id, start_time, end_time, exclude_shift_id)
+        if not overlaps:
+            return start_time, end_time
+
+        for overlap in overlaps:
+            start_time = min(start_time, overlap.start_time)
+            end_time = max(end_time, overlap.end_time)
+            db.session.delete(overlap)
+
+        # The deletes must reach the database before the merged shift is
+        # written, or the exclusion constraint sees both. The widened range
+        # is checked again in case it now reaches further shifts.
+        db.session.flush()
+
+
+def sweep_batch_overlaps(batch, existing):
+    """
+    Find the shifts in `batch` that would double-book their assignee, either
+    against another shift in the batch or against one already stored.
+
+    `batch` is a list of (position, user_id, start_time, end_time) and
+    `existing` of (shift_id, user_id, start_time, end_time). Everything is
+    sorted once by (user, start) and swept in a single pass. Stored shifts
+    always win; between batch shifts the earlier one wins.
+
+    Returns {position: message} for every rejected batch shift.
+    """
+    intervals = [(user_id, start, end, False, position)
+                 for position, user_id, start, end in batch]
+    intervals += [(user_id, start, end, True, shift_id)
+                  for shift_id, user_id, start, end in existing]
+    # Stored shifts sort first on ties so they win over batch shifts
+    intervals.sort(key=lambda i: (str(i[0]), i[1], not i[3]))
+
+    rejected = {}
+    current_user = None
+
+    for user_id, start, end, stored, key in intervals:
+        if user_id != current_user:
+            current_user = user_id
+            # Latest end among this user's stored shifts so far
+            stored_end = None
+            # Most recently accepted batch shift; accepted batch shifts are
+            # disjoint, so it is also the one that ends last
+            accepted = None
+
+        if stored:
+            if accepted is not None and start < accepted[1]:
+                rejected[accepted[0]] = "Overlaps an existing shift"
+                accepted = None
+            if stored_end is None or end > stored_end:
+                stored_end = end
+        elif stored_end is not None and start < stored_end:
+            rejected[key] = "Overlaps an existing shift"
+        elif accepted is not None and start < accepted[1]:
+            rejected[key] = "Overlaps another shift in this batch"
+        else:
+            accepted = (key, end)
+
+    return rejected
+
+
+def assigned_shifts_by_user(connection, group_id=None, batch_size=1000):
+    """
+    Stream (id, user_id, start_time, end_time) of assigned shifts ordered
+    by user then start, from a server-side cursor. With `group_id` only
+    that group's shifts are read, so double-bookings across groups are
+    only found by a scan of all groups.
+    """
+    query = (
+        select(Shift.id, Shift.user_id, Shift.start_time, Shift.end_time)
+        .where(Shift.user_id.isnot(None))
+        .order_by(Shift.user_id, Shift.start_time, Shift.id)
+    )
+    if group_id is not None:
+        query = query.where(Shift.group_id == group_id)
+    return connection.execute(query.execution_options(yield_per=batch_size))
+
+
+def sweep_conflicts(rows):
+    """
+    Yield (user_id, earlier, later) for every pair of overlapping shifts
+    in `rows`, which must be (id, user_id, start_time, end_time) ordered by
+    user then start. Shifts are (id, start_time, end_time).
+
+    The shifts still running at each start are kept in a heap by end, so
+    the cost is O(n log n) plus one step per reported pair.
+    """
+    current_user = None
+    running = []
+
+    for shift_id, user_id, start, end in rows:
+        if user_id != current_user:
+            current_user = user_id
+            running = []
+
+        while running and running[0][0] <= start:
+            heapq.heappop(running)
+
+        for other_end, other_id, other_start in running:
+            yield user_id, (other_id, other_start, other_end), (shift_id, start, end)
+
+        heapq.heappush(running, (end, shift_id, start))
+
+
+def conflict_clusters(rows):
+    """
+    Yield lists of (id, start_time, end_time) for each run of transitively
+    overlapping shifts in `rows`, ordered like for `sweep_conflicts`.
+    Shifts that overlap nothing are skipped.
+    """
+    current_user = None
+    cluster = []
+    cluster_end = None
+
+    for shift_id, user_id, start, end in rows:
+        if user_id != current_user or start >= cluster_end:
+            if len(cluster) > 1:
+                yield cluster
+            current_user = user_id
+            cluster = []
+            cluster_end = end
+
+        cluster.append((shift_id, start, end))
+        cluster_end = max(cluster_end, end)
+
+    if len(cluster) > 1:
+        yield cluster
+
+
+def merge_conflict_clusters(connection, clusters, batch_size=500):
+    """
+    Fold each cluster into its earliest shift, stretched to cover the
+    others, and delete the rest, as the shift routes do for a single
+    shift. Clusters are applied `batch_size` at a time, one transaction
+    each. The shifts are locked and swept again inside the transaction,
+    so anything edited since the scan is merged as it is now.
+
+    Returns the number of shifts deleted.
+    """
+    deleted = 0
+    clusters = iter(clusters)
+
+    while True:
+        batch = [cluster for _, cluster in zip(range(batch_size), clusters)]
+        if not batch:
+            return deleted
+
+        with connection.begin():
+            current = connection.execute(
+                select(Shift.id, Shift.user_id, Shift.start_time, Shift.end_time)
+                .where(Shift.id.in_([shift[0] for cluster in batch for shift in cluster]))
+                .order_by(Shift.user_id, Shift.start_time, Shift.id)
+                .with_for_update()
+            ).all()
+
+            keepers = []
+            doomed = []
+            for cluster in conflict_clusters(current):
+                keepers.append({
+                    "keeper_id": cluster[0][0],
+                    "merged_start": cluster[0][1],
+                    "merged_end": max(shift[2] for shift in cluster),
+                })
+                doomed += [shift[0] for shift in cluster[1:]]
+
+            if doomed:
+                # Delete first so a valid exclusion constraint never sees
+                # the widened shift next to the ones it absorbs
+                connection.execute(delete(Shift).where(Shift.id.in_(doomed)))
+                connection.execute(
+                    update(Shift)
+                    .where(Shift.id == bindparam("keeper_id"))
+                    .values(start_time=bindparam("merged_start"),
+                            end_time=bindparam("merged_end")),
+                    keepers
+                )
+                deleted += len(doomed)
@@ -0,0 +1,173 @@
+"""
+JSON output of list endpoints, fetched as plain column tuples.
+
+Each resource declares its output fields once, as name=column. Handlers
+select exactly those columns, so rows come back as tuples and no ORM
+instances are hydrated, tracked in the identity map or lazily loaded
+from. Every field gets one converter picked from its column type: UUIDs
+become strings and datetimes HTTP dates, the same values Flask's JSON
+provider would produce, so responses are unchanged.
+
+The single-object `get_details()` methods on the models stay for handlers
+that already hold the instance.
+
+Usage: python serializers.py [rows] benchmarks both paths on a temporary
+user's notifications and rolls everything back.
+"""
+
+from sqlalchemy import types
+from werkzeug.http import http_date
+from models import db, User, Group, GroupMembership, Shift, Shift_recurrence, Notification_messages
+
+
+def converter_for(column_type):
+    """The function turning a value of `column_type` into JSON, None if it already is."""
+    if isinstance(column_type, types.Uuid):
+        return str
+    if isinstance(column_type, (types.DateTime, types.Date)):
+        return http_date
+    return None
+
+
+class Projection:
+    """A resource's output fields, fetched by `select()` and encoded by `dump()`."""
+
+    def __init__(self, **fields):
+        self.names = tuple(fields)
+        self.columns = tuple(column.label(name) for name, column in fields.items())
+        self.converters = tuple(converter_for(column.type) for column in fields.values())
+
+    def select(self, *extra):
+        """A select of the fields, followed by any `extra` columns the handler needs."""
+        return db.select(*self.columns, *extra)
+
+    def dump(self, row):
+        # zip stops at the declared fields, ignoring extra columns
+        return {
+            name: value if convert is None or value is None else convert(value)
+            for name, convert, value in zip(self.names, self.converters, row)
+        }
+
+    def dump_all(self, rows):
+        return [self.dump(row) for row in rows]
+
+
+USER_FIELDS = Projection(
+    id=User.id,
+    email=User.email,
+    username=User.username
+)
+
+GROUP_FIELDS = Projection(
+    id=Group.id,
+    name=Group.name,
+    owner_id=Group.owner_id
+)
+
+NOTIFICATION_FIELDS = Projection(
+    id=Notification_messages.id,
+    user_id=Notification_messages.user_id,
+    read=Notification_messages.read,
+    message=Notification_messages.message,
+    iat=Notification_messages.iat
+)
+
+SHIFT_FIELDS = Projection(
+    id=Shift.id,
+    group_id=Shift.group_id,
+    user_id=Shift.user_id,
+    start_time=Shift.start_time,
+    end_time=Shift.end_time
+)
+
+# Needs a join to users
+MEMBERSHIP_REQUEST_FIELDS = Projection(
+    id=GroupMembership.id,
+    group_id=GroupMembership.group_id,
+    user_id=GroupMembership.user_id,
+    username=User.username
+)
+
+RECURRING_SHIFT_FIELDS = Projection(
+    id=Shift_recurrence.id,
+    group_id=Shift_recurrence.group_id,
+    user_id=Shift_recurrence.user_id,
+    start_time=Shift_recurrence.dtstart,
+    end_time=db.type_coerce(
+        Shift_recurrence.dtstart
+        + db.func.make_interval(0, 0, 0, 0, 0, Shift_recurrence.duration_minutes),
+        db.DateTime()
+    )
+)
+
+# The columns `format_rrule()` builds a rule's "rrule" field from
+RECURRENCE_RULE_COLUMNS = (
+    Shift_recurrence.freq,
+    Shift_recurrence.interval,
+    Shift_recurrence.by_day,
+    Shift_recurrence.until
+)
+
+
+if __name__ == '__main__':
+    import gc
+    import os
+    import sys
+    import time
+    import tracemalloc
+    from flask import Flask
+    from sqlalchemy import text
+    from sqlalchemy.orm import Session
+    from models import connect_db
+
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv("SQLALCHEMY_DATABASE_URI")
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    connect_db(app)
+
+    def measure(name, build):
+        gc.collect()
+        tracemalloc.start()
+        began = time.perf_counter()
+        body = app.json.dumps(build())
+        elapsed = time.perf_counter() - began
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"{name}: {count / elapsed:,.0f} rows/s, "
+              f"peak {peak / 2 ** 20:.1f} MiB, {len(body) / 2 ** 20:.1f} MiB of JSON")
+        return body
+
+    with app.app_context(), db.engine.connect() as connection:
+        transaction = connection.begin()
+        try:
+            user_id = connection.execute(text("""
+                INSERT INTO users (id, username, email)
+                VALUES (md5(random()::text)::uuid, 'benchmark', 'benchmark@example.com')
+                RETURNING id
+            """)).scalar()
+            connection.execute(text("""
+                INSERT INTO notification_messages (id, user_id, read, message, iat)
+                SELECT md5(random()::text || i)::uuid, :user_id, mod(i, 2) = 0,
+                       'Notification number ' || i, now() - make_interval(mins => i)
+                FROM generate_series(1, :count) AS i
+            """), {"user_id": user_id, "count": count})
+
+            with Session(bind=connection) as session:
+                orm = measure("get_details", lambda: [
+                    notification.get_details() for notification in session.scalars(
+                        db.select(Notification_messages)
+                        .where(Notification_messages.user_id == user_id)
+                        .order_by(Notification_messages.id))
+                ])
+                session.expunge_all()
+                projected = measure("projection", lambda: NOTIFICATION_FIELDS.dump_all(
+                    session.execute(
+                        NOTIFICATION_FIELDS.select()
+                        .where(Notification_messages.user_id == user_id)
+                        .order_by(Notification_messages.id))
+                ))
+            print("identical output" if orm == projected else "output differs")
+        finally:
+            transaction.rollback()
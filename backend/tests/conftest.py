@@ -0,0 +1,149 @@
+"""
+Shared fixtures.
+
+Tests that only exercise in-memory logic run anywhere. Tests that need
+Postgres take the `app` fixture and are skipped unless TEST_DATABASE_URL
+points at a scratch database; its tables are dropped and recreated, and
+emptied again after every test.
+
+Usage: cd backend && TEST_DATABASE_URL=postgresql:///shifts_test python -m pytest tests
+"""
+
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+import os
+import sys
+import uuid
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+
+# app.py and auth_decorator.py read these at import time
+os.environ.setdefault("FRONTEND_URL", "http://localhost:3000")
+os.environ.setdefault("secretKey", "test-secret")
+if TEST_DATABASE_URL:
+    os.environ["SQLALCHEMY_DATABASE_URI"] = TEST_DATABASE_URL
+else:
+    # Engines connect lazily, so app.py imports without a database
+    os.environ.setdefault("SQLALCHEMY_DATABASE_URI", "postgresql:///unused")
+
+
+@pytest.fixture(scope="session")
+def flask_app():
+    if not TEST_DATABASE_URL:
+        pytest.skip("TEST_DATABASE_URL is not set")
+
+    from app import app
+    from models import db, create_extensions
+
+    app.config.update(
+        TESTING=True,
+        SQLALCHEMY_ECHO=False,
+        # The test client talks plain HTTP
+        SESSION_COOKIE_SECURE=False,
+    )
+
+    with app.app_context():
+        db.drop_all()
+        create_extensions()
+        db.create_all()
+
+    return app
+
+
+@pytest.fixture
+def app(flask_app):
+    from models import db
+    from identity_cache import identity_cache
+    from schedule_index import schedule_indexes
+
+    with flask_app.app_context():
+        yield flask_app
+        db.session.remove()
+        tables = ", ".join(f'"{table.name}"' for table in db.metadata.sorted_tables)
+        with db.engine.begin() as conn:
+            conn.execute(db.text(f"TRUNCATE {tables} CASCADE"))
+
+    identity_cache.clear()
+    schedule_indexes.clear()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+def make_user(username=None):
+    from models import db, User
+
+    username = username or f"user-{uuid.uuid4().hex[:8]}"
+    user = User(username=username, email=f"{username}@example.com")
+    db.session.add(user)
+    db.session.commit()
+    return user
+
+
+def make_group(owner, name="Group", members=(), admins=()):
+    """A group owned by `owner`, with approved `members` and `admins`."""
+    from models import db, Group, GroupMembership
+
+    group = Group(name=name, owner_id=owner.id)
+    db.session.add(group)
+    db.session.flush()
+    db.session.add(GroupMembership(
+        user_id=owner.id, group_id=group.id, admin=True, approved=True))
+    for member in members:
+        db.session.add(GroupMembership(
+            user_id=member.id, group_id=group.id, admin=False, approved=True))
+    for admin in admins:
+        db.session.add(GroupMembership(
+            user_id=admin.id, group_id=group.id, admin=True, approved=True))
+    db.session.commit()
+    return group
+
+
+def make_shift(group, user, start, hours=8):
+    from models import db, Shift
+
+    shift = Shift(
+        group_id=group.id,
+        user_id=user.id if user is not None else None,
+        start_time=start,
+        end_time=start + timedelta(hours=hours)
+    )
+    db.session.add(shift)
+    db.session.commit()
+    return shift
+
+
+def log_in(client, user):
+    import jwt
+
+    token = jwt.encode(
+        {"user_id": str(user.id), "exp": datetime.utcnow() + timedelta(hours=1)},
+        os.environ["secretKey"], algorithm="HS256")
+    with client.session_transaction() as session:
+        session["access_token"] = token
+        session["auth_type"] = "Host"
+
+
+@contextmanager
+def captured_statements():
+    """Collect the (statement, parameters) of every SQL statement run meanwhile."""
+    from sqlalchemy import event
+    from models import db
+
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if not executemany:
+            statements.append((statement, parameters))
+
+    event.listen(db.engine, "before_cursor_execute", record)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, "before_cursor_execute", record)
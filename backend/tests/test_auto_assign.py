@@ -0,0 +1,141 @@
+from datetime import datetime, timedelta
+import random
+
+import pytest
+
+from conftest import make_user, make_group, make_shift, log_in
+
+HOUR = 3600
+DAY = 24 * HOUR
+
+
+def maximum_matching_size(shifts, members, rest, cap):
+    """Plain Kuhn's algorithm over the explicit eligibility graph."""
+    edges = [
+        [m for m, member in enumerate(members) if member.fits(start, end, rest, cap)]
+        for _, start, end in shifts
+    ]
+    owner = {}
+
+    def augment(s, seen):
+        for m in edges[s]:
+            if m in seen:
+                continue
+            seen.add(m)
+            if m not in owner or augment(owner[m], seen):
+                owner[m] = s
+                return True
+        return False
+
+    return sum(augment(s, set()) for s in range(len(shifts)))
+
+
+def random_instance(rng):
+    from auto_assign import MemberSchedule
+
+    # Two weeks, few members, and caps tight enough that members run out
+    # of room in one week but not the other
+    shifts = sorted(
+        ((i, start, start + rng.choice((4, 8, 12)) * HOUR) for i, start in enumerate(
+            rng.randrange(14) * DAY + rng.choice((0, 6, 14, 22)) * HOUR
+            for _ in range(rng.randint(4, 30)))),
+        key=lambda shift: shift[1])
+    members = []
+    for user_id in range(rng.randint(1, 8)):
+        busy = []
+        for day in rng.sample(range(14), rng.randint(0, 8)):
+            start = day * DAY + rng.choice((2, 10, 18)) * HOUR
+            busy.append((start, start + rng.choice((4, 8)) * HOUR))
+        member = MemberSchedule(user_id)
+        for start, end in sorted(busy):
+            if member.fits(start, end, 0, 10 ** 9):
+                member.add(start, end)
+        members.append(member)
+    return shifts, members, rng.choice((0, 8 * HOUR, 11 * HOUR)), rng.choice((16, 24, 40)) * HOUR
+
+
+@pytest.mark.parametrize("seed", range(300))
+def test_each_round_finds_a_maximum_matching(seed):
+    from auto_assign import round_matching
+
+    shifts, members, rest, cap = random_instance(random.Random(seed))
+    matched = round_matching(shifts, members, rest, cap)
+
+    assert len(set(matched.values())) == len(matched)
+    for s, m in matched.items():
+        _, start, end = shifts[s]
+        assert members[m].fits(start, end, rest, cap)
+    assert len(matched) == maximum_matching_size(shifts, members, rest, cap)
+
+
+def test_augmenting_path_through_another_week():
+    from auto_assign import MemberSchedule, round_matching
+
+    monday = 4 * DAY  # 1970-01-05
+    # `busy` already works 8 of its 12 hours in the first week, so only
+    # `flexible` can take that week's shift. The greedy pass sees the
+    # second week's shift first and hands it to `flexible`; only a path
+    # through the second week reaches the free member.
+    flexible = MemberSchedule("flexible")
+    busy = MemberSchedule("busy", [(monday + 2 * DAY, monday + 2 * DAY + 8 * HOUR)])
+    shifts = [
+        ("second week", monday + 8 * DAY, monday + 8 * DAY + 8 * HOUR),
+        ("first week", monday + DAY, monday + DAY + 8 * HOUR),
+    ]
+
+    matched = round_matching(shifts, [flexible, busy], 0, 12 * HOUR)
+
+    assert matched == {0: 1, 1: 0}
+
+
+def propose(client, group, start):
+    response = client.post(f"/user/groups/{group.id}/auto-assign", json={
+        "start_time_iso": start.isoformat(),
+        "end_time_iso": (start + timedelta(days=7)).isoformat(),
+    })
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def commit(client, group, proposal):
+    return client.post(f"/user/groups/{group.id}/auto-assign/commit", json={
+        "version": proposal["version"],
+        "user_versions": proposal["user_versions"],
+        "assignments": [
+            {"shift_id": item["shift_id"], "user_id": item["user_id"]}
+            for item in proposal["assignments"]
+        ]
+    })
+
+
+def test_commit_applies_an_unchanged_proposal(client):
+    owner, member = make_user(), make_user()
+    group = make_group(owner, members=[member])
+    start = datetime(2030, 5, 6)
+    make_shift(group, None, start + timedelta(hours=9))
+    log_in(client, owner)
+
+    proposal = propose(client, group, start)
+    assert len(proposal["assignments"]) == 1
+
+    assert commit(client, group, proposal).status_code == 200
+
+
+def test_commit_rejects_when_an_assignee_changed_elsewhere(client):
+    owner, member = make_user(), make_user()
+    group = make_group(owner, members=[member])
+    elsewhere = make_group(make_user(), members=[member])
+    start = datetime(2030, 5, 6)
+    make_shift(group, None, start + timedelta(hours=9))
+    log_in(client, owner)
+
+    proposal = propose(client, group, start)
+    assignee = next(item["user_id"] for item in proposal["assignments"])
+    # The assignee picks up a shift in another group; the group's own
+    # version is untouched
+    make_shift(elsewhere, owner if assignee == str(owner.id) else member,
+               start + timedelta(hours=8), hours=4)
+
+    response = commit(client, group, proposal)
+
+    assert response.status_code == 409
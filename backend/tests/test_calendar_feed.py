@@ -0,0 +1,70 @@
+from datetime import datetime, timedelta
+
+from conftest import make_user, make_group, make_shift, log_in
+
+
+def issue_feed(client, url):
+    response = client.post(url)
+    assert response.status_code == 201
+    return "/" + response.get_json()["url"].split("/", 3)[3]
+
+
+def fetch(client, path, etag=None):
+    headers = {"If-None-Match": etag} if etag else {}
+    return client.get(path, headers=headers)
+
+
+def test_member_rename_refreshes_the_group_feed(client):
+    from models import db
+
+    owner, member = make_user(), make_user("before_rename")
+    group = make_group(owner, members=[member])
+    make_shift(group, member, datetime.now() + timedelta(days=1))
+    log_in(client, owner)
+    path = issue_feed(client, f"/user/groups/{group.id}/calendar-feed")
+
+    first = fetch(client, path)
+    assert first.status_code == 200
+    assert "before_rename" in first.get_data(as_text=True)
+    assert fetch(client, path, first.headers["ETag"]).status_code == 304
+
+    member.username = "after_rename"
+    db.session.commit()
+
+    second = fetch(client, path, first.headers["ETag"])
+    assert second.status_code == 200
+    assert "after_rename" in second.get_data(as_text=True)
+
+
+def test_group_rename_refreshes_the_member_feed(client):
+    from models import db
+
+    owner = make_user()
+    group = make_group(owner, name="Old name")
+    make_shift(group, owner, datetime.now() + timedelta(days=1))
+    log_in(client, owner)
+    path = issue_feed(client, "/user/calendar-feed")
+
+    first = fetch(client, path)
+    assert "Old name" in first.get_data(as_text=True)
+
+    group.name = "New name"
+    db.session.commit()
+
+    second = fetch(client, path, first.headers["ETag"])
+    assert second.status_code == 200
+    assert "New name" in second.get_data(as_text=True)
+
+
+def test_other_user_updates_leave_group_versions_alone(app):
+    from models import db
+    from versions import get_version
+
+    owner, member = make_user(), make_user()
+    group = make_group(owner, members=[member])
+    before = get_version('group', group.id)
+
+    member.email = "changed@example.com"
+    db.session.commit()
+
+    assert get_version('group', group.id) == before
@@ -0,0 +1,152 @@
+import gzip
+import json
+
+import pytest
+from flask import Flask, Response, jsonify, stream_with_context
+
+from compression import CompressionMiddleware, negotiate
+
+ALL = ["zstd", "br", "gzip"]
+
+# A list payload shaped like the shift and notification lists
+PAYLOAD = {"shifts": [
+    {"id": f"00000000-0000-0000-0000-{i:012d}", "user_id": f"00000000-0000-0000-0000-{i % 7:012d}",
+     "start_time": "Mon, 01 Jan 2030 09:00:00 GMT", "end_time": "Mon, 01 Jan 2030 17:00:00 GMT"}
+    for i in range(200)
+]}
+
+
+@pytest.mark.parametrize("accept, expected", [
+    ("", None),
+    ("gzip", "gzip"),
+    ("gzip, br", "br"),
+    ("gzip;q=1.0, br;q=0.5", "gzip"),
+    ("br;q=0, gzip;q=0.1", "gzip"),
+    ("*", "zstd"),
+    ("*;q=0.5, zstd;q=0", "br"),
+    ("gzip;q=0", None),
+    ("identity", None),
+    ("identity;q=1, gzip;q=0.2", "gzip"),
+    ("GZIP;Q=0.8", "gzip"),
+    ("gzip;q=oops", None),
+    (" , gzip ,", "gzip"),
+])
+def test_negotiation(accept, expected):
+    assert negotiate(accept, ALL) == expected
+
+
+def test_negotiation_only_picks_available_encodings():
+    assert negotiate("br, zstd", ["gzip"]) is None
+    assert negotiate("br, gzip;q=0.5", ["gzip"]) == "gzip"
+
+
+@pytest.fixture
+def client():
+    from versions import make_etag, not_modified, tag
+
+    app = Flask(__name__)
+
+    @app.route("/large")
+    def large():
+        return jsonify(PAYLOAD)
+
+    @app.route("/small")
+    def small():
+        return jsonify({"message": "ok"})
+
+    @app.route("/events")
+    def events():
+        return Response("data: " + "x" * 4096 + "\n\n", mimetype="text/event-stream")
+
+    @app.route("/encoded")
+    def encoded():
+        response = Response(gzip.compress(json.dumps(PAYLOAD).encode()), mimetype="application/json")
+        response.headers["Content-Encoding"] = "gzip"
+        return response
+
+    @app.route("/streamed")
+    def streamed():
+        def generate():
+            for shift in PAYLOAD["shifts"]:
+                yield "BEGIN:VEVENT\r\nUID:" + shift["id"] + "\r\nEND:VEVENT\r\n"
+        return Response(stream_with_context(generate()), mimetype="text/calendar")
+
+    @app.route("/versioned")
+    def versioned():
+        etag = make_etag("group", "1", 7)
+        cached = not_modified(etag)
+        if cached is not None:
+            return cached
+        return tag(jsonify(PAYLOAD), etag)
+
+    app.wsgi_app = CompressionMiddleware(app.wsgi_app, min_size=1024, encodings=["gzip"])
+    return app.test_client()
+
+
+def test_large_responses_are_compressed(client):
+    identity = client.get("/large")
+    response = client.get("/large", headers={"Accept-Encoding": "gzip"})
+
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert response.headers["Vary"] == "Accept-Encoding"
+    assert int(response.headers["Content-Length"]) == len(response.data)
+    assert gzip.decompress(response.data) == identity.data
+    # List payloads repeat their keys and timestamps on every row
+    assert len(response.data) < len(identity.data) / 5
+
+
+def test_identity_when_the_client_refuses_every_encoding(client):
+    for accept in ("", "identity", "gzip;q=0"):
+        response = client.get("/large", headers={"Accept-Encoding": accept})
+        assert "Content-Encoding" not in response.headers
+        # The identity response still varies on the header
+        assert response.headers["Vary"] == "Accept-Encoding"
+        assert response.get_json() == PAYLOAD
+
+
+def test_responses_below_the_minimum_size_are_sent_as_is(client):
+    response = client.get("/small", headers={"Accept-Encoding": "gzip"})
+
+    assert "Content-Encoding" not in response.headers
+    assert response.get_json() == {"message": "ok"}
+
+
+def test_event_streams_are_not_compressed(client):
+    response = client.get("/events", headers={"Accept-Encoding": "gzip"})
+
+    assert "Content-Encoding" not in response.headers
+    assert "Vary" not in response.headers
+    assert response.data.startswith(b"data: ")
+
+
+def test_encoded_responses_are_not_compressed_again(client):
+    response = client.get("/encoded", headers={"Accept-Encoding": "gzip"})
+
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert json.loads(gzip.decompress(response.data)) == PAYLOAD
+
+
+def test_streamed_responses_are_compressed_as_generated(client):
+    identity = client.get("/streamed")
+    response = client.get("/streamed", headers={"Accept-Encoding": "gzip"})
+
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert "Content-Length" not in response.headers
+    assert gzip.decompress(response.data) == identity.data
+
+
+def test_compressed_etag_is_weak_and_still_revalidates(client):
+    identity = client.get("/versioned")
+    response = client.get("/versioned", headers={"Accept-Encoding": "gzip"})
+
+    strong = identity.headers["ETag"]
+    assert not strong.startswith("W/")
+    assert response.headers["ETag"] == "W/" + strong
+
+    # The weak tag the client stored matches on the next request
+    revalidated = client.get("/versioned", headers={
+        "Accept-Encoding": "gzip", "If-None-Match": response.headers["ETag"]})
+    assert revalidated.status_code == 304
+    assert revalidated.data == b""
+    assert "Content-Encoding" not in revalidated.headers
+    assert client.get("/versioned", headers={"If-None-Match": strong}).status_code == 304
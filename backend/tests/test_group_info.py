@@ -0,0 +1,77 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import text
+
+from conftest import make_user, make_group, log_in, captured_statements
+
+SIZES = (10, 100, 1000, 10000)
+
+SEED = """
+    INSERT INTO users (id, username, email)
+    SELECT md5(:prefix || i)::uuid, :prefix || i, :prefix || i || '@example.com'
+    FROM generate_series(1, 2 * :size) AS i;
+
+    -- The first half are members with a shift each, the second half pending requests
+    INSERT INTO group_memberships (id, user_id, group_id, admin, approved)
+    SELECT md5(:prefix || 'membership' || i)::uuid, md5(:prefix || i)::uuid, :group_id,
+           false, i <= :size
+    FROM generate_series(1, 2 * :size) AS i;
+
+    INSERT INTO shifts (id, group_id, user_id, start_time, end_time)
+    SELECT md5(:prefix || 'shift' || i)::uuid, :group_id, md5(:prefix || i)::uuid,
+           :start, :start + interval '8 hours'
+    FROM generate_series(1, :size) AS i;
+"""
+
+
+def seed_group(owner, size):
+    from models import db
+
+    group = make_group(owner, name=f"Group of {size}")
+    with db.engine.begin() as conn:
+        conn.execute(text(SEED), {
+            "prefix": f"g{size}-",
+            "size": size,
+            "group_id": group.id,
+            "start": datetime.now() + timedelta(days=1)
+        })
+    return group
+
+
+def test_statement_count_is_independent_of_group_size(client):
+    owner = make_user()
+    log_in(client, owner)
+    groups = {size: seed_group(owner, size) for size in SIZES}
+
+    # Warm the identity cache so the caller's lookup isn't counted once
+    assert client.get("/user").status_code == 200
+
+    counts = {}
+    for size, group in groups.items():
+        with captured_statements() as statements:
+            response = client.get(f"/user/groups/{group.id}?include_shifts=true")
+        assert response.status_code == 200
+        body = response.get_json()
+        assert len(body["members"]) == 2 * size + 1
+        assert len(body["membership_requests"]) == size
+        assert len(body["shifts"]) == size
+        counts[size] = len(statements)
+
+    assert len(set(counts.values())) == 1, counts
+    # The group, its recurring rules, the shifts and the memberships
+    assert counts[SIZES[0]] <= 4, counts
+
+
+def test_statement_count_without_shifts(client):
+    owner = make_user()
+    log_in(client, owner)
+    group = seed_group(owner, 100)
+    assert client.get("/user").status_code == 200
+
+    with captured_statements() as statements:
+        response = client.get(f"/user/groups/{group.id}")
+
+    assert response.status_code == 200
+    assert "shifts" not in response.get_json() or response.get_json()["shifts"] == []
+    # The group with the caller's membership, then the memberships
+    assert len(statements) == 2, [statement for statement, _ in statements]
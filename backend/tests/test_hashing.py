@@ -0,0 +1,89 @@
+import threading
+
+import pytest
+
+from hashing import PasswordHasher, HashingOverloaded, HashingRateLimited, hash_cost
+
+
+class StubBcrypt:
+    """Checks block until `release` is set, so tests control what is in flight."""
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.started = threading.Semaphore(0)
+
+    def check_password_hash(self, password_hash, password):
+        self.started.release()
+        self.release.wait(5)
+        return password_hash == password
+
+    def generate_password_hash(self, password):
+        return f"$2b$04${password}".encode('UTF-8')
+
+
+def start_check(hasher, client_ip, errors):
+    def run():
+        try:
+            hasher.check(client_ip, "secret", "secret")
+        except Exception as e:
+            errors.append(e)
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread
+
+
+def test_hash_cost_is_read_from_the_prefix():
+    assert hash_cost("$2b$12$" + "x" * 53) == 12
+    assert hash_cost("$2a$04$" + "x" * 53) == 4
+    assert hash_cost("") is None
+    assert hash_cost("plain-text") is None
+    assert hash_cost("$argon2id$v=19$m=65536") is None
+
+
+def test_needs_rehash_compares_against_configured_cost():
+    hasher = PasswordHasher(StubBcrypt(), log_rounds=12)
+
+    assert hasher.needs_rehash("$2b$10$" + "x" * 53)
+    assert not hasher.needs_rehash("$2b$12$" + "x" * 53)
+    assert not hasher.needs_rehash("not a bcrypt hash")
+
+
+def test_check_and_generate_run_on_the_pool():
+    bcrypt = StubBcrypt()
+    bcrypt.release.set()
+    hasher = PasswordHasher(bcrypt, log_rounds=4)
+
+    assert hasher.check("1.2.3.4", "secret", "secret")
+    assert hasher.generate("1.2.3.4", "pw") == "$2b$04$pw"
+
+
+def test_one_client_is_limited_to_max_per_ip():
+    bcrypt = StubBcrypt()
+    hasher = PasswordHasher(bcrypt, log_rounds=4, max_workers=2, max_queue=8, max_per_ip=1)
+    errors = []
+
+    thread = start_check(hasher, "1.2.3.4", errors)
+    assert bcrypt.started.acquire(timeout=5)
+
+    with pytest.raises(HashingRateLimited):
+        hasher.check("1.2.3.4", "secret", "secret")
+
+    bcrypt.release.set()
+    thread.join()
+    assert not errors
+
+
+def test_full_pool_rejects_immediately():
+    bcrypt = StubBcrypt()
+    hasher = PasswordHasher(bcrypt, log_rounds=4, max_workers=1, max_queue=0, max_per_ip=5)
+    errors = []
+
+    thread = start_check(hasher, "10.0.0.1", errors)
+    assert bcrypt.started.acquire(timeout=5)
+
+    with pytest.raises(HashingOverloaded):
+        hasher.check("10.0.0.2", "secret", "secret")
+
+    bcrypt.release.set()
+    thread.join()
+    assert not errors
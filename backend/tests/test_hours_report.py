@@ -0,0 +1,90 @@
+from datetime import datetime, timedelta
+import random
+
+from sqlalchemy.exc import IntegrityError
+
+from conftest import make_user, make_group, make_shift, log_in
+
+MONDAY = datetime(2030, 6, 3)
+
+
+def test_report_mixes_stored_and_recurring_shifts(client):
+    from models import db, Shift_recurrence
+
+    owner, member = make_user(), make_user()
+    group = make_group(owner, members=[member])
+    # Tuesday 9-17 stored, Wednesdays 22-06 recurring, split over midnight
+    make_shift(group, member, MONDAY + timedelta(days=1, hours=9))
+    db.session.add(Shift_recurrence(
+        group_id=group.id, user_id=member.id, dtstart=MONDAY + timedelta(days=2, hours=22),
+        duration_minutes=8 * 60, freq="WEEKLY", interval=1))
+    db.session.commit()
+    log_in(client, owner)
+
+    response = client.get(
+        f"/user/groups/{group.id}/hours?from={MONDAY.date()}&to={MONDAY.date() + timedelta(days=14)}"
+        "&period=week&overtime_hours=20")
+
+    assert response.status_code == 200
+    members = {m["user_id"]: m for m in response.get_json()["members"]}
+    report = members[str(member.id)]
+    first, second = report["periods"]
+    assert first == {"start": MONDAY.date().isoformat(), "hours": 16, "shifts": 2, "overtime": False}
+    assert second == {"start": (MONDAY.date() + timedelta(days=7)).isoformat(),
+                      "hours": 8, "shifts": 1, "overtime": False}
+    assert report["total_hours"] == 24
+    assert report["total_shifts"] == 3
+    # Numbers, not Decimal strings
+    assert isinstance(report["total_hours"], (int, float))
+    assert isinstance(first["shifts"], int)
+
+
+def test_report_flags_overtime(client):
+    owner = make_user()
+    group = make_group(owner)
+    for day in range(3):
+        make_shift(group, owner, MONDAY + timedelta(days=day, hours=8), hours=10)
+    log_in(client, owner)
+
+    response = client.get(
+        f"/user/groups/{group.id}/hours?from={MONDAY.date()}&to={MONDAY.date() + timedelta(days=7)}"
+        "&period=week&overtime_hours=25")
+
+    period = response.get_json()["members"][0]["periods"][0]
+    assert period["hours"] == 30
+    assert period["overtime"] is True
+
+
+def test_rollup_matches_the_raw_shifts_after_random_edits(app):
+    from models import db
+    from hours_rollup import check_hours_rollup, rebuild_hours_rollup
+
+    rng = random.Random(0)
+    owner = make_user()
+    members = [make_user() for _ in range(4)]
+    group = make_group(owner, members=members)
+
+    shifts = []
+    for member in members:
+        for day in rng.sample(range(30), 12):
+            # Some run past midnight, none reach the next day's shift
+            shifts.append(make_shift(
+                group, member, MONDAY + timedelta(days=day, hours=rng.choice((2, 8, 21))),
+                hours=rng.randint(1, 4)))
+    for shift in rng.sample(shifts, 10):
+        db.session.delete(shift)
+    db.session.commit()
+    for shift in rng.sample([shift for shift in shifts if shift in db.session], 10):
+        assignee = rng.choice(members + [None])
+        shift.user_id = assignee.id if assignee is not None else None
+        shift.end_time = shift.start_time + timedelta(hours=rng.randint(1, 3))
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # The reassignment may overlap the new owner's shifts
+            db.session.rollback()
+
+    with db.engine.connect() as conn:
+        assert check_hours_rollup(conn) == []
+        rebuild_hours_rollup(conn)
+        assert check_hours_rollup(conn) == []
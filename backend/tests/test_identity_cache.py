@@ -0,0 +1,56 @@
+import pytest
+
+from conftest import make_user, make_group, log_in
+
+
+def delete_elsewhere(user):
+    """Delete the user the way another process would, without ORM events."""
+    from models import db, User
+
+    with db.engine.begin() as conn:
+        conn.execute(db.delete(User).where(User.id == user.id))
+
+
+def test_cached_user_loads_full_row_lazily(app):
+    from identity_cache import identity_cache
+
+    user = make_user()
+    cached = identity_cache.get_by_id(user.id)
+
+    assert cached.username == user.username
+    assert cached.password_hash == user.password_hash
+
+
+def test_deleted_user_raises_a_clear_error(app):
+    from identity_cache import identity_cache, UserNoLongerExists
+
+    user = make_user()
+    cached = identity_cache.get_by_id(user.id)
+    delete_elsewhere(user)
+
+    from models import db
+    db.session.expunge_all()
+    with pytest.raises(UserNoLongerExists):
+        cached.password_hash
+    assert identity_cache.stats()["size"] == 0
+
+
+def test_route_answers_401_for_user_deleted_elsewhere(client):
+    owner = make_user()
+    group = make_group(owner)
+    user = make_user()
+    log_in(client, user)
+
+    # Caches the user
+    assert client.get("/user").status_code == 200
+
+    delete_elsewhere(user)
+    from models import db
+    db.session.expunge_all()
+
+    response = client.post(f"/user/groups/{group.id}/membership/request-join")
+
+    assert response.status_code == 401
+    assert response.get_json()["message"] == "User does not exist"
+    with client.session_transaction() as session:
+        assert "access_token" not in session
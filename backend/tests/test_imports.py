@@ -0,0 +1,52 @@
+"""
+Importing the application runs every module-level declaration (routes,
+projections, trigger DDL), so these run without a database and catch
+errors the database tests would skip past.
+"""
+
+from datetime import datetime
+import uuid
+
+
+def test_app_imports():
+    import app
+
+    assert app.app.url_map.bind("localhost").match("/user/groups/1/recurring-shifts")
+
+
+def test_projections_compile():
+    from sqlalchemy.dialects import postgresql
+    import serializers
+
+    for projection in (serializers.USER_FIELDS, serializers.GROUP_FIELDS,
+                       serializers.NOTIFICATION_FIELDS, serializers.SHIFT_FIELDS,
+                       serializers.MEMBERSHIP_REQUEST_FIELDS, serializers.RECURRING_SHIFT_FIELDS):
+        projection.select().compile(dialect=postgresql.dialect())
+
+
+def test_recurring_rule_row_matches_get_details():
+    from models import Shift_recurrence, format_rrule
+    from serializers import RECURRING_SHIFT_FIELDS, RECURRENCE_RULE_COLUMNS
+    from werkzeug.http import http_date
+
+    rule = Shift_recurrence(
+        id=uuid.uuid4(), group_id=uuid.uuid4(), user_id=uuid.uuid4(),
+        dtstart=datetime(2030, 1, 7, 9), duration_minutes=480, freq="WEEKLY",
+        interval=2, by_day="0,2", until=datetime(2030, 6, 1))
+    details = rule.get_details()
+    row = (rule.id, rule.group_id, rule.user_id, details["start_time"], details["end_time"],
+           rule.freq, rule.interval, rule.by_day, rule.until)
+    assert len(row) == len(RECURRING_SHIFT_FIELDS.names) + len(RECURRENCE_RULE_COLUMNS)
+
+    dumped = RECURRING_SHIFT_FIELDS.dump(row)
+    dumped["rrule"] = format_rrule(*row[len(RECURRING_SHIFT_FIELDS.names):])
+
+    assert dumped == {
+        "id": str(rule.id),
+        "group_id": str(rule.group_id),
+        "user_id": str(rule.user_id),
+        "start_time": http_date(details["start_time"]),
+        "end_time": http_date(details["end_time"]),
+        "rrule": "FREQ=WEEKLY;INTERVAL=2;BYDAY=MO,WE;UNTIL=20300601T000000",
+    }
+    assert dumped["rrule"] == details["rrule"]
@@ -0,0 +1,91 @@
+"""
+Running every migration from an empty schema must end with exactly the
+schema `db.create_all()` builds from the current models.
+"""
+
+import pytest
+from sqlalchemy import create_engine, text
+
+from conftest import TEST_DATABASE_URL
+
+SCHEMA = "migration_test"
+
+
+@pytest.fixture
+def migration_engine(app):
+    from models import db
+
+    with db.engine.begin() as conn:
+        conn.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+        conn.execute(text(f"CREATE SCHEMA {SCHEMA}"))
+
+    # Extensions stay in public, where the app fixture created them
+    engine = create_engine(
+        TEST_DATABASE_URL, connect_args={"options": f"-csearch_path={SCHEMA},public"})
+    yield engine
+    engine.dispose()
+
+    with db.engine.begin() as conn:
+        conn.execute(text(f"DROP SCHEMA {SCHEMA} CASCADE"))
+
+
+def describe(conn, schema):
+    columns = set(conn.execute(text("""
+        SELECT table_name, column_name, data_type, is_nullable, is_generated
+        FROM information_schema.columns
+        WHERE table_schema = :schema AND table_name <> 'schema_migrations'
+    """), {"schema": schema}).all())
+
+    indexes = set(conn.execute(text("""
+        SELECT tablename, indexname FROM pg_indexes
+        WHERE schemaname = :schema AND tablename <> 'schema_migrations'
+    """), {"schema": schema}).all())
+
+    constraints = set(conn.execute(text("""
+        SELECT c.relname, k.conname, k.contype
+        FROM pg_constraint AS k
+        JOIN pg_class AS c ON c.oid = k.conrelid
+        JOIN pg_namespace AS n ON n.oid = c.relnamespace
+        WHERE n.nspname = :schema AND c.relname <> 'schema_migrations'
+    """), {"schema": schema}).all())
+
+    triggers = set(conn.execute(text("""
+        SELECT event_object_table, trigger_name, event_manipulation
+        FROM information_schema.triggers
+        WHERE trigger_schema = :schema
+    """), {"schema": schema}).all())
+
+    return columns, indexes, constraints, triggers
+
+
+def test_migrations_build_the_model_schema(app, migration_engine):
+    from models import db
+    from migrations import run_migrations, MIGRATIONS
+
+    run_migrations(migration_engine)
+
+    with migration_engine.connect() as conn:
+        applied = conn.execute(text("SELECT version FROM schema_migrations")).scalars().all()
+        assert sorted(applied) == [version for version, _ in MIGRATIONS]
+        migrated = describe(conn, SCHEMA)
+
+    with db.engine.connect() as conn:
+        created = describe(conn, "public")
+
+    for name, got, expected in zip(
+            ("columns", "indexes", "constraints", "triggers"), migrated, created):
+        assert got == expected, f"{name} differ: missing {expected - got}, extra {got - expected}"
+
+
+def test_migrations_are_idempotent(app, migration_engine):
+    from migrations import run_migrations, MIGRATIONS
+
+    run_migrations(migration_engine)
+    # Rerun everything over the finished schema, as happens for databases
+    # created by `python models.py`
+    with migration_engine.begin() as conn:
+        conn.execute(text("DELETE FROM schema_migrations"))
+    run_migrations(migration_engine)
+
+    with migration_engine.connect() as conn:
+        assert conn.execute(text("SELECT count(*) FROM schema_migrations")).scalar() == len(MIGRATIONS)
@@ -0,0 +1,161 @@
+import threading
+
+import pytest
+
+from conftest import make_user
+
+
+class RecordingBroker:
+    def __init__(self):
+        self.published = []
+
+    def publish(self, events):
+        self.published.extend(events)
+
+
+@pytest.fixture
+def published(app, monkeypatch):
+    import notification_stream
+
+    broker = RecordingBroker()
+    monkeypatch.setattr(notification_stream, "broker", broker)
+    return broker.published
+
+
+def notify(user, message):
+    from models import db, Notification_messages
+
+    db.session.add(Notification_messages(user_id=user.id, message=message))
+    db.session.flush()
+
+
+def messages(events):
+    return sorted(event["message"] for event in events)
+
+
+def test_broker_base_class_is_abstract():
+    from notification_stream import Broker
+
+    with pytest.raises(TypeError):
+        Broker()
+
+
+def test_in_process_broker_delivers_to_the_users_streams():
+    from notification_stream import InProcessBroker
+
+    broker = InProcessBroker()
+    mine = broker.subscribe("user-1")
+    other = broker.subscribe("user-2")
+
+    broker.publish([{"user_id": "user-1", "message": "hello"}])
+
+    assert mine.events.get_nowait()["message"] == "hello"
+    assert other.events.empty()
+
+    broker.unsubscribe(mine)
+    broker.publish([{"user_id": "user-1", "message": "again"}])
+    assert mine.events.empty()
+
+
+def test_commit_publishes_flushed_notifications(published):
+    from models import db
+
+    user = make_user()
+    notify(user, "first")
+    notify(user, "second")
+    assert published == []
+
+    db.session.commit()
+
+    assert messages(published) == ["first", "second"]
+
+
+def test_rollback_discards_pending_notifications(published):
+    from models import db
+
+    user = make_user()
+    notify(user, "lost")
+    db.session.rollback()
+    db.session.commit()
+
+    assert published == []
+
+
+def test_savepoint_rollback_keeps_the_outer_transactions_events(published):
+    from models import db
+
+    user = make_user()
+    notify(user, "outer")
+
+    savepoint = db.session.begin_nested()
+    notify(user, "inner")
+    savepoint.rollback()
+
+    notify(user, "after")
+    db.session.commit()
+
+    assert messages(published) == ["after", "outer"]
+
+
+def test_released_savepoint_events_follow_the_outer_transaction(published):
+    from models import db
+
+    user = make_user()
+    with db.session.begin_nested():
+        notify(user, "kept")
+    db.session.commit()
+    assert messages(published) == ["kept"]
+
+    published.clear()
+    with db.session.begin_nested():
+        notify(user, "dropped")
+    db.session.rollback()
+    db.session.commit()
+    assert published == []
+
+
+class FailingConnection:
+    def __init__(self):
+        self.closed = False
+        self.autocommit = False
+
+    def cursor(self):
+        raise RuntimeError("connection lost")
+
+    def close(self):
+        self.closed = True
+
+
+def test_listener_closes_failed_connections_and_backs_off(monkeypatch):
+    import notification_stream
+    from notification_stream import PostgresBroker
+
+    connections = []
+    delays = []
+
+    broker = PostgresBroker("postgresql://localhost/test", reconnect_delay=1, max_reconnect_delay=4)
+
+    def connect(dsn):
+        connection = FailingConnection()
+        connections.append(connection)
+        return connection
+
+    def wait(delay):
+        delays.append(delay)
+        # Stop after a few attempts
+        return len(delays) >= 5
+
+    broker.connect = connect
+    monkeypatch.setattr(broker.stopping, "wait", wait)
+    logged = []
+    monkeypatch.setattr(notification_stream.logger, "exception",
+                        lambda *args, **kwargs: logged.append(args))
+
+    thread = threading.Thread(target=broker._listen)
+    thread.start()
+    thread.join(5)
+
+    assert not thread.is_alive()
+    assert delays == [1, 2, 4, 4, 4]
+    assert all(connection.closed for connection in connections)
+    assert len(logged) == 5
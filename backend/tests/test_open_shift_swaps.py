@@ -0,0 +1,51 @@
+from datetime import datetime, timedelta
+
+from conftest import make_user, make_group, make_shift, log_in
+
+START = datetime(2030, 4, 1, 9)
+
+
+def open_swaps(client, group, etag=None):
+    headers = {"If-None-Match": etag} if etag else {}
+    return client.get(f"/user/groups/{group.id}/shift-swaps/open", headers=headers)
+
+
+def test_busy_members_are_not_eligible(client):
+    from models import db, Shift_swap
+
+    owner, holder, free, busy = make_user(), make_user(), make_user(), make_user()
+    group = make_group(owner, members=[holder, free, busy])
+    shift = make_shift(group, holder, START)
+    make_shift(group, busy, START + timedelta(hours=2), hours=2)
+    db.session.add(Shift_swap(shift_id=shift.id, group_id=group.id, current_owner_id=holder.id))
+    db.session.commit()
+    log_in(client, owner)
+
+    swaps = open_swaps(client, group).get_json()["swaps"]
+
+    assert len(swaps) == 1
+    assert set(swaps[0]["eligible_member_ids"]) == {str(owner.id), str(free.id)}
+
+
+def test_member_busy_elsewhere_changes_the_etag(client):
+    from models import db, Shift_swap
+
+    owner, holder, member = make_user(), make_user(), make_user()
+    group = make_group(owner, members=[holder, member])
+    elsewhere = make_group(make_user(), members=[member])
+    shift = make_shift(group, holder, START)
+    db.session.add(Shift_swap(shift_id=shift.id, group_id=group.id, current_owner_id=holder.id))
+    db.session.commit()
+    log_in(client, owner)
+
+    first = open_swaps(client, group)
+    assert str(member.id) in first.get_json()["swaps"][0]["eligible_member_ids"]
+    etag = first.headers["ETag"]
+    assert open_swaps(client, group, etag).status_code == 304
+
+    # Only the member's own version moves; this group's is untouched
+    make_shift(elsewhere, member, START, hours=4)
+
+    second = open_swaps(client, group, etag)
+    assert second.status_code == 200
+    assert str(member.id) not in second.get_json()["swaps"][0]["eligible_member_ids"]
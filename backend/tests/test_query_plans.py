@@ -0,0 +1,213 @@
+"""
+Query-plan regression tests: each route's statements, captured while it
+runs against a seeded dataset, must use the indexes declared for them
+and never scan the large tables sequentially.
+"""
+
+from datetime import datetime, timedelta
+import json
+
+import pytest
+from sqlalchemy import text
+
+from conftest import log_in, captured_statements
+
+USERS = 5000
+GROUPS = 500
+
+# Tables large enough that a sequential scan is always a regression
+LARGE_TABLES = {"shifts", "notification_messages", "group_memberships", "shift_swaps"}
+
+SEED = """
+    INSERT INTO users (id, username, email)
+    SELECT md5('user' || i)::uuid, 'user' || i, 'user' || i || '@example.com'
+    FROM generate_series(1, :users) AS i;
+
+    INSERT INTO groups (id, name, owner_id)
+    SELECT md5('group' || g)::uuid, 'Group ' || g, md5('user' || g)::uuid
+    FROM generate_series(1, :groups) AS g;
+
+    -- Four groups per user, with every tenth membership still pending
+    INSERT INTO group_memberships (id, user_id, group_id, admin, approved)
+    SELECT md5('membership' || i || '-' || k)::uuid, md5('user' || i)::uuid,
+           md5('group' || (mod(i + k * 37, :groups) + 1))::uuid, false, mod(i, 10) <> 0
+    FROM generate_series(1, :users) AS i, generate_series(0, 3) AS k;
+
+    INSERT INTO group_memberships (id, user_id, group_id, admin, approved)
+    SELECT md5('owner' || g)::uuid, md5('user' || g)::uuid, md5('group' || g)::uuid, true, true
+    FROM generate_series(1, :groups) AS g
+    ON CONFLICT (user_id, group_id) DO UPDATE SET admin = true, approved = true;
+
+    -- Four shifts per membership, 36 hours apart per user so none overlap
+    INSERT INTO shifts (id, group_id, user_id, start_time, end_time)
+    SELECT md5(m.id::text || j)::uuid, m.group_id, m.user_id,
+           :origin + (m.rank * 4 + j) * interval '36 hours',
+           :origin + (m.rank * 4 + j) * interval '36 hours' + interval '8 hours'
+    FROM (
+        SELECT id, group_id, user_id,
+               row_number() OVER (PARTITION BY user_id ORDER BY group_id) - 1 AS rank
+        FROM group_memberships
+    ) AS m, generate_series(0, 3) AS j;
+
+    INSERT INTO shift_swaps (id, shift_id, group_id, current_owner_id)
+    SELECT md5('swap' || s.id::text)::uuid, s.id, s.group_id, s.user_id
+    FROM shifts AS s
+    WHERE mod(abs(hashtext(s.id::text)), 16) = 0;
+
+    INSERT INTO notification_messages (id, user_id, read, message, iat)
+    SELECT md5('notification' || i || '-' || n)::uuid, md5('user' || i)::uuid, mod(n, 3) = 0,
+           'Notification ' || n, :origin - n * interval '1 hour'
+    FROM generate_series(1, :users) AS i, generate_series(1, 20) AS n;
+"""
+
+
+@pytest.fixture
+def seeded(app):
+    from models import db, User, GroupMembership
+
+    origin = datetime.now().replace(minute=0, second=0, microsecond=0) - timedelta(days=10)
+    with db.engine.begin() as conn:
+        conn.execute(text(SEED), {"users": USERS, "groups": GROUPS, "origin": origin})
+    with db.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text("ANALYZE"))
+
+    owner = db.session.execute(
+        db.select(User).where(User.username == "user1")).scalar_one()
+    group_id = db.session.execute(
+        text("SELECT id FROM groups WHERE name = 'Group 1'")).scalar()
+    pending = db.session.execute(
+        db.select(GroupMembership.id)
+        .where(GroupMembership.group_id == group_id, GroupMembership.approved == False)
+        .limit(1)
+    ).scalar()
+    return owner, group_id, pending
+
+
+def plan_nodes(plan):
+    yield plan
+    for child in plan.get("Plans", ()):
+        yield from plan_nodes(child)
+
+
+def explain(statements):
+    """Every plan node of the captured reads and writes."""
+    from models import db
+
+    nodes = []
+    connection = db.engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        for statement, parameters in statements:
+            if not statement.lstrip().upper().startswith(("SELECT", "WITH", "UPDATE", "DELETE")):
+                continue
+            cursor.execute("EXPLAIN (FORMAT JSON) " + statement, parameters)
+            plan = cursor.fetchone()[0]
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            for node in plan_nodes(plan[0]["Plan"]):
+                nodes.append((statement, node))
+        connection.rollback()
+    finally:
+        connection.close()
+    return nodes
+
+
+def assert_plans(statements, *expected):
+    """
+    No sequential scan of a large table, and for each set in `expected`
+    at least one of its indexes is used.
+    """
+    nodes = explain(statements)
+    assert nodes, "no statements were captured"
+
+    for statement, node in nodes:
+        if node["Node Type"] == "Seq Scan":
+            assert node.get("Relation Name") not in LARGE_TABLES, \
+                f"sequential scan of {node['Relation Name']} in:\n{statement}"
+
+    used = {node.get("Index Name") for _, node in nodes}
+    for indexes in expected:
+        assert used & set(indexes), f"none of {indexes} used; used {used - {None}}"
+
+
+def request(client, method, url, **kwargs):
+    with captured_statements() as statements:
+        response = client.open(url, method=method, **kwargs)
+    assert response.status_code < 400, response.get_data(as_text=True)
+    return statements
+
+
+def test_group_info(client, seeded):
+    owner, group_id, _ = seeded
+    log_in(client, owner)
+
+    statements = request(client, "GET", f"/user/groups/{group_id}")
+    assert_plans(statements,
+                 {"group_memberships_pkey"},
+                 {"ix_group_memberships_group_id_approved"})
+
+
+def test_group_info_with_shifts(client, seeded):
+    owner, group_id, _ = seeded
+    log_in(client, owner)
+
+    statements = request(client, "GET", f"/user/groups/{group_id}?include_shifts=true")
+    assert_plans(statements,
+                 {"ix_shifts_group_id_end_time", "ix_shifts_group_id_start_time"})
+
+
+def test_group_schedule(client, seeded):
+    owner, group_id, _ = seeded
+    log_in(client, owner)
+    start = datetime.now() - timedelta(days=7)
+
+    statements = request(
+        client, "GET",
+        f"/user/groups/{group_id}/schedule"
+        f"?from={start.isoformat()}&to={(start + timedelta(days=14)).isoformat()}")
+    assert_plans(statements,
+                 {"ix_shifts_group_id_start_time", "ix_shifts_group_id_end_time"})
+
+
+def test_group_list(client, seeded):
+    owner, _, _ = seeded
+    log_in(client, owner)
+
+    statements = request(client, "GET", "/user/groups")
+    assert_plans(statements, {"group_memberships_pkey"})
+
+
+def test_notifications(client, seeded):
+    owner, _, _ = seeded
+    log_in(client, owner)
+
+    statements = request(client, "GET", "/user/notifications")
+    assert_plans(statements, {
+        "ix_notification_messages_user_id_iat",
+        "ix_notification_messages_user_id_read_iat"
+    })
+
+
+def test_notification_page(client, seeded):
+    owner, _, _ = seeded
+    log_in(client, owner)
+
+    statements = request(client, "GET", "/user/notifications/page?unread_only=true")
+    assert_plans(statements, {"ix_notification_messages_user_id_read_iat"})
+
+
+def test_open_shift_swaps(client, seeded):
+    owner, group_id, _ = seeded
+    log_in(client, owner)
+
+    statements = request(client, "GET", f"/user/groups/{group_id}/shift-swaps/open")
+    assert_plans(statements, {"ix_shift_swaps_group_id_open"})
+
+
+def test_membership_approval(client, seeded):
+    owner, _, pending = seeded
+    log_in(client, owner)
+
+    statements = request(client, "POST", "/user/memberships/approve-join",
+                         json={"membership_ids": [str(pending)]})
+    assert_plans(statements, {"group_memberships_id_key"})
@@ -0,0 +1,149 @@
+from datetime import datetime, timedelta
+from itertools import islice
+import random
+from types import SimpleNamespace
+import uuid
+
+import pytest
+
+from conftest import make_user, make_group, log_in
+
+DTSTART = datetime(2020, 1, 6, 9)
+
+
+def make_rule(freq, interval=1, by_day=None, until=None, duration_minutes=8 * 60):
+    return SimpleNamespace(id=uuid.uuid4(), dtstart=DTSTART, duration_minutes=duration_minutes,
+                           freq=freq, interval=interval, by_day=by_day, until=until)
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_windowed_expansion_matches_the_full_expansion(seed):
+    from recurrence import expand
+
+    rng = random.Random(seed)
+    freq = rng.choice(["DAILY", "WEEKLY"])
+    rule = make_rule(
+        freq, interval=rng.randint(1, 4),
+        by_day=",".join(map(str, sorted(rng.sample(range(7), 3)))) if freq == "WEEKLY" else None,
+        until=DTSTART + timedelta(days=rng.randint(200, 900)) if rng.random() < 0.5 else None,
+        duration_minutes=rng.randint(1, 24) * 60)
+    horizon = DTSTART + timedelta(days=1000)
+    everything = list(expand(rule, DTSTART, horizon))
+
+    for _ in range(20):
+        start = DTSTART + timedelta(hours=rng.randrange(-48, 24 * 990))
+        end = start + timedelta(hours=rng.randint(1, 24 * 21))
+        assert list(expand(rule, start, end)) == [
+            (a, b) for a, b in everything if a < end and b > start]
+
+
+def test_expansion_starts_at_the_window_however_old_the_rule_is():
+    from recurrence import expand
+
+    rule = make_rule("WEEKLY", by_day="0,2")
+    window_start = DTSTART + timedelta(days=365 * 50)
+    occurrences = expand(rule, window_start, window_start + timedelta(weeks=520))
+
+    # The first value is produced without walking fifty years of weeks
+    first = next(occurrences)
+    assert window_start - timedelta(days=7) < first[0] < window_start + timedelta(days=7)
+    assert len(list(islice(occurrences, 3))) == 3
+
+
+def expand_rule(rule, window_end):
+    from recurrence import expand
+
+    return list(expand(rule, DTSTART, window_end))
+
+
+def test_merged_occurrences_keep_their_own_rule():
+    from recurrence import merge_occurrences
+
+    first_user, second_user = uuid.uuid4(), uuid.uuid4()
+    mornings = make_rule("DAILY")
+    mornings.user_id = first_user
+    evenings = make_rule("WEEKLY", by_day="0,2,4")
+    evenings.dtstart = DTSTART + timedelta(hours=9)
+    evenings.duration_minutes = 4 * 60
+    evenings.user_id = second_user
+    # Cancel the first rule's Tuesday; the second rule has nothing then
+    cancelled = DTSTART + timedelta(days=1)
+    window_end = DTSTART + timedelta(weeks=1)
+
+    merged = list(merge_occurrences(
+        [mornings, evenings], {(mornings.id, cancelled)}, DTSTART, window_end))
+
+    expected = sorted(
+        [(mornings, start, end) for start, end in expand_rule(mornings, window_end)
+         if start != cancelled]
+        + [(evenings, start, end) for start, end in expand_rule(evenings, window_end)],
+        key=lambda occurrence: occurrence[1])
+    assert [(rule.user_id, start, end) for rule, start, end in merged] == [
+        (rule.user_id, start, end) for rule, start, end in expected]
+    assert len(merged) == 6 + 3
+    assert all(start != cancelled for _, start, _ in merged)
+
+
+def test_group_occurrences_skip_only_the_cancelled_rule(app):
+    from models import db, Shift_recurrence, Shift_recurrence_exception
+    from recurrence import group_occurrences
+
+    owner, member = make_user(), make_user()
+    group = make_group(owner, members=[member])
+    day = Shift_recurrence(group_id=group.id, user_id=owner.id, dtstart=DTSTART,
+                           duration_minutes=8 * 60, freq="DAILY", interval=1)
+    night = Shift_recurrence(group_id=group.id, user_id=member.id,
+                             dtstart=DTSTART + timedelta(hours=12),
+                             duration_minutes=8 * 60, freq="DAILY", interval=1)
+    db.session.add_all([day, night])
+    db.session.flush()
+    db.session.add(Shift_recurrence_exception(
+        recurrence_id=night.id, occurrence_start=night.dtstart + timedelta(days=1)))
+    db.session.commit()
+
+    merged = list(group_occurrences(group.id, DTSTART, DTSTART + timedelta(days=3)))
+
+    assert [(rule.user_id, start) for rule, start, _ in merged] == [
+        (owner.id, DTSTART),
+        (member.id, DTSTART + timedelta(hours=12)),
+        (owner.id, DTSTART + timedelta(days=1)),
+        (owner.id, DTSTART + timedelta(days=2)),
+        (member.id, DTSTART + timedelta(days=2, hours=12)),
+    ]
+
+
+def materialize(client, group, rule, start):
+    return client.post(
+        f"/user/groups/{group.id}/recurring-shifts/{rule.id}/materialize",
+        json={"occurrence_start_iso": start.isoformat()})
+
+
+@pytest.fixture
+def rule_setup(app):
+    from models import db, Shift_recurrence
+
+    owner, assignee, other = make_user(), make_user(), make_user()
+    group = make_group(owner, members=[assignee, other])
+    rule = Shift_recurrence(group_id=group.id, user_id=assignee.id, dtstart=DTSTART,
+                            duration_minutes=8 * 60, freq="DAILY", interval=1)
+    db.session.add(rule)
+    db.session.commit()
+    return owner, assignee, other, group, rule
+
+
+def test_other_members_cannot_materialise_a_rule(client, rule_setup):
+    _, _, other, group, rule = rule_setup
+    log_in(client, other)
+
+    assert materialize(client, group, rule, DTSTART).status_code == 401
+
+
+@pytest.mark.parametrize("who", ["owner", "assignee"])
+def test_admins_and_the_assignee_can_materialise(client, rule_setup, who):
+    owner, assignee, _, group, rule = rule_setup
+    log_in(client, owner if who == "owner" else assignee)
+
+    response = materialize(client, group, rule, DTSTART + timedelta(days=3))
+
+    assert response.status_code == 201
+    assert response.get_json()["shift"]["user_id"] == str(assignee.id)
@@ -0,0 +1,280 @@
+"""
+The interval index is checked against brute force: random schedules and
+random edits, with every answer compared with a plain scan of the same
+shifts, and then against SQL for schedules stored in Postgres.
+"""
+
+from datetime import datetime, timedelta
+import random
+import uuid
+
+import pytest
+
+from conftest import make_user, make_group, make_shift
+
+ORIGIN = datetime(2030, 1, 7)
+HOURS = 24 * 28
+SEEDS = range(25)
+
+
+def random_interval(rng):
+    start = ORIGIN + timedelta(hours=rng.randrange(HOURS))
+    return start, start + timedelta(hours=rng.randint(1, 12))
+
+
+def random_window(rng):
+    start = ORIGIN + timedelta(hours=rng.randrange(-24, HOURS))
+    return start, start + timedelta(hours=rng.randint(1, 72))
+
+
+def random_rule(rng, user_id):
+    from schedule_index import Rule
+
+    freq = rng.choice(["DAILY", "WEEKLY"])
+    by_day = None
+    if freq == "WEEKLY" and rng.random() < 0.5:
+        by_day = ",".join(str(day) for day in sorted(rng.sample(range(7), rng.randint(1, 3))))
+    dtstart = ORIGIN + timedelta(hours=rng.randrange(HOURS // 2))
+    return Rule(uuid.uuid4(), user_id, dtstart, rng.randint(1, 10) * 60, freq,
+                rng.randint(1, 3), by_day,
+                dtstart + timedelta(days=rng.randint(3, 40)) if rng.random() < 0.5 else None)
+
+
+def naive_occurrences(rule, until):
+    """Every occurrence of `rule` starting before `until`, by walking day by day."""
+    duration = timedelta(minutes=rule.duration_minutes)
+    days = ([int(day) for day in rule.by_day.split(",")] if rule.by_day
+            else [rule.dtstart.weekday()])
+    monday = (rule.dtstart - timedelta(days=rule.dtstart.weekday())).date()
+    start = rule.dtstart
+    while start < until and (rule.until is None or start <= rule.until):
+        if rule.freq == "DAILY":
+            if (start - rule.dtstart).days % rule.interval == 0:
+                yield start, start + duration
+        elif start.weekday() in days and ((start.date() - monday).days // 7) % rule.interval == 0:
+            yield start, start + duration
+        start += timedelta(days=1)
+
+
+class BruteForce:
+    def __init__(self, member_ids):
+        self.member_ids = member_ids
+        self.shifts = {}
+        self.rules = []
+        self.skipped = set()
+
+    def intervals(self, until):
+        for shift_id, (user_id, start, end) in self.shifts.items():
+            yield shift_id, user_id, start, end
+        for rule in self.rules:
+            for start, end in naive_occurrences(rule, until):
+                if (rule.id, start) not in self.skipped:
+                    yield f"{rule.id}:{start.isoformat()}", rule.user_id, start, end
+
+    def working_at(self, t):
+        return {user_id for _, user_id, start, end in self.intervals(t + timedelta(seconds=1))
+                if user_id is not None and start <= t < end}
+
+    def shifts_between(self, a, b):
+        return sorted(
+            (str(shift_id), user_id, start, end)
+            for shift_id, user_id, start, end in self.intervals(b)
+            if start < b and end > a)
+
+    def free_members(self, a, b):
+        busy = {user_id for _, user_id, start, end in self.intervals(b) if start < b and end > a}
+        return [user_id for user_id in self.member_ids if user_id not in busy]
+
+
+def compare(index, brute, rng, probes=10):
+    for _ in range(probes):
+        t = random_window(rng)[0] + timedelta(minutes=rng.choice([0, 30]))
+        assert set(index.working_at(t)) == brute.working_at(t), t
+
+        a, b = random_window(rng)
+        assert sorted(
+            (str(shift_id), user_id, start, end)
+            for shift_id, user_id, start, end in index.shifts_between(a, b)
+        ) == brute.shifts_between(a, b), (a, b)
+        assert index.free_members(brute.member_ids, a, b) == brute.free_members(a, b), (a, b)
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_index_matches_brute_force_under_random_edits(seed):
+    from schedule_index import GroupScheduleIndex
+
+    rng = random.Random(seed)
+    member_ids = [uuid.uuid4() for _ in range(6)]
+    index = GroupScheduleIndex(uuid.uuid4())
+    brute = BruteForce(member_ids)
+
+    for rule in (random_rule(rng, rng.choice(member_ids)) for _ in range(rng.randint(0, 3))):
+        index.rules[rule.id] = rule
+        brute.rules.append(rule)
+
+    for step in range(120):
+        if brute.shifts and rng.random() < 0.35:
+            shift_id = rng.choice(list(brute.shifts))
+            user_id, start, _ = brute.shifts.pop(shift_id)
+            index.remove(shift_id, user_id, start)
+        elif brute.rules and rng.random() < 0.1:
+            rule = rng.choice(brute.rules)
+            occurrence = next(naive_occurrences(rule, ORIGIN + timedelta(hours=HOURS)), None)
+            if occurrence is not None:
+                index.skip(rule.id, occurrence[0])
+                brute.skipped.add((rule.id, occurrence[0]))
+        else:
+            # Overlaps are allowed here, as in legacy data, so both the
+            # disjoint and the overlapping paths are exercised
+            shift_id = uuid.uuid4()
+            user_id = rng.choice(member_ids + [None])
+            start, end = random_interval(rng)
+            index.add(shift_id, user_id, start, end)
+            brute.shifts[shift_id] = (user_id, start, end)
+
+        if step % 10 == 0:
+            compare(index, brute, rng)
+
+    compare(index, brute, rng, probes=50)
+
+
+def test_removing_the_last_overlap_makes_a_member_disjoint_again():
+    from schedule_index import MemberIntervals
+
+    intervals = MemberIntervals()
+    first, second, third = uuid.uuid4(), uuid.uuid4(), uuid.uuid4()
+    intervals.add(first, 0, 100)
+    intervals.add(second, 50, 150)
+    intervals.add(third, 200, 300)
+    assert not intervals.disjoint
+
+    intervals.remove(second, 50)
+    assert intervals.disjoint
+    assert list(intervals.intersecting(90, 210)) == [0, 1]
+
+
+def test_change_committed_during_a_load_is_not_lost():
+    from schedule_index import GroupScheduleIndex, ScheduleIndexRegistry
+
+    group_id = uuid.uuid4()
+    shift_id = uuid.uuid4()
+    loads = []
+
+    def loader(group_id):
+        index = GroupScheduleIndex(group_id)
+        if not loads:
+            # Another request commits a shift after this snapshot was read
+            registry.update(group_id, lambda index: index.add(
+                shift_id, None, ORIGIN, ORIGIN + timedelta(hours=1)))
+        else:
+            index.add(shift_id, None, ORIGIN, ORIGIN + timedelta(hours=1))
+        loads.append(index)
+        return index
+
+    registry = ScheduleIndexRegistry(loader=loader)
+    index = registry.get(group_id)
+
+    assert len(loads) == 2
+    assert index is loads[1]
+    assert registry.loaded(group_id) is index
+    assert index.shifts_between(ORIGIN, ORIGIN + timedelta(hours=1))
+
+
+def test_changes_after_a_load_are_applied_to_the_cached_index():
+    from schedule_index import GroupScheduleIndex, ScheduleIndexRegistry
+
+    registry = ScheduleIndexRegistry(loader=GroupScheduleIndex)
+    group_id = uuid.uuid4()
+    index = registry.get(group_id)
+
+    registry.update(group_id, lambda index: index.add(
+        uuid.uuid4(), None, ORIGIN, ORIGIN + timedelta(hours=1)))
+
+    assert registry.get(group_id) is index
+    assert len(index.shifts_between(ORIGIN, ORIGIN + timedelta(hours=1))) == 1
+
+
+def sql_shifts_between(group, a, b):
+    from models import db, Shift
+    from recurrence import group_occurrences, occurrence_id
+    from scheduling import shift_range
+
+    rows = db.session.execute(
+        db.select(Shift.id, Shift.user_id, Shift.start_time, Shift.end_time)
+        .where(Shift.group_id == group.id, Shift.during.op('&&')(shift_range(a, b)))
+    ).all()
+    rows = [(str(shift_id), user_id, start, end) for shift_id, user_id, start, end in rows]
+    rows += [(occurrence_id(rule.id, start), rule.user_id, start, end)
+             for rule, start, end in group_occurrences(group.id, a, b)]
+    return sorted(rows)
+
+
+def index_shifts_between(group, a, b):
+    from schedule_index import schedule_indexes
+
+    return sorted(
+        (str(shift_id), user_id, start, end)
+        for shift_id, user_id, start, end
+        in schedule_indexes.get(group.id).shifts_between(a, b))
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_index_matches_sql(app, seed):
+    from models import db, Shift, Shift_recurrence
+    from recurrence import materialize_occurrence
+
+    rng = random.Random(seed)
+    owner = make_user()
+    members = [make_user() for _ in range(4)]
+    group = make_group(owner, members=members)
+
+    for member in members:
+        # One shift per day at most, so nothing overlaps
+        for day in rng.sample(range(28), 10):
+            make_shift(group, member, ORIGIN + timedelta(days=day, hours=rng.randrange(12)),
+                       hours=rng.randint(1, 10))
+    rule = Shift_recurrence(group_id=group.id, user_id=owner.id,
+                            dtstart=ORIGIN + timedelta(hours=9), duration_minutes=8 * 60,
+                            freq="WEEKLY", interval=1, by_day="0,2")
+    db.session.add(rule)
+    db.session.commit()
+
+    windows = [random_window(rng) for _ in range(20)]
+    for a, b in windows:
+        assert index_shifts_between(group, a, b) == sql_shifts_between(group, a, b)
+
+    # Edits committed through the ORM reach the loaded index
+    shifts = Shift.query.filter_by(group_id=group.id).all()
+    for shift in rng.sample(shifts, 5):
+        db.session.delete(shift)
+    moved = rng.choice([shift for shift in shifts if shift in db.session])
+    moved.end_time = moved.start_time + timedelta(minutes=30)
+    materialize_occurrence(rule, ORIGIN + timedelta(days=7, hours=9))
+    db.session.commit()
+
+    for a, b in windows:
+        assert index_shifts_between(group, a, b) == sql_shifts_between(group, a, b)
+
+
+def test_rolled_back_savepoint_changes_do_not_reach_the_index(app):
+    from models import db, Shift
+    from schedule_index import schedule_indexes
+
+    owner = make_user()
+    group = make_group(owner)
+    index = schedule_indexes.get(group.id)
+
+    kept = Shift(group_id=group.id, user_id=owner.id,
+                 start_time=ORIGIN, end_time=ORIGIN + timedelta(hours=8))
+    db.session.add(kept)
+    db.session.flush()
+
+    savepoint = db.session.begin_nested()
+    db.session.add(Shift(group_id=group.id, user_id=owner.id,
+                         start_time=ORIGIN + timedelta(days=1),
+                         end_time=ORIGIN + timedelta(days=1, hours=8)))
+    db.session.flush()
+    savepoint.rollback()
+    db.session.commit()
+
+    assert [shift[0] for shift in index.shifts_between(ORIGIN, ORIGIN + timedelta(days=2))] == [kept.id]
@@ -0,0 +1,156 @@
+from datetime import datetime, timedelta
+import random
+import uuid
+
+import pytest
+
+from conftest import make_user, make_group, make_shift, log_in
+
+START = datetime(2030, 2, 4, 9)
+
+
+def overlaps(a, b):
+    return a[0] < b[1] and b[0] < a[1]
+
+
+@pytest.mark.parametrize("seed", range(50))
+def test_sweep_never_accepts_an_overlap(seed):
+    from scheduling import sweep_batch_overlaps
+
+    rng = random.Random(seed)
+    users = [uuid.uuid4() for _ in range(3)]
+
+    def interval():
+        start = START + timedelta(hours=rng.randrange(72))
+        return start, start + timedelta(hours=rng.randint(1, 10))
+
+    batch = [(position, rng.choice(users), *interval()) for position in range(rng.randint(1, 20))]
+    existing = [(uuid.uuid4(), rng.choice(users), *interval()) for _ in range(rng.randint(0, 6))]
+
+    rejected = sweep_batch_overlaps(batch, existing)
+    accepted = [item for item in batch if item[0] not in rejected]
+
+    for position, user_id, start, end in accepted:
+        assert not any(user_id == other_user and overlaps((start, end), (a, b))
+                       for _, other_user, a, b in existing)
+        assert not any(user_id == other[1] and position != other[0]
+                       and overlaps((start, end), other[2:]) for other in accepted)
+    # A shift clashing with nothing at all is never rejected
+    for position, user_id, start, end in batch:
+        if not any(user_id == other[1] and other[0] != position and overlaps((start, end), other[2:])
+                   for other in batch + existing):
+            assert position not in rejected
+
+
+def batch(client, group, shifts, mode=None):
+    body = {"shifts": [
+        {"shift_owner_membership_id": str(user.id),
+         "start_time_iso": start.isoformat(),
+         "end_time_iso": (start + timedelta(hours=hours)).isoformat()}
+        for user, start, hours in shifts
+    ]}
+    if mode is not None:
+        body["mode"] = mode
+    return client.post(f"/user/groups/{group.id}/shifts/batch", json=body)
+
+
+def stored_shifts(group):
+    from models import db, Shift
+
+    db.session.expire_all()
+    return set(db.session.execute(
+        db.select(Shift.user_id, Shift.start_time).where(Shift.group_id == group.id)
+    ).all())
+
+
+@pytest.fixture
+def batch_setup(app, client):
+    owner, member = make_user(), make_user()
+    group = make_group(owner, members=[member])
+    # Already stored: the member works 9-17 on the first day
+    make_shift(group, member, START)
+    log_in(client, owner)
+    return owner, member, group
+
+
+def test_all_or_nothing_creates_nothing_when_one_shift_clashes(client, batch_setup):
+    owner, member, group = batch_setup
+
+    response = batch(client, group, [
+        (owner, START, 8),
+        (member, START + timedelta(days=1), 8),
+        # Overlaps the stored shift
+        (member, START + timedelta(hours=4), 2),
+    ])
+
+    assert response.status_code == 422
+    assert response.get_json()["errors"] == [{"index": 2, "message": "Overlaps an existing shift"}]
+    assert len(stored_shifts(group)) == 1
+
+
+def test_best_effort_creates_the_valid_shifts(client, batch_setup):
+    owner, member, group = batch_setup
+
+    response = batch(client, group, [
+        (owner, START, 8),
+        (member, START + timedelta(hours=4), 2),
+        (member, START + timedelta(days=1), 8),
+        # Overlaps the previous shift of the same batch
+        (member, START + timedelta(days=1, hours=6), 4),
+        (make_user(), START, 8),
+    ], mode="best_effort")
+
+    assert response.status_code == 201
+    body = response.get_json()
+    assert [item["index"] for item in body["created"]] == [0, 2]
+    assert body["errors"] == [
+        {"index": 1, "message": "Overlaps an existing shift"},
+        {"index": 3, "message": "Overlaps another shift in this batch"},
+        {"index": 4, "message": "Assigned user does not have an approved membership to this group"},
+    ]
+    assert stored_shifts(group) == {
+        (member.id, START), (owner.id, START), (member.id, START + timedelta(days=1))}
+
+
+def test_recurring_occurrences_count_as_stored_shifts(client, batch_setup):
+    from models import db, Shift_recurrence
+
+    owner, _, group = batch_setup
+    db.session.add(Shift_recurrence(
+        group_id=group.id, user_id=owner.id, dtstart=START - timedelta(days=7),
+        duration_minutes=60, freq="DAILY", interval=1))
+    db.session.commit()
+
+    response = batch(client, group, [(owner, START + timedelta(days=2), 2)])
+
+    assert response.status_code == 422
+    assert response.get_json()["errors"][0]["message"] == "Overlaps an existing shift"
+
+
+def test_concurrent_overlap_answers_409(client, batch_setup, monkeypatch):
+    import app as app_module
+    from models import db, Shift
+    from recurrence import user_occurrences
+    from sqlalchemy import insert
+
+    owner, member, group = batch_setup
+
+    def write_concurrently(user_ids, window_start, window_end):
+        # Another writer commits after the overlap sweep read the shifts
+        with db.engine.connect() as conn:
+            conn.execute(insert(Shift).values(
+                group_id=group.id, user_id=member.id,
+                start_time=START + timedelta(days=1), end_time=START + timedelta(days=1, hours=8)))
+            conn.commit()
+        return user_occurrences(user_ids, window_start, window_end)
+
+    monkeypatch.setattr(app_module, "user_occurrences", write_concurrently)
+
+    response = batch(client, group, [
+        (owner, START + timedelta(days=1), 8),
+        (member, START + timedelta(days=1, hours=2), 4),
+    ])
+
+    assert response.status_code == 409
+    # Neither batch shift was kept
+    assert stored_shifts(group) == {(member.id, START), (member.id, START + timedelta(days=1))}
@@ -0,0 +1,135 @@
+"""
+The exclusion constraint must keep a member from being double-booked
+however many writers race, and the overlap check must only touch the
+shifts that intersect the new one.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+import statistics
+import threading
+import time
+
+import pytest
+from sqlalchemy import insert, text
+from sqlalchemy.exc import IntegrityError
+
+from conftest import make_user, make_group, make_shift, log_in
+
+WRITERS = 8
+
+
+def overlapping_pairs(user):
+    from models import db
+
+    return db.session.execute(text("""
+        SELECT a.id, b.id FROM shifts AS a
+        JOIN shifts AS b ON a.user_id = b.user_id AND a.id < b.id AND a.during && b.during
+        WHERE a.user_id = :user_id
+    """), {"user_id": user.id}).all()
+
+
+def test_parallel_inserts_are_serialised_by_the_constraint(app):
+    from models import db, Shift
+
+    owner = make_user()
+    group = make_group(owner)
+    start = datetime(2030, 1, 7, 9)
+    barrier = threading.Barrier(WRITERS)
+
+    def write(offset):
+        with db.engine.connect() as conn:
+            barrier.wait()
+            try:
+                conn.execute(insert(Shift).values(
+                    group_id=group.id, user_id=owner.id,
+                    start_time=start + timedelta(minutes=offset),
+                    end_time=start + timedelta(hours=8, minutes=offset)))
+                conn.commit()
+                return True
+            except IntegrityError:
+                conn.rollback()
+                return False
+
+    with ThreadPoolExecutor(WRITERS) as pool:
+        results = list(pool.map(write, range(WRITERS)))
+
+    assert results.count(True) == 1
+    assert overlapping_pairs(owner) == []
+
+
+def test_parallel_route_writers_never_double_book(app):
+    owner = make_user()
+    group = make_group(owner)
+    # An existing shift every writer has to merge with
+    make_shift(group, owner, datetime(2030, 1, 7, 12), hours=2)
+    barrier = threading.Barrier(WRITERS)
+
+    def create(offset):
+        client = app.test_client()
+        log_in(client, owner)
+        start = datetime(2030, 1, 7, 9) + timedelta(minutes=15 * offset)
+        barrier.wait()
+        return client.post(f"/user/groups/{group.id}/shift", json={
+            "shift_owner_membership_id": str(owner.id),
+            "start_time_iso": start.isoformat(),
+            "end_time_iso": (start + timedelta(hours=4)).isoformat()
+        }).status_code
+
+    with ThreadPoolExecutor(WRITERS) as pool:
+        statuses = list(pool.map(create, range(WRITERS)))
+
+    assert set(statuses) <= {201, 409}, statuses
+    assert 201 in statuses
+    assert overlapping_pairs(owner) == []
+
+
+def seed_history(group, user, count):
+    """`count` past shifts for `user`, a day apart, ending before 2030."""
+    from models import db
+
+    with db.engine.begin() as conn:
+        conn.execute(text("""
+            INSERT INTO shifts (id, group_id, user_id, start_time, end_time)
+            SELECT gen_random_uuid(), :group_id, :user_id,
+                   :origin - i * interval '1 day',
+                   :origin - i * interval '1 day' + interval '8 hours'
+            FROM generate_series(1, :count) AS i
+        """), {"group_id": group.id, "user_id": user.id,
+               "origin": datetime(2030, 1, 1), "count": count})
+    with db.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text("ANALYZE shifts"))
+
+
+def median_write_time(client, group, user, day, runs=15):
+    timings = []
+    for run in range(runs):
+        start = day + timedelta(days=run)
+        began = time.perf_counter()
+        response = client.post(f"/user/groups/{group.id}/shift", json={
+            "shift_owner_membership_id": str(user.id),
+            "start_time_iso": start.isoformat(),
+            "end_time_iso": (start + timedelta(hours=8)).isoformat()
+        })
+        timings.append(time.perf_counter() - began)
+        assert response.status_code == 201
+    return statistics.median(timings)
+
+
+@pytest.mark.parametrize("small, large", [(100, 50000)])
+def test_write_latency_does_not_grow_with_history(client, small, large):
+    newcomer = make_user()
+    veteran = make_user()
+    group = make_group(newcomer, members=[veteran])
+    log_in(client, newcomer)
+    seed_history(group, newcomer, small)
+    seed_history(group, veteran, large)
+
+    # Warm the caches so the first timed write isn't an outlier
+    median_write_time(client, group, newcomer, datetime(2031, 1, 1), runs=3)
+
+    baseline = median_write_time(client, group, newcomer, datetime(2032, 1, 1))
+    grown = median_write_time(client, group, veteran, datetime(2032, 1, 1))
+
+    # A check that loaded the history would be hundreds of times slower
+    assert grown < baseline * 3 + 0.01, (baseline, grown)
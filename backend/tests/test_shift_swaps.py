@@ -0,0 +1,359 @@
+from datetime import datetime, timedelta
+
+from conftest import make_user, make_group, make_shift, log_in
+
+START = datetime(2030, 3, 4, 9)
+
+
+def make_swap(shift, new_owner=None):
+    from models import db, Shift_swap
+
+    swap = Shift_swap(shift_id=shift.id, group_id=shift.group_id,
+                      current_owner_id=shift.user_id,
+                      new_owner_id=new_owner.id if new_owner else None)
+    db.session.add(swap)
+    db.session.commit()
+    return swap
+
+
+def notifications_for(user):
+    from models import db, Notification_messages
+
+    return db.session.execute(
+        db.select(Notification_messages.message)
+        .where(Notification_messages.user_id == user.id)
+    ).scalars().all()
+
+
+def reload(model, id):
+    from models import db
+
+    db.session.expire_all()
+    return db.session.get(model, id)
+
+
+def swap_url(group, shift, swap, action):
+    return f"/user/groups/{group.id}/shift/{shift.id}/shift-swap/{swap.id}/{action}"
+
+
+def test_new_owner_can_unlink_themselves(client):
+    from models import Shift_swap
+
+    owner, holder, taker = make_user(), make_user(), make_user()
+    group = make_group(owner, members=[holder, taker])
+    shift = make_shift(group, holder, START)
+    swap = make_swap(shift, new_owner=taker)
+
+    log_in(client, taker)
+    response = client.delete(swap_url(group, shift, swap, "decline"))
+
+    assert response.status_code == 204
+    assert reload(Shift_swap, swap.id).new_owner_id is None
+    assert any("removed their request" in message for message in notifications_for(holder))
+
+
+def test_admin_decline_and_delete(client):
+    from models import Shift_swap
+
+    owner, holder, taker = make_user(), make_user(), make_user()
+    group = make_group(owner, members=[holder, taker])
+    shift = make_shift(group, holder, START)
+    swap = make_swap(shift, new_owner=taker)
+
+    log_in(client, owner)
+    response = client.delete(swap_url(group, shift, swap, "decline"),
+                             json={"delete_request": False})
+    assert response.status_code == 204
+    assert reload(Shift_swap, swap.id).new_owner_id is None
+    assert any("2030-03-04 09:00" in message and "declined" in message
+               for message in notifications_for(holder))
+
+    response = client.delete(swap_url(group, shift, swap, "decline"),
+                             json={"delete_request": True})
+    assert response.status_code == 204
+    assert reload(Shift_swap, swap.id) is None
+
+
+def test_uninvolved_member_cannot_decline(client):
+    owner, holder, taker, bystander = make_user(), make_user(), make_user(), make_user()
+    group = make_group(owner, members=[holder, taker, bystander])
+    shift = make_shift(group, holder, START)
+    swap = make_swap(shift, new_owner=taker)
+
+    log_in(client, bystander)
+    response = client.delete(swap_url(group, shift, swap, "decline"),
+                             json={"delete_request": True})
+
+    assert response.status_code == 401
+
+
+def test_decline_looks_the_swap_up_by_id(client):
+    owner, holder = make_user(), make_user()
+    group = make_group(owner, members=[holder])
+    shift = make_shift(group, holder, START)
+    other_shift = make_shift(group, holder, START + timedelta(days=1))
+    swap = make_swap(other_shift)
+
+    log_in(client, owner)
+    response = client.delete(swap_url(group, shift, swap, "decline"),
+                             json={"delete_request": True})
+
+    assert response.status_code == 404
+
+
+def test_rejected_link_leaves_the_swap_unclaimed(client):
+    from models import db, Shift, Shift_swap, Shift_recurrence
+
+    owner, holder = make_user(), make_user()
+    group = make_group(owner, members=[holder])
+    shift = make_shift(group, holder, START)
+    swap = make_swap(shift)
+    # The admin taking the shift already works it through a recurring rule
+    db.session.add(Shift_recurrence(
+        group_id=group.id, user_id=owner.id, dtstart=START,
+        duration_minutes=8 * 60, freq="DAILY", interval=1))
+    db.session.commit()
+
+    log_in(client, owner)
+    response = client.post(swap_url(group, shift, swap, "link"))
+
+    assert response.status_code == 409
+    assert reload(Shift_swap, swap.id).new_owner_id is None
+    assert reload(Shift, shift.id).user_id == holder.id
+
+
+def test_admin_link_completes_the_swap(client):
+    from models import Shift, Shift_swap
+
+    owner, holder = make_user(), make_user()
+    group = make_group(owner, members=[holder])
+    shift = make_shift(group, holder, START)
+    swap = make_swap(shift)
+
+    log_in(client, owner)
+    response = client.post(swap_url(group, shift, swap, "link"))
+
+    assert response.status_code == 200
+    assert reload(Shift, shift.id).user_id == owner.id
+    swap = reload(Shift_swap, swap.id)
+    assert swap.new_owner_id == owner.id
+    assert swap.approved_by_admin_id == owner.id
+
+
+def test_approving_a_swap_of_an_open_shift(client):
+    from models import db, Shift, Notification_messages
+
+    owner, taker = make_user(), make_user()
+    group = make_group(owner, members=[taker])
+    shift = make_shift(group, None, START)
+    swap = make_swap(shift, new_owner=taker)
+    log_in(client, owner)
+
+    response = client.post(swap_url(group, shift, swap, "approve"))
+
+    assert response.status_code == 200
+    assert reload(Shift, shift.id).user_id == taker.id
+    assert any("assigned a new shift" in message for message in notifications_for(taker))
+    # No notification addressed to nobody
+    assert db.session.execute(
+        db.select(db.func.count()).select_from(Notification_messages)
+        .where(Notification_messages.user_id.is_(None))
+    ).scalar() == 0
+
+
+def test_open_shifts_can_be_modified_and_deleted(client):
+    from models import Shift
+
+    owner, member = make_user(), make_user()
+    group = make_group(owner, members=[member])
+    shift = make_shift(group, None, START)
+    log_in(client, owner)
+
+    response = client.put(f"/user/groups/{group.id}/shift/{shift.id}", json={
+        "shift_owner_membership_id": str(member.id),
+        "start_time_iso": START.isoformat(),
+        "end_time_iso": (START + timedelta(hours=6)).isoformat()
+    })
+    assert response.status_code == 200
+    assert reload(Shift, shift.id).user_id == member.id
+    assert any("assigned a new shift" in message for message in notifications_for(member))
+
+    open_shift = make_shift(group, None, START + timedelta(days=1))
+    response = client.delete(f"/user/groups/{group.id}/shift/{open_shift.id}")
+    assert response.status_code == 204
+    assert reload(Shift, open_shift.id) is None
+
+
+def test_modifying_a_shift_in_place_notifies_the_same_owner(client):
+    owner, member = make_user(), make_user()
+    group = make_group(owner, members=[member])
+    shift = make_shift(group, member, START)
+    log_in(client, owner)
+
+    response = client.put(f"/user/groups/{group.id}/shift/{shift.id}", json={
+        "shift_owner_membership_id": str(member.id),
+        "start_time_iso": START.isoformat(),
+        "end_time_iso": (START + timedelta(hours=4)).isoformat()
+    })
+
+    assert response.status_code == 200
+    messages = notifications_for(member)
+    assert any("was modified" in message for message in messages)
+    assert not any("unassigned" in message for message in messages)
+
+
+def batch_swaps(client, group, method, swap_ids, **body):
+    action = "approve" if method == "POST" else "decline"
+    return client.open(f"/user/groups/{group.id}/shift-swaps/{action}", method=method,
+                       json={"swap_ids": [str(swap_id) for swap_id in swap_ids], **body})
+
+
+def test_batch_approve_assigns_every_shift_once(client):
+    from models import Shift, Shift_swap
+
+    owner, holder, taker = make_user(), make_user(), make_user()
+    group = make_group(owner, members=[holder, taker])
+    shifts = [make_shift(group, holder, START + timedelta(days=day)) for day in range(3)]
+    swaps = [make_swap(shift, new_owner=taker) for shift in shifts]
+    log_in(client, owner)
+
+    response = batch_swaps(client, group, "POST", [swap.id for swap in swaps])
+    assert response.status_code == 200
+    assert response.get_json()["updated"] == 3
+    assert all(reload(Shift, shift.id).user_id == taker.id for shift in shifts)
+    assert all(reload(Shift_swap, swap.id).approved_by_admin_id == owner.id for swap in swaps)
+    assert len([m for m in notifications_for(holder) if "unassigned" in m]) == 3
+
+    # Approving a completed swap again is refused and changes nothing
+    again = batch_swaps(client, group, "POST", [swaps[0].id])
+    assert again.status_code == 409
+    assert again.get_json()["swap_ids"] == [str(swaps[0].id)]
+    assert len([m for m in notifications_for(taker) if "assigned a new shift" in m]) == 3
+
+
+def test_batch_approve_rejects_overlapping_new_owners(client):
+    from models import Shift
+
+    owner, holder, taker = make_user(), make_user(), make_user()
+    group = make_group(owner, members=[holder, taker])
+    shift = make_shift(group, holder, START)
+    make_shift(group, taker, START + timedelta(hours=4))
+    swap = make_swap(shift, new_owner=taker)
+    log_in(client, owner)
+
+    response = batch_swaps(client, group, "POST", [swap.id])
+
+    assert response.status_code == 409
+    assert reload(Shift, shift.id).user_id == holder.id
+
+
+def test_batch_approve_answers_409_on_a_concurrent_overlap(client, monkeypatch):
+    import app as app_module
+    from models import db, Shift, Shift_swap
+    from recurrence import user_occurrences
+    from sqlalchemy import insert
+
+    owner, holder, taker = make_user(), make_user(), make_user()
+    group = make_group(owner, members=[holder, taker])
+    shift = make_shift(group, holder, START)
+    swap = make_swap(shift, new_owner=taker)
+    log_in(client, owner)
+
+    def write_concurrently(user_ids, window_start, window_end):
+        # The taker is booked elsewhere after the conflict sweep read the shifts
+        with db.engine.connect() as conn:
+            conn.execute(insert(Shift).values(
+                group_id=group.id, user_id=taker.id,
+                start_time=START + timedelta(hours=2), end_time=START + timedelta(hours=4)))
+            conn.commit()
+        return user_occurrences(user_ids, window_start, window_end)
+
+    monkeypatch.setattr(app_module, "user_occurrences", write_concurrently)
+
+    response = batch_swaps(client, group, "POST", [swap.id])
+
+    assert response.status_code == 409
+    assert reload(Shift, shift.id).user_id == holder.id
+    assert reload(Shift_swap, swap.id).approved_by_admin_id is None
+    assert not notifications_for(taker)
+
+
+def test_batch_decline_and_delete(client):
+    from models import Shift_swap
+
+    owner, holder, taker = make_user(), make_user(), make_user()
+    group = make_group(owner, members=[holder, taker])
+    pending = make_swap(make_shift(group, holder, START), new_owner=taker)
+    done = make_swap(make_shift(group, holder, START + timedelta(days=1)), new_owner=taker)
+    log_in(client, owner)
+    assert batch_swaps(client, group, "POST", [done.id]).status_code == 200
+
+    # A completed swap can't be declined, only deleted
+    response = batch_swaps(client, group, "DELETE", [pending.id, done.id], delete_request=False)
+    assert response.status_code == 409
+    assert reload(Shift_swap, pending.id).new_owner_id == taker.id
+
+    response = batch_swaps(client, group, "DELETE", [pending.id], delete_request=False)
+    assert response.status_code == 200
+    assert reload(Shift_swap, pending.id).new_owner_id is None
+
+    response = batch_swaps(client, group, "DELETE", [pending.id, done.id], delete_request=True)
+    assert response.status_code == 200
+    assert reload(Shift_swap, pending.id) is None
+    assert reload(Shift_swap, done.id) is None
+
+
+def test_batch_swaps_need_an_admin(client):
+    owner, holder, taker = make_user(), make_user(), make_user()
+    group = make_group(owner, members=[holder, taker])
+    swap = make_swap(make_shift(group, holder, START), new_owner=taker)
+    log_in(client, taker)
+
+    assert batch_swaps(client, group, "POST", [swap.id]).status_code == 401
+
+
+def request_memberships(group, users):
+    from models import db, GroupMembership
+
+    memberships = [GroupMembership(user_id=user.id, group_id=group.id, admin=False, approved=False)
+                   for user in users]
+    db.session.add_all(memberships)
+    db.session.commit()
+    return memberships
+
+
+def test_batch_membership_approve_and_decline(client):
+    from models import GroupMembership
+
+    owner = make_user()
+    group = make_group(owner)
+    applicants = [make_user() for _ in range(4)]
+    memberships = request_memberships(group, applicants)
+    log_in(client, owner)
+
+    response = client.post("/user/memberships/approve-join", json={
+        "membership_ids": [str(m.id) for m in memberships[:2]]})
+    assert response.status_code == 200
+    assert response.get_json()["updated"] == 2
+
+    # Already approved memberships are skipped, not declined
+    response = client.delete("/user/memberships/decline-join", json={
+        "membership_ids": [str(m.id) for m in memberships]})
+    assert response.status_code == 200
+    assert response.get_json()["updated"] == 2
+    assert all(reload(GroupMembership, m.id).approved for m in memberships[:2])
+    assert all(reload(GroupMembership, m.id) is None for m in memberships[2:])
+    assert any("declined" in m for m in notifications_for(applicants[3]))
+
+
+def test_batch_membership_needs_admin_rights_in_every_group(client):
+    owner, other_owner = make_user(), make_user()
+    mine, theirs = make_group(owner), make_group(other_owner)
+    applicant = make_user()
+    memberships = request_memberships(mine, [applicant]) + request_memberships(theirs, [applicant])
+    log_in(client, owner)
+
+    response = client.post("/user/memberships/approve-join", json={
+        "membership_ids": [str(m.id) for m in memberships]})
+
+    assert response.status_code == 401
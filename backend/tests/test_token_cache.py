@@ -0,0 +1,245 @@
+import threading
+
+import pytest
+import requests
+
+import token_cache as token_cache_module
+from token_cache import TokenValidationCache, CircuitBreaker, InvalidToken, ProviderUnavailable
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+class StubResponse:
+    def __init__(self, status_code, body=None, text=None):
+        self.status_code = status_code
+        self.body = body
+        self.text = text
+
+    def json(self):
+        if self.text is not None:
+            raise requests.JSONDecodeError("Expecting value", self.text, 0)
+        return self.body
+
+
+class StubProvider:
+    """Stands in for requests.get; answers with whatever `respond` returns."""
+
+    def __init__(self, respond=None):
+        self.respond = respond or (lambda token: StubResponse(200, {"sub": f"openid-{token}"}))
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, url, headers, timeout):
+        with self.lock:
+            self.calls += 1
+        token = headers["Authorization"].removeprefix("Bearer ")
+        return self.respond(token)
+
+
+def unreachable(token):
+    raise requests.ConnectionError("provider down")
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(token_cache_module.time, "monotonic", clock)
+    return clock
+
+
+def make_cache(provider, **kwargs):
+    options = dict(ttl=60, stale_ttl=240, failure_threshold=3, reset_timeout=30)
+    options.update(kwargs)
+    return TokenValidationCache(fetch=provider, **options)
+
+
+def settle(cache):
+    """Wait for background revalidations to finish."""
+    cache.executor.shutdown(wait=True)
+
+
+def test_fresh_entries_are_served_from_cache(clock):
+    provider = StubProvider()
+    cache = make_cache(provider)
+
+    assert cache.lookup("Google", "abc") == ("openid-abc", None)
+    clock.advance(59)
+    assert cache.lookup("Google", "abc") == ("openid-abc", None)
+
+    assert provider.calls == 1
+    assert cache.stats()["hits"] == 1
+
+
+def test_resolved_user_is_remembered(clock):
+    cache = make_cache(StubProvider())
+
+    openid, _ = cache.lookup("Google", "abc")
+    cache.remember_user("Google", "abc", openid, "user-1")
+
+    assert cache.lookup("Google", "abc") == ("openid-abc", "user-1")
+
+
+def test_stale_entries_are_served_while_revalidating(clock):
+    provider = StubProvider()
+    cache = make_cache(provider)
+    cache.lookup("Google", "abc")
+
+    clock.advance(120)
+    assert cache.lookup("Google", "abc") == ("openid-abc", None)
+    settle(cache)
+
+    assert provider.calls == 2
+    assert cache.stats()["stale_hits"] == 1
+    # Revalidation made the entry fresh again
+    clock.advance(30)
+    cache.lookup("Google", "abc")
+    assert provider.calls == 2
+
+
+def test_revalidation_drops_rejected_tokens(clock):
+    responses = iter([StubResponse(200, {"sub": "openid"}), StubResponse(401)])
+    cache = make_cache(StubProvider(lambda token: next(responses)))
+    cache.lookup("Google", "abc")
+
+    clock.advance(120)
+    cache.lookup("Google", "abc")
+    settle(cache)
+
+    assert cache.stats()["size"] == 0
+
+
+def test_expired_entries_are_validated_synchronously(clock):
+    provider = StubProvider()
+    cache = make_cache(provider)
+    cache.lookup("Google", "abc")
+
+    clock.advance(60 + 240)
+    cache.lookup("Google", "abc")
+
+    assert provider.calls == 2
+    assert cache.stats()["misses"] == 2
+
+
+def test_rejected_token_raises_and_is_not_cached(clock):
+    provider = StubProvider(lambda token: StubResponse(401))
+    cache = make_cache(provider)
+
+    with pytest.raises(InvalidToken):
+        cache.lookup("Google", "abc")
+    assert cache.stats()["size"] == 0
+    # A rejection is an answer, not a provider failure
+    assert not cache.breakers["Google"].is_open
+
+
+def test_non_json_success_is_a_provider_error(clock):
+    cache = make_cache(StubProvider(lambda token: StubResponse(200, text="<html>")))
+
+    with pytest.raises(ProviderUnavailable):
+        cache.lookup("Google", "abc")
+    assert cache.stats()["provider_errors"] == 1
+
+
+def test_success_without_openid_is_rejected(clock):
+    cache = make_cache(StubProvider(lambda token: StubResponse(200, ["not", "an", "object"])))
+
+    with pytest.raises(InvalidToken):
+        cache.lookup("Google", "abc")
+
+
+def test_expired_entry_is_served_while_provider_is_down(clock):
+    provider = StubProvider()
+    cache = make_cache(provider)
+    cache.lookup("Google", "abc")
+
+    provider.respond = unreachable
+    clock.advance(60 + 240)
+
+    assert cache.lookup("Google", "abc") == ("openid-abc", None)
+
+
+def test_breaker_opens_after_consecutive_failures(clock):
+    provider = StubProvider(unreachable)
+    cache = make_cache(provider)
+
+    for _ in range(3):
+        with pytest.raises(ProviderUnavailable):
+            cache.lookup("Google", "abc")
+    assert cache.breakers["Google"].is_open
+
+    with pytest.raises(ProviderUnavailable):
+        cache.lookup("Google", "abc")
+    assert provider.calls == 3
+    # Other providers are unaffected
+    assert not cache.breakers["Microsoft"].is_open
+
+
+def test_half_open_breaker_lets_one_trial_through(clock):
+    provider = StubProvider(unreachable)
+    cache = make_cache(provider)
+    for _ in range(3):
+        with pytest.raises(ProviderUnavailable):
+            cache.lookup("Google", "abc")
+
+    clock.advance(30)
+    provider.respond = StubProvider().respond
+
+    assert cache.lookup("Google", "abc") == ("openid-abc", None)
+    assert provider.calls == 4
+    assert not cache.breakers["Google"].is_open
+
+
+def test_failed_trial_reopens_the_breaker(clock):
+    provider = StubProvider(unreachable)
+    cache = make_cache(provider)
+    for _ in range(3):
+        with pytest.raises(ProviderUnavailable):
+            cache.lookup("Google", "abc")
+
+    clock.advance(30)
+    with pytest.raises(ProviderUnavailable):
+        cache.lookup("Google", "abc")
+    assert provider.calls == 4
+
+    # Open again for another full reset timeout
+    clock.advance(29)
+    with pytest.raises(ProviderUnavailable):
+        cache.lookup("Google", "abc")
+    assert provider.calls == 4
+
+
+def test_half_open_breaker_admits_a_single_caller(clock):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+    breaker.record_failure()
+
+    assert not breaker.allow_request()
+    clock.advance(30)
+    assert breaker.allow_request()
+    assert not breaker.allow_request()
+
+    breaker.record_success()
+    assert breaker.allow_request()
+
+
+def test_least_recently_used_entries_are_evicted(clock):
+    cache = make_cache(StubProvider(), max_entries=2)
+
+    cache.lookup("Google", "a")
+    cache.lookup("Google", "b")
+    cache.lookup("Google", "a")
+    cache.lookup("Google", "c")
+
+    assert cache.stats()["evictions"] == 1
+    calls = cache.fetch.calls
+    cache.lookup("Google", "a")
+    assert cache.fetch.calls == calls
+    cache.lookup("Google", "b")
+    assert cache.fetch.calls == calls + 1
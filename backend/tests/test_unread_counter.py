@@ -0,0 +1,140 @@
+"""
+The unread counters must equal count(*) of unread notifications after any
+mix of set-based writes, and reconcile must repair them when they don't.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+import random
+import threading
+import uuid
+
+from sqlalchemy import delete, insert, text, update
+
+from conftest import make_user, log_in
+
+
+def counters_match_counts():
+    """(user_id, counter, actual) for every user whose counter is wrong."""
+    from models import db
+
+    db.session.expire_all()
+    return db.session.execute(text("""
+        SELECT u.id, coalesce(c.unread, 0) AS counter,
+               (SELECT count(*) FROM notification_messages AS n
+                WHERE n.user_id = u.id AND NOT n.read) AS actual
+        FROM users AS u
+        LEFT JOIN notification_counters AS c ON c.user_id = u.id
+    """)).all()
+
+
+def drifted():
+    return [row for row in counters_match_counts() if row.counter != row.actual]
+
+
+def notification_rows(rng, users, count):
+    now = datetime.now()
+    return [
+        {"id": uuid.uuid4(), "user_id": rng.choice(users).id, "read": rng.random() < 0.3,
+         "message": "hello", "iat": now - timedelta(days=rng.randint(0, 60))}
+        for _ in range(count)
+    ]
+
+
+def test_counters_follow_bulk_reads_and_deletes(client):
+    from models import db, Notification_messages
+
+    rng = random.Random(0)
+    users = [make_user() for _ in range(4)]
+    rows = notification_rows(rng, users, 300)
+    db.session.execute(insert(Notification_messages), rows)
+    db.session.commit()
+    assert drifted() == []
+
+    user = users[0]
+    log_in(client, user)
+    mine = [row["id"] for row in rows if row["user_id"] == user.id]
+    response = client.post("/user/notifications/read", json={"ids": [str(i) for i in mine[:20]]})
+    assert response.status_code == 200
+    assert drifted() == []
+
+    # Unread notifications deleted across every user in one statement
+    db.session.execute(
+        delete(Notification_messages)
+        .where(Notification_messages.id.in_([row["id"] for row in rows[::3]]))
+        .execution_options(synchronize_session=False))
+    # And some read ones marked unread again
+    db.session.execute(
+        update(Notification_messages)
+        .where(Notification_messages.id.in_([row["id"] for row in rows[1::5]]))
+        .values(read=False)
+        .execution_options(synchronize_session=False))
+    db.session.commit()
+    assert drifted() == []
+
+    assert client.post("/user/notifications/read-all").status_code == 200
+    assert client.delete("/user/notifications/read?older_than_days=10").status_code == 200
+    assert drifted() == []
+    assert client.get("/user/notifications/unread-count").get_json()["unread_count"] == 0
+
+
+def test_reconcile_repairs_drifted_counters(app):
+    from models import db, Notification_messages
+    from unread_counter import reconcile_unread_counters
+
+    rng = random.Random(1)
+    users = [make_user() for _ in range(5)]
+    db.session.execute(insert(Notification_messages), notification_rows(rng, users, 200))
+    db.session.commit()
+
+    # Drift: counters changed behind the triggers' back, one removed entirely
+    with db.engine.begin() as conn:
+        conn.execute(text("UPDATE notification_counters SET unread = unread + 7 WHERE user_id = :a"),
+                     {"a": users[0].id})
+        conn.execute(text("UPDATE notification_counters SET unread = 0 WHERE user_id = :b"),
+                     {"b": users[1].id})
+        conn.execute(text("DELETE FROM notification_counters WHERE user_id = :c"),
+                     {"c": users[2].id})
+    assert len(drifted()) == 3
+
+    with db.engine.connect() as conn:
+        # Small batches, so more than one transaction is exercised
+        repaired = reconcile_unread_counters(conn, batch_size=2)
+
+    assert repaired == 3
+    assert drifted() == []
+
+
+def test_concurrent_bulk_writes_over_the_same_users(app):
+    from models import db, Notification_messages
+
+    users = [make_user() for _ in range(20)]
+    writers = 6
+    barrier = threading.Barrier(writers)
+
+    def write(seed):
+        rng = random.Random(seed)
+        # Each writer walks the users in its own order
+        order = users[::-1] if seed % 2 else users
+        rows = [{"id": uuid.uuid4(), "user_id": user.id, "read": False, "message": "hi",
+                 "iat": datetime.now()} for user in order for _ in range(rng.randint(1, 3))]
+        with db.engine.connect() as conn:
+            barrier.wait()
+            for _ in range(5):
+                conn.execute(insert(Notification_messages), rows)
+                conn.execute(
+                    update(Notification_messages)
+                    .where(Notification_messages.id.in_([row["id"] for row in rows[::2]]))
+                    .values(read=True))
+                conn.execute(
+                    delete(Notification_messages)
+                    .where(Notification_messages.id.in_([row["id"] for row in rows])))
+                conn.commit()
+                for row in rows:
+                    row["id"] = uuid.uuid4()
+
+    # A deadlock would surface as an exception from one of the writers
+    with ThreadPoolExecutor(writers) as pool:
+        list(pool.map(write, range(writers)))
+
+    assert drifted() == []
@@ -0,0 +1,276 @@
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import threading
+import time
+import os
+import requests
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Userinfo endpoints used to validate OAuth access tokens, and the field of
+# the response that holds the provider's openid for the user
+PROVIDERS = {
+    "Google": ("https://openidconnect.googleapis.com/v1/userinfo", "sub"),
+    "Microsoft": ("https://graph.microsoft.com/v1.0/me", "id"),
+}
+
+
+class ProviderUnavailable(Exception):
+    """Raised when a provider cannot be reached and nothing usable is cached."""
+
+
+class InvalidToken(Exception):
+    """Raised when a provider rejects the access token."""
+
+
+class CircuitBreaker:
+    """
+    Stops calling a provider after `failure_threshold` consecutive failures
+    and lets a single trial request through once `reset_timeout` has passed.
+    """
+
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+        self.lock = threading.Lock()
+
+    def allow_request(self):
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                return False
+            # Half-open: only one caller gets to probe the provider
+            if self.trial_in_flight:
+                return False
+            self.trial_in_flight = True
+            return True
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_in_flight = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.trial_in_flight = False
+            if self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None
+
+
+class _Entry:
+    __slots__ = ("openid", "user_id", "validated_at", "revalidating")
+
+    def __init__(self, openid, user_id, validated_at):
+        self.openid = openid
+        self.user_id = user_id
+        self.validated_at = validated_at
+        self.revalidating = False
+
+
+class TokenValidationCache:
+    """
+    Caches the result of validating an OAuth access token against its
+    provider, keyed by a hash of the token so raw tokens are never held.
+
+    Entries younger than `ttl` are served directly. Entries younger than
+    `ttl + stale_ttl` are served while a background thread revalidates them.
+    Older entries are validated synchronously, unless the provider's circuit
+    breaker is open, in which case any cached entry is served as-is.
+    """
+
+    def __init__(self, ttl=60, stale_ttl=240, max_entries=10000, timeout=3.0,
+                 failure_threshold=5, reset_timeout=30, fetch=None):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self.fetch = fetch or requests.get
+        self.breakers = {
+            auth_type: CircuitBreaker(failure_threshold, reset_timeout)
+            for auth_type in PROVIDERS
+        }
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(
+            max_workers=2, thread_name_prefix="token-revalidate")
+
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.provider_errors = 0
+
+    @staticmethod
+    def key_for(auth_type, access_token):
+        return hashlib.sha256(f"{auth_type}:{access_token}".encode("UTF-8")).hexdigest()
+
+    def stats(self):
+        with self.lock:
+            return {
+                "size": len(self.entries),
+                "hits": self.hits,
+                "stale_hits": self.stale_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "provider_errors": self.provider_errors,
+                "open_circuits": [name for name, breaker in self.breakers.items() if breaker.is_open],
+            }
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def invalidate(self, auth_type, access_token):
+        with self.lock:
+            self.entries.pop(self.key_for(auth_type, access_token), None)
+
+    def lookup(self, auth_type, access_token):
+        """
+        Return `(openid, user_id)` for the token. `user_id` is None when the
+        token was validated but the user has not been resolved yet.
+
+        Raises InvalidToken or ProviderUnavailable.
+        """
+        key = self.key_for(auth_type, access_token)
+        now = time.monotonic()
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                age = now - entry.validated_at
+                if age < self.ttl:
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return entry.openid, entry.user_id
+                if age < self.ttl + self.stale_ttl:
+                    self.entries.move_to_end(key)
+                    self.stale_hits += 1
+                    if not entry.revalidating:
+                        entry.revalidating = True
+                        self.executor.submit(
+                            self._revalidate, key, auth_type, access_token)
+                    return entry.openid, entry.user_id
+            self.misses += 1
+
+        try:
+            openid = self._validate(auth_type, access_token)
+        except ProviderUnavailable:
+            # Better to let a recently valid token through than to lock
+            # every OAuth user out while the provider is down
+            if entry is not None:
+                return entry.openid, entry.user_id
+            raise
+        except InvalidToken:
+            self.invalidate(auth_type, access_token)
+            raise
+
+        user_id = entry.user_id if entry is not None and entry.openid == openid else None
+        self._store(key, openid, user_id)
+        return openid, user_id
+
+    def remember_user(self, auth_type, access_token, openid, user_id):
+        """Attach the resolved `User.id` to an already validated token."""
+        key = self.key_for(auth_type, access_token)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry.openid == openid:
+                entry.user_id = user_id
+
+    def _store(self, key, openid, user_id):
+        with self.lock:
+            self.entries[key] = _Entry(openid, user_id, time.monotonic())
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def _revalidate(self, key, auth_type, access_token):
+        try:
+            openid = self._validate(auth_type, access_token)
+        except InvalidToken:
+            with self.lock:
+                self.entries.pop(key, None)
+            return
+        except ProviderUnavailable:
+            with self.lock:
+                entry = self.entries.get(key)
+                if entry is not None:
+                    entry.revalidating = False
+            return
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return
+            if entry.openid != openid:
+                entry.user_id = None
+            entry.openid = openid
+            entry.validated_at = time.monotonic()
+            entry.revalidating = False
+
+    def _validate(self, auth_type, access_token):
+        url, openid_field = PROVIDERS[auth_type]
+        breaker = self.breakers[auth_type]
+
+        if not breaker.allow_request():
+            raise ProviderUnavailable(f"{auth_type} circuit is open")
+
+        try:
+            response = self.fetch(
+                url,
+                headers={'Authorization': f'Bearer {access_token}'},
+                timeout=self.timeout
+            )
+        except requests.RequestException as e:
+            self._provider_failed(breaker)
+            raise ProviderUnavailable(str(e))
+
+        if response.status_code == 200:
+            try:
+                body = response.json()
+            except ValueError:
+                # A 200 that isn't JSON means the provider is misbehaving,
+                # not that the token is bad
+                self._provider_failed(breaker)
+                raise ProviderUnavailable(f"{auth_type} returned an unreadable response")
+            breaker.record_success()
+            openid = body.get(openid_field) if isinstance(body, dict) else None
+            if openid is None:
+                raise InvalidToken("Provider response did not include an openid")
+            return openid
+
+        if response.status_code >= 500 or response.status_code == 429:
+            self._provider_failed(breaker)
+            raise ProviderUnavailable(
+                f"{auth_type} responded with {response.status_code}")
+
+        # The provider answered and rejected the token
+        breaker.record_success()
+        raise InvalidToken(f"{auth_type} responded with {response.status_code}")
+
+    def _provider_failed(self, breaker):
+        breaker.record_failure()
+        with self.lock:
+            self.provider_errors += 1
+
+
+token_cache = TokenValidationCache(
+    ttl=int(os.getenv("TOKEN_CACHE_TTL", 60)),
+    stale_ttl=int(os.getenv("TOKEN_CACHE_STALE_TTL", 240)),
+    max_entries=int(os.getenv("TOKEN_CACHE_MAX_ENTRIES", 10000)),
+    timeout=float(os.getenv("TOKEN_PROVIDER_TIMEOUT", 3.0)),
+    failure_threshold=int(os.getenv("TOKEN_PROVIDER_FAILURE_THRESHOLD", 5)),
+    reset_timeout=int(os.getenv("TOKEN_PROVIDER_RESET_TIMEOUT", 30)),
+)
@@ -0,0 +1,65 @@
+from sqlalchemy import text
+from models import db, Notification_counter
+
+
+def unread_count_subquery(user_id):
+    """Scalar subquery for a user's unread count, 0 if no counter row exists yet."""
+    return db.func.coalesce(
+        db.select(Notification_counter.unread)
+        .where(Notification_counter.user_id == user_id)
+        .scalar_subquery(),
+        0
+    )
+
+
+def get_unread_count(user_id):
+    return db.session.execute(db.select(unread_count_subquery(user_id))).scalar()
+
+
+def reconcile_unread_counters(connection, batch_size=1000):
+    """
+    Recount unread notifications and repair any counter that has drifted.
+    Users are processed in batches of `batch_size`, one transaction each.
+
+    Each batch locks its counter rows before counting. A concurrent insert
+    either blocks on that lock and applies its increment after our
+    corrected value, or committed first and is included in the recount.
+
+    Returns the number of counters that were inserted or corrected.
+    """
+    repaired = 0
+    last_user_id = None
+
+    while True:
+        with connection.begin():
+            user_ids = connection.execute(text("""
+                SELECT id FROM users
+                WHERE (CAST(:last_user_id AS uuid) IS NULL OR id > CAST(:last_user_id AS uuid))
+                ORDER BY id
+                LIMIT :batch_size
+            """), {"last_user_id": last_user_id, "batch_size": batch_size}).scalars().all()
+
+            if not user_ids:
+                return repaired
+
+            connection.execute(text("""
+                SELECT user_id FROM notification_counters
+                WHERE user_id = ANY(:user_ids)
+                ORDER BY user_id
+                FOR UPDATE
+            """), {"user_ids": user_ids})
+
+            result = connection.execute(text("""
+                INSERT INTO notification_counters (user_id, unread)
+                SELECT u.id, count(n.id) FILTER (WHERE NOT n.read)
+                FROM users AS u
+                LEFT JOIN notification_messages AS n ON n.user_id = u.id
+                WHERE u.id = ANY(:user_ids)
+                GROUP BY u.id
+                ON CONFLICT (user_id) DO UPDATE
+                SET unread = EXCLUDED.unread
+                WHERE notification_counters.unread <> EXCLUDED.unread
+            """), {"user_ids": user_ids})
+            repaired += result.rowcount
+
+        last_user_id = str(user_ids[-1])
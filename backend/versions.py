@@ -0,0 +1,90 @@
+"""
+Conditional GET on top of the `resource_versions` counters.
+
+A view's ETag is derived from the version of the group or user it shows,
+the caller and the request path with its query string, so it changes
+whenever anything the view reads is changed. Checking it costs one primary
+key lookup instead of rebuilding the response.
+
+The version is read before the body. If a change commits in between, the
+body is newer than its ETag, which at worst makes the next request
+download it again.
+"""
+
+import hashlib
+from flask import request, Response
+from sqlalchemy import and_
+from models import db, Resource_version, GroupMembership
+
+
+def version_subquery(kind, resource_id):
+    """Scalar subquery for a counter, 0 if it was never bumped."""
+    return db.func.coalesce(
+        db.select(Resource_version.version)
+        .where(
+            Resource_version.kind == kind,
+            Resource_version.resource_id == resource_id
+        )
+        .scalar_subquery(),
+        0
+    )
+
+
+def members_version_subquery(group_id):
+    """
+    Scalar subquery summing the user versions of a group's approved members,
+    for responses that depend on what the members do in other groups.
+    Counters only go up, and joining or leaving bumps the group's own
+    version, so the sum moves whenever any member's version does.
+    """
+    return db.func.coalesce(
+        db.select(db.func.sum(Resource_version.version))
+        .join(GroupMembership, and_(
+            GroupMembership.user_id == Resource_version.resource_id,
+            Resource_version.kind == 'user'
+        ))
+        .where(GroupMembership.group_id == group_id, GroupMembership.approved == True)
+        .scalar_subquery(),
+        0
+    )
+
+
+def get_version(kind, resource_id):
+    return db.session.execute(db.select(version_subquery(kind, resource_id))).scalar()
+
+
+def get_versions(kind, resource_ids):
+    """{resource id: version} for several resources in one query."""
+    versions = dict.fromkeys(resource_ids, 0)
+    if versions:
+        versions.update(db.session.execute(
+            db.select(Resource_version.resource_id, Resource_version.version)
+            .where(
+                Resource_version.kind == kind,
+                Resource_version.resource_id.in_(list(versions))
+            )
+        ).all())
+    return versions
+
+
+def make_etag(kind, resource_id, version, *parts):
+    """`parts` are whatever else the response depends on, such as the caller."""
+    key = ":".join(str(part) for part in (
+        kind, resource_id, version, *parts, request.full_path))
+    return hashlib.sha256(key.encode('UTF-8')).hexdigest()[:32]
+
+
+def not_modified(etag):
+    """A 304 response if the client already holds `etag`, otherwise None."""
+    # If-None-Match uses weak comparison; compressed responses carry a weak
+    # version of the tag (see compression.py)
+    if request.if_none_match.contains_weak(etag):
+        return tag(Response(status=304), etag)
+    return None
+
+
+def tag(response, etag):
+    response.set_etag(etag)
+    # Cache, but revalidate on every use
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
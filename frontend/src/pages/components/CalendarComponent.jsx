@@ -1,6 +1,6 @@
 // components/CalendarComponent.jsx
 
-import React, { useState } from 'react';
+import React, { useState, useEffect } from 'react';
 import { Calendar, momentLocalizer, Views } from 'react-big-calendar';
 import moment from 'moment';
 import 'react-big-calendar/lib/css/react-big-calendar.css';
@@ -39,8 +39,14 @@ export function CalendarComponent({
     userRole = '',
     groupId = '',
     getGroupData = () => { },
+    onDateChange = () => { },
 }) {
     const [currentDate, setCurrentDate] = useState(new Date());
+
+    // Let the parent load the schedule window around the visible date
+    useEffect(() => {
+        onDateChange(currentDate);
+    }, [currentDate]);
     const [showDayPreview, setShowDayPreview] = useState(null);
     const [showNewShiftForm, setShowNewShiftForm] = useState(false);
     const [selectedShift, setSelectedShift] = useState(null);
@@ -1,5 +1,6 @@
 // components/GroupSchedule.jsx
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
+import { startOfMonth, endOfMonth, subDays, addDays } from 'date-fns';
 import { SideMenu } from './SideMenu';
 import { GroupSidebar } from './GroupSidebar';
 import { CalendarComponent } from './CalendarComponent';
@@ -12,6 +13,9 @@ export function GroupSchedule({ selectedGroup, handleSelectGroup, user }) {
     });
     const [showMenu, setShowMenu] = useState(true);
     const [groupData, setGroupData] = useState(null);
+    const [shifts, setShifts] = useState([]);
+    const [visibleDate, setVisibleDate] = useState(new Date());
+    const visibleDateRef = useRef(visibleDate);
 
     // Initialize the selected employee to the user
     const [selectedEmployee, setSelectedEmployee] = useState(user);
@@ -32,6 +36,37 @@ export function GroupSchedule({ selectedGroup, handleSelectGroup, user }) {
         }
         const data = await res.json();
         setGroupData(data);
+        await getSchedule(visibleDateRef.current);
+    };
+
+    // Fetch every shift in a window around the month being viewed, which
+    // covers the day, week and month views
+    const getSchedule = async (date) => {
+        const from = subDays(startOfMonth(date), 7).toISOString();
+        const to = addDays(endOfMonth(date), 7).toISOString();
+        const loaded = [];
+        let cursor = null;
+        do {
+            const params = new URLSearchParams({ from, to });
+            if (cursor) params.set('cursor', cursor);
+            const res = await fetch(
+                `${backendURL}/user/groups/${selectedGroup.id}/schedule?${params}`,
+                { method: 'GET', credentials: 'include' }
+            );
+            if (!res.ok) return;
+            const page = await res.json();
+            loaded.push(...page.shifts);
+            cursor = page.next_cursor;
+        } while (cursor);
+        // Ignore responses for a date the user has already navigated away from
+        if (date === visibleDateRef.current) {
+            setShifts(loaded);
+        }
+    };
+
+    const handleDateChange = (date) => {
+        visibleDateRef.current = date;
+        setVisibleDate(date);
     };
 
     useEffect(() => {
@@ -40,6 +75,10 @@ export function GroupSchedule({ selectedGroup, handleSelectGroup, user }) {
         return () => clearInterval(intervalId);
     }, []);
 
+    useEffect(() => {
+        getSchedule(visibleDate);
+    }, [visibleDate]);
+
     // const myEmployees = employees.filter(member =>
     //     !membershipRequests.some(request => request.user_id === member.id))
 
@@ -52,8 +91,8 @@ export function GroupSchedule({ selectedGroup, handleSelectGroup, user }) {
     // If personView === 'I', filter out shifts that don't belong to selectedEmployee
     const effectiveShifts =
         viewMode.personView === 'I'
-            ? groupData.shifts.filter((shift) => shift.user_id === selectedEmployee?.id)
-            : groupData.shifts;
+            ? shifts.filter((shift) => shift.user_id === selectedEmployee?.id)
+            : shifts;
 
     return (
         <div className="flex h-full w-full">
@@ -93,6 +132,7 @@ export function GroupSchedule({ selectedGroup, handleSelectGroup, user }) {
                     userRole={groupData.role}
                     groupId={groupData.id}
                     getGroupData={getGroupData}
+                    onDateChange={handleDateChange}
                     isAdmin={groupData.role === 'owner' || groupData.role === 'admin'}
                     membershipRequests={groupData.membership_requests}
                 />